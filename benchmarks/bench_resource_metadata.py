@@ -0,0 +1,45 @@
+# Copyright (C)  Authors and contributors All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+Measures ChassisResourceList per request construction cost. The uncached run clears the metadata cache before each
+instantiation which reproduces building schemas and introspecting columns on every request.
+
+Usage::
+
+    python -m benchmarks.bench_resource_metadata
+"""
+import timeit
+
+from flask_resource_chassis.metadata import clear_metadata_cache
+from tests import TestApiList
+
+ITERATIONS = 2000
+
+
+def uncached():
+    clear_metadata_cache()
+    TestApiList()
+
+
+def cached():
+    TestApiList()
+
+
+if __name__ == '__main__':
+    before = timeit.timeit(uncached, number=ITERATIONS) / ITERATIONS
+    after = timeit.timeit(cached, number=ITERATIONS) / ITERATIONS
+    print(f"ChassisResourceList.__init__ uncached: {before * 1e6:.1f}us per request")
+    print(f"ChassisResourceList.__init__ cached:   {after * 1e6:.1f}us per request")
+    print(f"Speedup: {before / after:.1f}x")
@@ -0,0 +1,92 @@
+# Copyright (C)  Authors and contributors All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""
+Compares the default LikeSearchBackend scan of all columns against SqliteFtsSearchBackend on a generated SQLite
+fixture(1M rows by default).
+
+Usage::
+
+    BENCH_ROWS=1000000 python -m benchmarks.bench_search
+"""
+import os
+import random
+import time
+
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+
+from flask_resource_chassis.introspection import get_model_metadata
+from flask_resource_chassis.search import LikeSearchBackend, SqliteFtsSearchBackend
+
+ROWS = int(os.environ.get("BENCH_ROWS", 1000000))
+WORDS = ["amani", "baraka", "chege", "dalia", "imani", "jabari", "kamau", "neema", "otieno", "wanjiru", "zawadi"]
+
+app = Flask(__name__)
+app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+db = SQLAlchemy(app)
+
+
+class Person(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    full_name = db.Column(db.String(254), nullable=False)
+    national_id = db.Column(db.String)
+    age = db.Column(db.Integer)
+
+
+def load_fixture():
+    db.create_all()
+    random.seed(1)
+    batch = []
+    for i in range(ROWS):
+        batch.append({"full_name": " ".join(random.sample(WORDS, 2)) + f" {i}", "national_id": f"ID{i:09d}",
+                      "age": i % 90})
+        if len(batch) == 10000:
+            db.session.execute(Person.__table__.insert(), batch)
+            batch = []
+    if batch:
+        db.session.execute(Person.__table__.insert(), batch)
+    db.session.commit()
+
+
+def run(backend, term, columns, repeat=5):
+    metadata = get_model_metadata(Person)
+    started = time.perf_counter()
+    for i in range(repeat):
+        query, ordering = backend.search(Person.query, metadata, columns, term)
+        if ordering is not None:
+            query = query.order_by(ordering)
+        query.limit(10).all()
+        query.order_by(None).count()
+    return (time.perf_counter() - started) / repeat
+
+
+if __name__ == '__main__':
+    started = time.perf_counter()
+    load_fixture()
+    print(f"Loaded {ROWS} rows in {time.perf_counter() - started:.1f}s")
+    fts = SqliteFtsSearchBackend()
+    search_columns = [Person.__table__.c.full_name, Person.__table__.c.national_id]
+    started = time.perf_counter()
+    fts.create_fts_table(db.engine, get_model_metadata(Person), search_columns)
+    print(f"Built FTS5 index in {time.perf_counter() - started:.1f}s")
+    like_backend = LikeSearchBackend()
+    # Reference is the default LIKE search of all columns used by resources without search_fields
+    like_columns = like_backend.get_default_columns(get_model_metadata(Person))
+    for term in ("ID000012345", "zawadi 4242"):
+        like = run(like_backend, term, like_columns)
+        ranked = run(fts, term, search_columns)
+        print(f"q={term!r}: LIKE {like * 1000:.1f}ms, FTS5 {ranked * 1000:.1f}ms per page and count "
+              f"({like / ranked:.1f}x)")
@@ -1,15 +1,30 @@
+import functools
 import inspect
 
+from flask import request, jsonify, make_response, Response, stream_with_context
 from flask_apispec import use_kwargs, marshal_with, doc, MethodResource, Ref
-from marshmallow import Schema, fields
-from sqlalchemy import desc, asc, not_, or_, and_
+from marshmallow import Schema, ValidationError as MarshmallowValidationError
+from sqlalchemy import desc, asc, not_, or_, and_, exists, tuple_
 
 from .exceptions import ConflictError, ValidationError
-from .schemas import ResponseWrapper, DjangoPageSchema, error_response, val_error_response
-from .services import ChassisService, LoggerService, get_primary_key
+from .export import EXPORT_MIMETYPES, CSV_EXPORT, stream_csv, stream_ndjson
+from .introspection import get_model_metadata
+from .metadata import get_resource_metadata
+from .pagination import PAGE_PAGINATION, CURSOR_PAGINATION, EXACT_COUNT, paginate_keyset, paginate_offset, \
+    count_records, get_total_pages
+from .schemas import ResponseWrapper, error_response, val_error_response
+from .search import SearchBackend, LikeSearchBackend
+from .services import LoggerService, create_audit_event
 from .utils import CustomResourceProtector
 
 
+default_search_backend = LikeSearchBackend()
+
+# Bulk creation modes
+ALL_OR_NOTHING = "all-or-nothing"
+PARTIAL = "partial"
+
+
 class Scope:
 
     def __init__(self, scopes=None, operator=None):
@@ -19,7 +34,8 @@ class Scope:
 
 def authenticate(resource_protector, scope=None, permissions=None):
     """
-    Used to authenticate request using CustomResourceProtector
+    Used to authenticate request using CustomResourceProtector. The token is validated once per request, subsequent
+    calls only check scope and permissions
 
     :param resource_protector: CustomResourceProtector
     :param scope: Scope with scopes string and operator (And/Or)::
@@ -29,13 +45,22 @@ def authenticate(resource_protector, scope=None, permissions=None):
     :param permissions: A list of permission tags
     """
     scope_ = scope.scopes if scope else None
+    if isinstance(scope_, list):
+        scope_ = tuple(scope_)
     operator = scope.operator if scope and scope.operator else "AND"
+    return _get_authenticator(resource_protector, scope_, operator, tuple(permissions) if permissions else None)()
+
 
-    @resource_protector(scope=scope_, operator=operator, has_any_authority=permissions)
+@functools.lru_cache(maxsize=1024)
+def _get_authenticator(resource_protector, scope, operator, permissions):
+    """
+    Builds authentication function. Functions are cached per resource protector, scope, operator and permissions
+    """
+    @resource_protector(scope=scope, operator=operator, has_any_authority=permissions)
     def authenticate_(*args, **kwargs):
         return args[0]
 
-    return authenticate_()
+    return authenticate_
 
 
 def validate_foreign_keys(model, db):
@@ -44,63 +69,148 @@ def validate_foreign_keys(model, db):
     1. Checks of foreign key exists
     2. If foreign key entity has field is_active checks if the entity is active
 
+    Foreign keys are validated using a single query per referred table selecting only the key and is_active columns.
+
     :throws ValidationError: If validation fails
     """
-    entity_table = getattr(model, "__table__")
-    for column in entity_table.c:
-        # print("Person column", column, column.name, column.foreign_keys)
-        if column.foreign_keys:
-            for key in column.foreign_keys:
-                # print(f"Details", key, key.column.name, key.constraint)
-                payload = getattr(model, "__dict__")
-                if column.name in payload:
-                    filters = {
-                        "is_deleted": False,
-                        key.column.name: payload.get(column.name)
-                    }
-                    fk_model = db.session.query(key.constraint.referred_table).filter_by(**filters).first()
-                    if fk_model is None:
-                        if column.doc:
-                            raise ValidationError(f"Sorry {column.doc} doesn't exist")
-                        else:
-                            raise ValidationError(f"Associated entity({key.constraint.referred_table}) doesn't exist")
-                    elif hasattr(fk_model, "is_active") and not getattr(fk_model, "is_active"):
-                        if column.doc:
-                            raise ValidationError(f"Sorry {column.doc} is not active")
-                        else:
-                            raise ValidationError(f"Associated entity({key.constraint.referred_table}) is not active")
+    error = get_foreign_key_errors([model], db)[0]
+    if error:
+        raise ValidationError(error)
+
+
+def get_foreign_key_errors(models, db):
+    """
+    Validates foreign keys of multiple models using a single query per referred table
+
+    :param models: A list of SQLAlchemy ORM models of the same type
+    :param db: SQLAlchemy database instance
+    :return: A list with an error message or None for each model
+    """
+    if not models:
+        return []
+    foreign_keys = get_model_metadata(models[0]).foreign_keys
+    payloads = [getattr(model, "__dict__") for model in models]
+    # Group payload values by referred table and column
+    referred_values = {}
+    for column, referred_column, referred_table in foreign_keys:
+        for payload in payloads:
+            if column.name in payload:
+                referred_values.setdefault(referred_table, {}).setdefault(referred_column, set()) \
+                    .add(payload.get(column.name))
+    # Maps (referred column, key value) to the referred entity is_active value
+    existing = {}
+    for referred_table, values in referred_values.items():
+        referred_columns = list(values)
+        active_column = referred_table.c.get("is_active")
+        columns = referred_columns if active_column is None else referred_columns + [active_column]
+        query = db.session.query(*columns).filter(or_(*[column.in_(keys) for column, keys in values.items()]))
+        if "is_deleted" in referred_table.c:
+            query = query.filter(referred_table.c.is_deleted == False)  # noqa: E712
+        for row in query:
+            is_active = True if active_column is None else row[-1]
+            for i, referred_column in enumerate(referred_columns):
+                existing[(referred_column, str(row[i]))] = is_active
+    errors = []
+    for payload in payloads:
+        errors.append(None)
+        for column, referred_column, referred_table in foreign_keys:
+            if column.name not in payload:
+                continue
+            is_active = existing.get((referred_column, str(payload.get(column.name))))
+            if is_active is None:
+                if column.doc:
+                    errors[-1] = f"Sorry {column.doc} doesn't exist"
+                else:
+                    errors[-1] = f"Associated entity({referred_table}) doesn't exist"
+                break
+            elif not is_active:
+                if column.doc:
+                    errors[-1] = f"Sorry {column.doc} is not active"
+                else:
+                    errors[-1] = f"Associated entity({referred_table}) is not active"
+                break
+    return errors
 
 
 def validate_unique_constraints(model, db, model_id=None):
     """
-    Validates unique constraints ignoring records flagged as deleted
+    Validates unique constraints ignoring records flagged as deleted. All unique indexes are checked in a single query
+    with an EXISTS clause per index hence no rows are loaded.
 
     :param model: SQLAlchemy ORM Model
     :param db: SQLAlchemy database instance
     :param model_id: If id is provided unique constraints are checked against other records exclude record with the
     provided id
-    :throws ValidationError: If unique constraints check fails
+    :throws ValidationError: If unique constraints check fails. Error details contain the violated index names
     """
-    entity_table = getattr(model, "__table__")
-    for index in entity_table.indexes:
-        if index.unique:
-            filters = {
-                "is_deleted": False
-            }
-            for column in index.columns:
-                if column.name in model.__dict__:
-                    filters[column.name] = model.__dict__[column.name]
-            if len(filters) == 1:
+    metadata = get_model_metadata(model)
+    payload = model.__dict__
+    common_filters = []
+    if metadata.soft_delete:
+        common_filters.append(metadata.table.c.is_deleted == False)  # noqa: E712
+    if model_id:
+        common_filters.append(not_(metadata.primary_key == model_id))
+    checks = []
+    for index in metadata.unique_indexes:
+        filters = [column == payload[column.name] for column in index.columns if column.name in payload]
+        if filters:
+            checks.append((index.name, exists().where(and_(*filters, *common_filters))))
+    if not checks:
+        return
+    result = db.session.query(*[check for name, check in checks]).one()
+    collisions = [name for (name, check), collided in zip(checks, result) if collided]
+    if collisions:
+        raise ValidationError("Similar record already exists", collisions)
+
+
+def get_unique_collisions(models, db, model_ids=None):
+    """
+    Checks unique indexes of multiple models using a single query per unique index. Models colliding with an earlier
+    model in the same list are reported as duplicates.
+
+    :param models: A list of SQLAlchemy ORM models of the same type
+    :param db: SQLAlchemy database instance
+    :param model_ids: Optional primary key values of updated models. A model doesn't collide with its own record
+    :return: A list with a tuple of error message and violated index names or None for each model
+    """
+    if not models:
+        return []
+    metadata = get_model_metadata(models[0])
+    payloads = [model.__dict__ for model in models]
+    collisions = [None] * len(models)
+    for index in metadata.unique_indexes:
+        keys = [tuple(payload.get(column.name) for column in index.columns) for payload in payloads]
+        # NULL values never collide
+        values = {key for key in keys if None not in key}
+        if not values:
+            continue
+        if len(index.columns) == 1:
+            query = db.session.query(index.columns[0]).filter(index.columns[0].in_([key[0] for key in values]))
+        else:
+            query = db.session.query(*index.columns).filter(tuple_(*index.columns).in_(list(values)))
+        if metadata.soft_delete:
+            query = query.filter(metadata.table.c.is_deleted == False)  # noqa: E712
+        # Maps existing unique values to the records primary keys
+        existing = {}
+        for row in query.add_columns(metadata.primary_key):
+            existing.setdefault(tuple(str(value) for value in row[:-1]), set()).add(str(row[-1]))
+        seen = set()
+        for i, key in enumerate(keys):
+            if None in key:
+                continue
+            key = tuple(str(value) for value in key)
+            if existing.get(key, set()) - ({str(model_ids[i])} if model_ids else set()):
+                message = "Similar record already exists"
+            elif key in seen:
+                message = "Duplicate record in request"
+            else:
+                seen.add(key)
                 continue
-            if model_id:
-                pk_col = get_primary_key(model)
-                query = db.session.query(entity_table).filter_by(**filters)
-                query = query.filter(not_(pk_col == model_id))
-                unique_model = query.first()
+            if collisions[i] is None:
+                collisions[i] = (message, [index.name])
             else:
-                unique_model = db.session.query(entity_table).filter_by(**filters).first()
-            if unique_model:
-                raise ValidationError("Similar record already exists")
+                collisions[i][1].append(index.name)
+    return collisions
 
 
 @marshal_with(ResponseWrapper, code=400, description="Validation errors")
@@ -112,15 +222,36 @@ class ChassisResourceList(MethodResource):
 
     def __init__(self, app, db, schema, record_name=None, logger_service: LoggerService = None,
                  resource_protector: CustomResourceProtector = None, create_scope: Scope = None,
-                 fetch_scope: Scope = None, create_permissions=None, fetch_permissions=None):
+                 fetch_scope: Scope = None, create_permissions=None, fetch_permissions=None,
+                 optimistic_unique=False, pagination=PAGE_PAGINATION, count_mode=EXACT_COUNT,
+                 search_backend: SearchBackend = None, search_fields=None, bulk_max_size=1000,
+                 bulk_mode=ALL_OR_NOTHING, update_scope: Scope = None, delete_scope: Scope = None,
+                 update_permissions=None, delete_permissions=None, export_batch_size=1000):
         """
 
         :param app: Flask application reference
         :param db: Flask SQLAlchemy reference
         :param schema: Current model Marshmallow Schema with model reference
+        :param optimistic_unique: If True unique constraints aren't checked before insert instead database unique
+        index violations are reported as validation errors
+        :param pagination: Listing pagination. Either "page" for page number pagination or "cursor" for keyset
+        pagination where responses have next and previous cursors
+        :param count_mode: Default listing records count mode. "exact" counts all matching records, "estimate" uses
+        PostgreSQL planner estimates(exact count on other databases) and "none" skips counting
+        :param search_backend: q param search backend. Defaults to LikeSearchBackend
+        :param search_fields: Searchable column names. Defaults to search_backend default columns i.e. all columns for
+        LikeSearchBackend and text columns for the other backends
+        :param bulk_max_size: Maximum records per bulk request. Bulk creation is enabled using BulkCreateMixin
+        :param bulk_mode: Default bulk creation mode. "all-or-nothing" creates records only if all records are valid
+        while "partial" creates the valid records
+        :param update_scope: Bulk update scopes. Bulk update is enabled using BulkUpdateMixin
+        :param delete_scope: Bulk delete scopes. Bulk delete is enabled using BulkDeleteMixin
+        :param export_batch_size: Records fetched and serialized per batch when exporting records using the format
+        parameter or Accept header
         """
         self.app = app
-        self.service = ChassisService(app, db, schema.Meta.model)
+        self.metadata = get_resource_metadata(schema)
+        self.service = self.metadata.get_service(app, db)
         self.db = db
         if record_name is None:
             self.record_name = "Resource"
@@ -128,37 +259,110 @@ class ChassisResourceList(MethodResource):
             self.record_name = record_name
 
         self.schema = schema
-
-        # class ResponseSchema(ResponseWrapper):
-        #     data = fields.Nested(schema)
-
-        class RecordPageSchema(DjangoPageSchema):
-            results = fields.List(fields.Nested(schema))
-
-        # self.response_schema = ResponseSchema()
-        self.page_response_schema = RecordPageSchema()
+        self.page_response_schema = self.metadata.page_response_schema
         self.logger_service = logger_service
         self.resource_protector = resource_protector
         self.create_scopes = create_scope
         self.fetch_scopes = fetch_scope
         self.create_permissions = create_permissions
         self.fetch_permissions = fetch_permissions
-        # Fetch schema fields
-        fetch_fields = dict(page_size=fields.Int(required=False), page=fields.Int(required=False),
-                            ordering=fields.Str(required=False), q=fields.Str(required=False))
-        if hasattr(self.schema.Meta.model, "created_at"):
-            fetch_fields["created_after"] = fields.Date(required=False)
-            fetch_fields["created_before"] = fields.Date(required=False)
-        if hasattr(self.schema.Meta.model, "updated_at"):
-            fetch_fields["updated_after"] = fields.Date(required=False)
-            fetch_fields["updated_before"] = fields.Date(required=False)
-        for column in getattr(self.schema.Meta.model, "__table__").c:
-            if column.primary_key == False and column.name != "created_at" and column.name != "updated_at" and \
-                    column.name != "is_deleted" and column.name != "created_by_id":
-                fetch_fields[column.name] = fields.Str(required=False)
-
-        self.fetch_schema = Schema.from_dict(fetch_fields)
+        self.optimistic_unique = optimistic_unique
+        self.pagination = pagination
+        self.count_mode = count_mode
+        self.search_backend = search_backend if search_backend else default_search_backend
+        self.search_fields = search_fields
+        if search_fields:
+            # Fails fast on unknown column names
+            self.metadata.get_search_columns(search_fields)
+        self.fetch_schema = self.metadata.fetch_schema
+        self.bulk_max_size = bulk_max_size
+        self.bulk_mode = bulk_mode
+        self.update_scopes = update_scope
+        self.delete_scopes = delete_scope
+        self.update_permissions = update_permissions
+        self.delete_permissions = delete_permissions
+        self.export_batch_size = export_batch_size
 
+    def bulk_post(self, items, mode=ALL_OR_NOTHING):
+        """
+        Creates multiple records. Foreign keys and unique indexes are validated using a query per referred table and
+        unique index and valid records are inserted in a single transaction.
+
+        :param items: A list of records payload
+        :param mode: "all-or-nothing" creates records only if all records are valid while "partial" creates the valid
+        records
+        :return: A tuple of response body with per record results and status code. 201 if all records are created,
+        207 if some records are created and 400 if no record is created
+        """
+        self.app.logger.info("Creating %d %s records", len(items), self.record_name)
+        if not items:
+            return {"message": "Sorry expected a JSON array of records"}, 400
+        if mode not in (ALL_OR_NOTHING, PARTIAL):
+            return {"message": f"Sorry invalid mode {mode}. Expected {ALL_OR_NOTHING} or {PARTIAL}"}, 400
+        if len(items) > self.bulk_max_size:
+            return {"message": f"Sorry a maximum of {self.bulk_max_size} records can be created per request"}, 400
+        token = None
+        if self.resource_protector:
+            self.app.logger.debug("Resource protector is present handling authorization")
+            token = authenticate(self.resource_protector, self.create_scopes, self.create_permissions)
+        schema = self.schema()
+        results = [None] * len(items)
+        payloads = []
+        for i, item in enumerate(items):
+            try:
+                payload = schema.load(item, transient=True)
+            except MarshmallowValidationError as ex:
+                results[i] = {"index": i, "status": 400, "message": "Sorry validation errors occurred",
+                              "errors": ex.messages}
+                continue
+            if token and self.metadata.model_metadata.created_by_id:
+                setattr(payload, "created_by_id", token.get_user_id())
+            payloads.append((i, payload))
+        models = [payload for i, payload in payloads]
+        foreign_key_errors = get_foreign_key_errors(models, self.db)
+        collisions = [None] * len(models) if self.optimistic_unique else get_unique_collisions(models, self.db)
+        valid = []
+        for (i, payload), error, collision in zip(payloads, foreign_key_errors, collisions):
+            if error:
+                results[i] = {"index": i, "status": 400, "message": error}
+            elif collision:
+                results[i] = {"index": i, "status": 400, "message": collision[0], "errors": collision[1]}
+            else:
+                valid.append((i, payload))
+        created = 0
+        events = []
+        if valid and (mode == PARTIAL or len(valid) == len(items)):
+            try:
+                records = self.service.bulk_create([payload for i, payload in valid])
+                valid = [(i, record) for (i, payload), record in zip(valid, records)]
+                created = len(valid)
+            except ValidationError as ex:
+                self.app.logger.debug(f"Failed to create {self.record_name} records. {ex.message}")
+                for i, payload in valid:
+                    results[i] = {"index": i, "status": 400, "message": ex.message, "errors": ex.errors}
+                valid = []
+            primary_key = self.metadata.model_metadata.primary_key
+            for i, payload in valid:
+                results[i] = {"index": i, "status": 201, "data": schema.dump(payload)}
+                events.append(create_audit_event("log_success_creation", f"Created {self.record_name} successfully",
+                                                 payload.__class__, getattr(payload, primary_key.key), token=token))
+        else:
+            for i, payload in valid:
+                results[i] = {"index": i, "status": 400, "message": "Not created due to other invalid records"}
+        for result in results:
+            if result["status"] != 201:
+                events.append(create_audit_event("log_failed_creation",
+                                                 f"Failed to create {self.record_name}. {result['message']}",
+                                                 self.metadata.model, token=token))
+        if self.logger_service and events:
+            self.logger_service.log_events(events)
+        status = 201 if created == len(items) else (207 if created else 400)
+        message = f"Created {created} of {len(items)} records"
+        return {"message": message, "data": {"created": created, "failed": len(items) - created,
+                                             "results": results}}, status
+
+    @doc(description="Creates a record. Resources supporting bulk creation accept a JSON array of records and a mode "
+                     "query parameter: all-or-nothing(default) or partial")
     @marshal_with(Ref("schema"), code=201, description="Request processed successfully")
     @use_kwargs(Ref('schema'))
     def post(self, payload=None):
@@ -167,39 +371,165 @@ class ChassisResourceList(MethodResource):
         if self.resource_protector:
             self.app.logger.debug("Resource protector is present handling authorization")
             token = authenticate(self.resource_protector, self.create_scopes, self.create_permissions)
-            if hasattr(payload, "created_by_id"):
+            if self.metadata.model_metadata.created_by_id:
                 self.app.logger.debug("Found created by field populating session user id")
                 setattr(payload, "created_by_id", token.get_user_id())
         # Validating foreign keys and unique constraints
         try:
             validate_foreign_keys(payload, self.db)
-            validate_unique_constraints(payload, self.db)
+            if not self.optimistic_unique:
+                validate_unique_constraints(payload, self.db)
+            self.service.create(payload)
         except ValidationError as ex:
             self.app.logger.debug(f"Failed to create entity {self.record_name}. {ex.message}")
             if self.logger_service:
                 self.logger_service.log_failed_creation(f"Failed to create {self.record_name}. {ex.message}",
                                                         payload.__class__, token=token)
             return {"message": ex.message}, 400
-        self.service.create(payload)
         if self.logger_service:
             self.logger_service.log_success_creation(f"Created {self.record_name} successfully", payload.__class__,
                                                      payload.id, token=token)
         return payload, 201
 
+    def bulk_patch(self, items):
+        """
+        Updates multiple records. Items are validated using a query per referred table and unique index then
+        updated using set based UPDATE statements see ChassisService.bulk_update()
+
+        :param items: A list of records payload with their primary key
+        :return: A tuple of response body and status code. 400 with per record results if any record is invalid
+        """
+        primary_key = self.metadata.model_metadata.primary_key
+        if not isinstance(items, list) or not items:
+            return {"message": "Sorry expected a JSON array of records"}, 400
+        self.app.logger.info("Updating %d %s records", len(items), self.record_name)
+        if len(items) > self.bulk_max_size:
+            return {"message": f"Sorry a maximum of {self.bulk_max_size} records can be updated per request"}, 400
+        token = None
+        if self.resource_protector:
+            self.app.logger.debug("Resource protector is present handling authorization")
+            token = authenticate(self.resource_protector, self.update_scopes, self.update_permissions)
+        schema = self.schema()
+        results = [None] * len(items)
+        payloads = []
+        seen = set()
+        for i, item in enumerate(items):
+            if not isinstance(item, dict) or item.get(primary_key.key) is None:
+                results[i] = {"index": i, "status": 400, "message": f"Sorry {primary_key.key} is required"}
+                continue
+            if len(item) < 2:
+                results[i] = {"index": i, "status": 400, "message": "Sorry no fields to update"}
+                continue
+            try:
+                payload = schema.load(item, partial=True, transient=True)
+            except MarshmallowValidationError as ex:
+                results[i] = {"index": i, "status": 400, "message": "Sorry validation errors occurred",
+                              "errors": ex.messages}
+                continue
+            model_id = getattr(payload, primary_key.key)
+            if model_id in seen:
+                results[i] = {"index": i, "status": 400, "message": "Duplicate record in request"}
+                continue
+            seen.add(model_id)
+            payloads.append((i, payload))
+        models = [payload for i, payload in payloads]
+        model_ids = [getattr(payload, primary_key.key) for payload in models]
+        foreign_key_errors = get_foreign_key_errors(models, self.db)
+        collisions = [None] * len(models) if self.optimistic_unique else \
+            get_unique_collisions(models, self.db, model_ids)
+        for (i, payload), error, collision in zip(payloads, foreign_key_errors, collisions):
+            if error:
+                results[i] = {"index": i, "status": 400, "message": error}
+            elif collision:
+                results[i] = {"index": i, "status": 400, "message": collision[0], "errors": collision[1]}
+        updated = []
+        if not any(results):
+            try:
+                updated = self.service.bulk_update(models)
+            except ValidationError as ex:
+                self.app.logger.debug(f"Failed to update {self.record_name} records. {ex.message}")
+                results = [{"index": i, "status": 400, "message": ex.message, "errors": ex.errors}
+                           for i in range(len(items))]
+        events = []
+        if any(results):
+            for i, result in enumerate(results):
+                if result is None:
+                    results[i] = {"index": i, "status": 400, "message": "Not updated due to other invalid records"}
+            for i, payload in payloads:
+                events.append(create_audit_event("log_failed_update",
+                                                 f"Failed to update {self.record_name}. {results[i]['message']}",
+                                                 self.metadata.model, getattr(payload, primary_key.key), token=token))
+            status, body = 400, {"message": "Sorry validation errors occurred", "data": {"results": results}}
+        else:
+            updated_ids = set(updated)
+            not_found = [model_id for model_id in model_ids if model_id not in updated_ids]
+            for model_id in updated:
+                events.append(create_audit_event("log_success_update", f"Updated {self.record_name} successfully",
+                                                 self.metadata.model, model_id, token=token))
+            for model_id in not_found:
+                events.append(create_audit_event("log_failed_update",
+                                                 f"Failed to update {self.record_name}. Record doesn't exist",
+                                                 self.metadata.model, model_id, token=token))
+            status, body = 200, {"message": f"Updated {len(updated)} of {len(items)} records",
+                                 "data": {"updated": len(updated), "ids": updated, "not_found": not_found}}
+        if self.logger_service and events:
+            self.logger_service.log_events(events)
+        return body, status
+
+    def bulk_delete(self, record_ids=None, **kwargs):
+        """
+        Deletes multiple records using a single set based statement see ChassisService.bulk_delete()
+
+        :param record_ids: Deleted records ids. If None records are selected using the listing filters
+        :param kwargs: Listing query parameters. Pagination, ordering and export parameters are ignored
+        :return: A tuple of response body with deleted records ids and status code
+        """
+        filter_names = {"q", "created_after", "created_before", "updated_after", "updated_before"} | \
+            {column.name for column in self.metadata.filter_columns}
+        filters = {key: value for key, value in kwargs.items() if key in filter_names and value is not None}
+        if record_ids is None and not filters:
+            return {"message": "Sorry deleting all records isn't allowed. Provide ids or filters"}, 400
+        if record_ids is not None and (not isinstance(record_ids, list) or len(record_ids) > self.bulk_max_size):
+            return {"message": f"Sorry ids should be a list of at most {self.bulk_max_size} ids"}, 400
+        self.app.logger.info("Deleting %s records. Ids %s, filters %s", self.record_name, record_ids, filters)
+        token = None
+        if self.resource_protector:
+            self.app.logger.debug("Resource protector is present handling authorization")
+            token = authenticate(self.resource_protector, self.delete_scopes, self.delete_permissions)
+        if record_ids is not None:
+            deleted = self.service.bulk_delete(record_ids)
+        else:
+            query, search_ordering = self.filter_query(**filters)
+            deleted = self.service.bulk_delete(query=query)
+        if self.logger_service and deleted:
+            self.logger_service.log_events([
+                create_audit_event("log_success_deletion", f"Deleted {self.record_name} successfully",
+                                   self.metadata.model, record_id, token=token) for record_id in deleted])
+        return {"message": f"Deleted {len(deleted)} records", "data": {"deleted": len(deleted), "ids": deleted}}, 200
+
     @doc(description="View Records. Currently only supports one column sorting:"
                      "<ul>"
                      "<li>For ascending specify ordering parameter with column name</li>"
                      "<li>For descending specify ordering parameter with a negative sign on the column name e.g. "
                      "<b><i>ordering=-id</i></b></li> "
-                     "</ul>")
+                     "</ul>"
+                     "Resources with cursor pagination return next and previous cursors. Pass them using the cursor "
+                     "parameter to navigate pages. "
+                     "Use count parameter to control records count: exact, estimate or none(skips counting). "
+                     "Export all matching records using format parameter(ndjson or csv) or an Accept header of "
+                     "application/x-ndjson or text/csv")
     @marshal_with(Ref("page_response_schema"), code=200)
     @use_kwargs(Ref("fetch_schema"), location="query")
     def get(self, page_size=None, page=None, ordering=None, q=None, created_after=None, created_before=None,
-            updated_after=None, updated_before=None, **kwargs):
+            updated_after=None, updated_before=None, cursor=None, count=None, export_format=None, **kwargs):
         """
         Fetching records
         :param page_size: Pagination page size
         :param page: pagination page starting with 1
+        :param cursor: Pagination cursor. Only used with cursor pagination
+        :param count: Records count mode. Either exact, estimate or none. Defaults to resource count_mode
+        :param export_format: Either json(default), ndjson or csv. ndjson and csv stream all matching records
+        without pagination
         :param ordering: Column ordering
         :param q: Search query param
         :param created_after: From creation date filter
@@ -216,19 +546,96 @@ class ChassisResourceList(MethodResource):
         if self.resource_protector:
             self.app.logger.debug("Resource protector is present handling authorization")
             authenticate(self.resource_protector, self.fetch_scopes, self.fetch_permissions)
-        if hasattr(self.schema.Meta.model, "is_deleted"):
+        query, search_ordering = self.filter_query(q, created_after, created_before, updated_after, updated_before,
+                                                   **kwargs)
+
+        export_format = self.get_export_format(export_format)
+        if export_format:
+            return self.export(self.order_query(query, ordering, search_ordering), export_format)
+        if count is None:
+            count = self.count_mode
+        if self.pagination == CURSOR_PAGINATION:
+            return self._paginate_keyset(query, page_size, ordering, cursor, count)
+
+        return paginate_offset(self.order_query(query, ordering, search_ordering), page, page_size, count)
+
+    def order_query(self, query, ordering=None, search_ordering=None):
+        """
+        Orders listing query
+        :param query: Filtered query
+        :param ordering: Column ordering. Column name prefixed with - for descending ordering
+        :param search_ordering: Search rank ordering used if ordering isn't specified
+        :return: Ordered query
+        """
+        if ordering is not None:
+            ordering = ordering.strip()
+            if ordering[0] == "-":
+                query = query.order_by(desc(ordering[1:]))
+            else:
+                query = query.order_by(asc(ordering))
+        elif search_ordering is not None:
+            self.app.logger.debug("Ordering(%s) not specified ordering by search rank", ordering)
+            query = query.order_by(search_ordering)
+        else:
+            self.app.logger.debug("Ordering(%s) not specified skipping ordering", ordering)
+        return query
+
+    @staticmethod
+    def get_export_format(export_format=None):
+        """
+        Gets requested export format from the format parameter falling back to the Accept header
+        :param export_format: format query parameter
+        :return: ndjson, csv or None if records should be paginated
+        """
+        if export_format is not None:
+            return export_format if export_format in EXPORT_MIMETYPES else None
+        mimetypes = {mimetype: name for name, mimetype in EXPORT_MIMETYPES.items()}
+        return mimetypes.get(request.accept_mimetypes.best_match(["application/json", *mimetypes]))
+
+    def export(self, query, export_format):
+        """
+        Streams all query records without counting or paginating. Records are fetched in batches of
+        export_batch_size using a server side cursor hence memory usage doesn't grow with the number of records
+
+        :param query: Filtered and ordered query
+        :param export_format: ndjson or csv
+        :return: Streamed response
+        """
+        self.app.logger.info("Exporting %s records as %s", self.record_name, export_format)
+        stream = stream_csv if export_format == CSV_EXPORT else stream_ndjson
+        response = Response(stream_with_context(stream(query, self.schema(), self.export_batch_size)),
+                            mimetype=EXPORT_MIMETYPES[export_format])
+        if export_format == CSV_EXPORT:
+            file_name = self.metadata.model_metadata.table.name
+            response.headers["Content-Disposition"] = f"attachment; filename={file_name}.csv"
+        return response
+
+    def filter_query(self, q=None, created_after=None, created_before=None, updated_after=None,
+                     updated_before=None, **kwargs):
+        """
+        Builds listing query filtered using search and filter query params
+
+        :param q: Search query param
+        :param created_after: From creation date filter
+        :param created_before: To creation date filter
+        :param updated_after: From updated date filter
+        :param updated_before: To updated date filter
+        :param kwargs: Column filters
+        :return: A tuple of filtered query and search rank ordering(None if there is no search or it isn't ranked)
+        """
+        model_metadata = self.metadata.model_metadata
+        if model_metadata.soft_delete:
             query = self.schema.Meta.model.query.filter_by(is_deleted=False)
         else:
             query = self.schema.Meta.model.query
         # If q param exists search columns using q param
+        search_ordering = None
         if q:
             self.app.logger.debug("Found query param searching columns...")
-            search_query = []
-            for column in getattr(self.schema.Meta.model, "__table__").c:
-                search_query.append(column.like('%' + q + "%"))
-            query = query.filter(or_(*search_query))
+            query, search_ordering = self.search_backend.search(
+                query, model_metadata, self.metadata.get_search_columns(self.search_fields, self.search_backend), q)
         # Filter using creation date
-        if (created_after or created_before) and hasattr(self.schema.Meta.model, "created_at"):
+        if (created_after or created_before) and model_metadata.created_at:
             self.app.logger.debug("Found created date filter. Filtering created from %s to %s",
                                   created_after, created_before)
             if created_before is None:
@@ -239,7 +646,7 @@ class ChassisResourceList(MethodResource):
                 query = query.filter(and_(self.schema.Meta.model.created_at >= created_after,
                                           self.schema.Meta.model.created_at <= created_before))
         # Filter using update date
-        if (updated_after or updated_before) and hasattr(self.schema.Meta.model, "updated_at"):
+        if (updated_after or updated_before) and model_metadata.updated_at:
             self.app.logger.debug("Found updated date filter. Filtering updated from %s to %s",
                                   updated_after, updated_before)
             if updated_before is None:
@@ -253,19 +660,84 @@ class ChassisResourceList(MethodResource):
         if kwargs:
             query = query.filter_by(**kwargs)
 
-        # Ordering query
+        return query, search_ordering
+
+    def _paginate_keyset(self, query, page_size, ordering=None, cursor=None, count_mode=EXACT_COUNT):
+        """
+        Cursor pagination using ordering column and primary key
+        :param query: Filtered query
+        :param page_size: Page size
+        :param ordering: Column ordering. Defaults to primary key
+        :param cursor: next or previous cursor from a previous response
+        :param count_mode: Records count mode (exact, estimate or none)
+        :return: A page of records with next and previous cursors
+        """
+        model_metadata = self.metadata.model_metadata
+        descending = False
+        order_column = model_metadata.primary_key
         if ordering is not None:
             ordering = ordering.strip()
-            if ordering[0] == "-":
-                query = query.order_by(desc(ordering[1:]))
-            else:
-                query = query.order_by(asc(ordering))
-        else:
-            self.app.logger.debug("Ordering(%s) not specified skipping ordering", ordering)
+            descending = ordering.startswith("-")
+            order_column = model_metadata.table.c.get(ordering.lstrip("-"))
+            if order_column is None:
+                return {"message": f"Sorry can't order by {ordering}"}, 400
+        try:
+            response = paginate_keyset(query, order_column, model_metadata.primary_key, descending, page_size,
+                                       cursor)
+        except ValidationError as ex:
+            return {"message": ex.message}, 400
+        response["page_size"] = page_size
+        count = count_records(query, count_mode)
+        if count is not None:
+            response.update(count=count, total_pages=get_total_pages(count, page_size))
+        return response
+
+
+class BulkCreateMixin(MethodResource):
+    """
+    Enables creating multiple records by posting a JSON array to a ChassisResourceList see
+    ChassisResourceList.bulk_post()::
+
+        class PersonListResource(BulkCreateMixin, ChassisResourceList):
+            ...
+    """
+
+    def dispatch_request(self, *args, **kwargs):
+        if request.method == "POST":
+            payload = request.get_json(silent=True)
+            if isinstance(payload, list):
+                body, status = self.bulk_post(payload, request.args.get("mode", self.bulk_mode))
+                return make_response(jsonify(body), status)
+        return super().dispatch_request(*args, **kwargs)
+
+
+class BulkUpdateMixin(MethodResource):
+    """
+    Enables updating multiple records by sending a JSON array to a ChassisResourceList using PATCH see
+    ChassisResourceList.bulk_patch(). PATCH is only registered and documented on resources using the mixin
+    """
 
-        response = query.paginate(page=page, per_page=page_size)
-        return {"count": response.total, "current_page": response.page, "page_size": response.per_page,
-                "total_pages": response.pages, "results": response.items}
+    @doc(description="Updates multiple records. Send a JSON array of records payload including their primary key. "
+                     "Records are updated only if all records are valid")
+    def patch(self):
+        body, status = self.bulk_patch(request.get_json(silent=True))
+        return make_response(jsonify(body), status)
+
+
+class BulkDeleteMixin(MethodResource):
+    """
+    Enables deleting multiple records by ids or the listing filters using DELETE on a ChassisResourceList see
+    ChassisResourceList.bulk_delete(). DELETE is only registered and documented on resources using the mixin
+    """
+
+    @doc(description="Deletes multiple records. Send a JSON object with the records ids e.g. {\"ids\": [1, 2]} or "
+                     "select the deleted records using the listing filter parameters")
+    @use_kwargs(Ref("fetch_schema"), location="query")
+    def delete(self, **kwargs):
+        payload = request.get_json(silent=True)
+        record_ids = payload.get("ids") if isinstance(payload, dict) else None
+        body, status = self.bulk_delete(record_ids, **kwargs)
+        return make_response(jsonify(body), status)
 
 
 @marshal_with(ResponseWrapper, code=400, description="Validation errors")
@@ -276,9 +748,18 @@ class ChassisResource(MethodResource):
     def __init__(self, app, db, schema, record_name=None, logger_service: LoggerService = None,
                  resource_protector: CustomResourceProtector = None, update_scope: Scope = None,
                  fetch_scope: Scope = None, delete_scope: Scope = None, update_permissions=None,
-                 fetch_permissions=None, delete_permissions=None):
+                 fetch_permissions=None, delete_permissions=None, optimistic_unique=False):
+        """
+
+        :param app: Flask application reference
+        :param db: Flask SQLAlchemy reference
+        :param schema: Current model Marshmallow Schema with model reference
+        :param optimistic_unique: If True unique constraints aren't checked before update instead database unique
+        index violations are reported as validation errors
+        """
         self.app = app
-        self.service = ChassisService(app, db, schema.Meta.model)
+        self.metadata = get_resource_metadata(schema)
+        self.service = self.metadata.get_service(app, db)
         self.db = db
         if record_name is None:
             self.record_name = "Resource"
@@ -286,15 +767,8 @@ class ChassisResource(MethodResource):
             self.record_name = record_name
 
         self.schema = schema
-
-        class ResponseSchema(ResponseWrapper):
-            data = fields.Nested(schema)
-
-        class RecordPageSchema(DjangoPageSchema):
-            results = fields.List(fields.Nested(schema))
-
-        self.response_schema = ResponseSchema()
-        self.page_response_schema = RecordPageSchema()
+        self.response_schema = self.metadata.response_schema
+        self.page_response_schema = self.metadata.page_response_schema
         self.logger_service = logger_service
         self.resource_protector = resource_protector
         self.update_scopes = update_scope
@@ -303,6 +777,7 @@ class ChassisResource(MethodResource):
         self.update_permissions = update_permissions
         self.fetch_permissions = fetch_permissions
         self.delete_permissions = delete_permissions
+        self.optimistic_unique = optimistic_unique
 
     @doc(description="View Record")
     @marshal_with(Ref("schema"), code=200)
@@ -319,9 +794,9 @@ class ChassisResource(MethodResource):
         for key, value in kwargs.items():
             record_id = value
             break
-        primary_column = get_primary_key(self.schema.Meta.model)
-        filters = {primary_column.name: record_id}
-        if hasattr(self.schema.Meta.model, "is_deleted"):
+        model_metadata = self.metadata.model_metadata
+        filters = {model_metadata.primary_key.name: record_id}
+        if model_metadata.soft_delete:
             filters["is_deleted"] = False
         record = self.schema.Meta.model.query.filter_by(**filters).first()
         if record is None:
@@ -359,7 +834,8 @@ class ChassisResource(MethodResource):
             token = authenticate(self.resource_protector, self.update_scopes, self.update_permissions)
         try:
             validate_foreign_keys(payload, self.db)
-            validate_unique_constraints(payload, self.db, record_id)
+            if not self.optimistic_unique:
+                validate_unique_constraints(payload, self.db, record_id)
             # attrs = inspect.getmembers(payload, lambda a: not (inspect.isroutine(a)))
             # for attr in attrs:
             #     print(attr)
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 authors and contributors All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from sqlalchemy import MetaData, Table, Column, Integer, String, Text, DateTime, Boolean
+
+from .services import LoggerService, create_audit_event
+from .utils import RemoteToken
+
+logger = logging.getLogger(__name__)
+
+# Queue overflow policies
+BLOCK = "block"
+DROP_NEW = "drop_new"
+DROP_OLDEST = "drop_oldest"
+
+
+class EventLoggerService(LoggerService):
+    """
+    LoggerService converting log_* calls to AuditEvent batches. Implementations override log_events()
+    """
+
+    def log_success_creation(self, description, entity, record_id=None, token: RemoteToken = None):
+        self.log_events([create_audit_event("log_success_creation", description, entity, record_id, token=token)])
+
+    def log_failed_creation(self, description, entity, token: RemoteToken = None):
+        self.log_events([create_audit_event("log_failed_creation", description, entity, token=token)])
+
+    def log_success_update(self, description, entity, record_id, notes="", token: RemoteToken = None):
+        self.log_events([create_audit_event("log_success_update", description, entity, record_id, notes, token)])
+
+    def log_failed_update(self, description, entity, record_id, notes="", token: RemoteToken = None):
+        self.log_events([create_audit_event("log_failed_update", description, entity, record_id, notes, token)])
+
+    def log_failed_deletion(self, description, entity, record_id, notes="", token: RemoteToken = None):
+        self.log_events([create_audit_event("log_failed_deletion", description, entity, record_id, notes, token)])
+
+    def log_success_deletion(self, description, entity, record_id, notes="", token: RemoteToken = None):
+        self.log_events([create_audit_event("log_success_deletion", description, entity, record_id, notes, token)])
+
+    def log_events(self, events):
+        raise NotImplementedError()
+
+
+class QueueingLoggerService(EventLoggerService):
+    """
+    Logs audit events asynchronously. Events are queued and a background worker passes them to the wrapped
+    LoggerService log_events() in batches of up to batch_size events or every flush_interval seconds. Queued events
+    are flushed on interpreter shutdown
+    """
+
+    def __init__(self, logger_service: LoggerService, max_queue_size=10000, batch_size=100, flush_interval=1.0,
+                 overflow=BLOCK, block_timeout=1.0):
+        """
+        :param logger_service: LoggerService writing the audit events
+        :param max_queue_size: Maximum queued events
+        :param batch_size: Maximum events per batch
+        :param flush_interval: Maximum seconds an event waits for a batch to fill
+        :param overflow: Policy applied when the queue is full:
+            - block: Waits up to block_timeout seconds for space then drops the event
+            - drop_new: Drops the new event
+            - drop_oldest: Drops the oldest queued event
+        :param block_timeout: Seconds to wait for space when overflow is block
+        """
+        if overflow not in (BLOCK, DROP_NEW, DROP_OLDEST):
+            raise ValueError(f"Invalid overflow policy {overflow}")
+        self.logger_service = logger_service
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.dropped = 0
+        self.failed = 0
+        self._stats_lock = threading.Lock()
+        self._queue = queue.Queue(max_queue_size)
+        self._stopped = threading.Event()
+        self._worker = threading.Thread(target=self._run, name="audit-log-worker", daemon=True)
+        self._worker.start()
+        atexit.register(self.shutdown)
+
+    def log_events(self, events):
+        if self._stopped.is_set():
+            # Worker has stopped hence events are written synchronously
+            self.logger_service.log_events(events)
+            return
+        for event in events:
+            self._put(event)
+
+    def _put(self, event):
+        try:
+            if self.overflow == BLOCK:
+                self._queue.put(event, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(event)
+            return
+        except queue.Full:
+            if self.overflow != DROP_OLDEST:
+                self._drop(event)
+                return
+        while True:
+            try:
+                self._drop(self._queue.get_nowait())
+                self._queue.task_done()
+            except queue.Empty:
+                pass
+            try:
+                self._queue.put_nowait(event)
+                return
+            except queue.Full:
+                continue
+
+    def _drop(self, event):
+        with self._stats_lock:
+            self.dropped += 1
+        logger.warning("Audit log queue is full. Dropped event: %s", event.description)
+
+    def _run(self):
+        while not (self._stopped.is_set() and self._queue.empty()):
+            try:
+                batch = [self._queue.get(timeout=0.1)]
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0 or self._stopped.is_set():
+                    try:
+                        batch.append(self._queue.get_nowait())
+                        continue
+                    except queue.Empty:
+                        break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            try:
+                self.logger_service.log_events(batch)
+            except Exception as ex:
+                with self._stats_lock:
+                    self.failed += len(batch)
+                logger.exception("Failed to write %d audit events. %s", len(batch), ex)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def flush(self):
+        """
+        Waits until all queued events are written
+        """
+        self._queue.join()
+
+    def shutdown(self, timeout=10):
+        """
+        Flushes queued events and stops the background worker
+        :param timeout: Maximum seconds to wait for queued events to be written
+        """
+        atexit.unregister(self.shutdown)
+        self._stopped.set()
+        self._worker.join(timeout)
+
+    def stats(self):
+        """
+        Queue statistics
+        :return: A dictionary with queued, dropped and failed events count
+        """
+        with self._stats_lock:
+            return {"queued": self._queue.qsize(), "dropped": self.dropped, "failed": self.failed}
+
+
+def build_audit_table(metadata=None, table_name="audit_log"):
+    """
+    Builds audit log table used by SqlAuditSink
+    :param metadata: SQLAlchemy MetaData i.e. db.metadata to manage the table using migrations
+    :param table_name: Table name
+    :return: SQLAlchemy Table
+    """
+    return Table(table_name, metadata if metadata is not None else MetaData(),
+                 Column("id", Integer, primary_key=True),
+                 Column("action", String(32), nullable=False),
+                 Column("success", Boolean, nullable=False),
+                 Column("description", Text),
+                 Column("entity", String(255)),
+                 Column("record_id", String(255)),
+                 Column("notes", Text),
+                 Column("user_id", String(255)),
+                 Column("client_id", String(255)),
+                 Column("created_at", DateTime, nullable=False))
+
+
+class SqlAuditSink(EventLoggerService):
+    """
+    Writes audit events to a database table. Each batch is written using a single bulk INSERT(executemany) in one
+    transaction. Usually wrapped in QueueingLoggerService
+    """
+
+    def __init__(self, engine, table: Table = None):
+        """
+        :param engine: SQLAlchemy engine i.e. db.engine
+        :param table: Audit log table. Defaults to build_audit_table()
+        """
+        self.engine = engine
+        self.table = table if table is not None else build_audit_table()
+
+    def create_table(self):
+        """
+        Creates audit log table if it doesn't exist
+        """
+        self.table.create(self.engine, checkfirst=True)
+
+    @staticmethod
+    def to_row(event):
+        """
+        Converts AuditEvent to an audit log table row
+        """
+        entity = event.entity
+        token = event.token
+        return {
+            "action": event.action,
+            "success": "_success_" in event.action,
+            "description": event.description,
+            "entity": getattr(entity, "__name__", entity.__class__.__name__) if entity is not None else None,
+            "record_id": str(event.record_id) if event.record_id is not None else None,
+            "notes": event.notes,
+            "user_id": str(token.get_user_id()) if token and token.get_user_id() else None,
+            "client_id": token.get_client_id() if token else None,
+            "created_at": event.created_at
+        }
+
+    def log_events(self, events):
+        if not events:
+            return
+        with self.engine.begin() as connection:
+            connection.execute(self.table.insert(), [self.to_row(event) for event in events])
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 authors and contributors All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import csv
+import io
+import json
+
+# Listing export formats and their response mimetypes
+NDJSON_EXPORT = "ndjson"
+CSV_EXPORT = "csv"
+EXPORT_MIMETYPES = {NDJSON_EXPORT: "application/x-ndjson", CSV_EXPORT: "text/csv"}
+EXPORT_FORMATS = ("json",) + tuple(EXPORT_MIMETYPES)
+
+
+def stream_records(query, batch_size=1000):
+    """
+    Iterates query records in batches using a server side cursor where the driver supports it hence records are
+    neither buffered nor counted
+
+    :param query: SQLAlchemy query
+    :param batch_size: Records fetched per batch
+    :return: A generator of record batches
+    """
+    batch = []
+    for record in query.yield_per(batch_size).execution_options(stream_results=True):
+        batch.append(record)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def stream_ndjson(query, schema, batch_size=1000):
+    """
+    Serializes query records to newline delimited JSON
+
+    :param query: SQLAlchemy query
+    :param schema: Marshmallow Schema instance used to dump records
+    :param batch_size: Records serialized per yielded chunk
+    :return: A generator of text chunks
+    """
+    for batch in stream_records(query, batch_size):
+        yield "".join(json.dumps(item, separators=(",", ":")) + "\n" for item in schema.dump(batch, many=True))
+
+
+def stream_csv(query, schema, batch_size=1000):
+    """
+    Serializes query records to CSV with a header row of the schema dumped fields. Nested values are JSON encoded
+
+    :param query: SQLAlchemy query
+    :param schema: Marshmallow Schema instance used to dump records
+    :param batch_size: Records serialized per yielded chunk
+    :return: A generator of text chunks
+    """
+    names = [field.data_key or name for name, field in schema.dump_fields.items()]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(names)
+    yield buffer.getvalue()
+    for batch in stream_records(query, batch_size):
+        buffer.seek(0)
+        buffer.truncate()
+        for item in schema.dump(batch, many=True):
+            writer.writerow([json.dumps(value) if isinstance(value, (dict, list)) else value
+                             for value in (item.get(name) for name in names)])
+        yield buffer.getvalue()
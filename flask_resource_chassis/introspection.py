@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 authors and contributors All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import threading
+from collections import namedtuple
+
+ForeignKeyColumn = namedtuple("ForeignKeyColumn", ["column", "referred_column", "referred_table"])
+UniqueIndex = namedtuple("UniqueIndex", ["name", "columns"])
+
+_lock = threading.Lock()
+_model_metadata = {}
+
+
+class ModelMetadata:
+    """
+    Table introspection of a SQLAlchemy model. Built once per mapped class, see get_model_metadata()
+    """
+
+    def __init__(self, model):
+        """
+        :param model: SQLAlchemy model class
+        """
+        self.model = model
+        self.table = getattr(model, "__table__")
+        self.columns = list(self.table.c)
+        self.primary_key = None
+        self.foreign_keys = []
+        for column in self.columns:
+            if column.primary_key and self.primary_key is None:
+                self.primary_key = column
+            for key in column.foreign_keys:
+                self.foreign_keys.append(ForeignKeyColumn(column, key.column, key.constraint.referred_table))
+        self.unique_indexes = [UniqueIndex(index.name, tuple(index.columns))
+                               for index in self.table.indexes if index.unique]
+        self.soft_delete = hasattr(model, "is_deleted")
+        self.is_active = hasattr(model, "is_active")
+        self.created_at = hasattr(model, "created_at")
+        self.updated_at = hasattr(model, "updated_at")
+        self.created_by_id = hasattr(model, "created_by_id")
+
+
+def get_model_metadata(entity):
+    """
+    Gets cached ModelMetadata of a model building it on first access
+
+    :param entity: SQLAlchemy model class or instance
+    :return: ModelMetadata
+    """
+    model = entity if isinstance(entity, type) else type(entity)
+    metadata = _model_metadata.get(model)
+    if metadata is None:
+        with _lock:
+            metadata = _model_metadata.get(model)
+            if metadata is None:
+                metadata = ModelMetadata(model)
+                _model_metadata[model] = metadata
+    return metadata
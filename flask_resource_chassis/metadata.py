@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 authors and contributors All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import threading
+
+from marshmallow import Schema, fields, validate
+
+from .export import EXPORT_FORMATS
+from .introspection import get_model_metadata
+from .pagination import COUNT_MODES
+from .schemas import DjangoPageSchema, ResponseWrapper
+from .services import ChassisService
+
+# Chassis managed columns which can't be used as list filters
+EXCLUDED_FILTER_COLUMNS = ("created_at", "updated_at", "is_deleted", "created_by_id")
+
+_lock = threading.Lock()
+_resource_metadata = {}
+
+
+class ResourceMetadata:
+    """
+    Schemas and model introspection shared by every resource built on the same marshmallow schema. Flask restful
+    instantiates resources on each request hence anything expensive is built here once per process.
+    """
+
+    def __init__(self, schema):
+        """
+        :param schema: Marshmallow Schema with model reference
+        """
+        self.schema = schema
+        self.model = schema.Meta.model
+        self.model_metadata = get_model_metadata(self.model)
+        self._services = {}
+        self._search_columns = {}
+
+        class ResponseSchema(ResponseWrapper):
+            data = fields.Nested(schema)
+
+        class RecordPageSchema(DjangoPageSchema):
+            results = fields.List(fields.Nested(schema))
+
+        self.response_schema = ResponseSchema()
+        self.page_response_schema = RecordPageSchema()
+        self.filter_columns = [column for column in self.model_metadata.columns
+                               if not column.primary_key and column.name not in EXCLUDED_FILTER_COLUMNS]
+        self.fetch_schema = self._build_fetch_schema()
+
+    def _build_fetch_schema(self):
+        """
+        Builds list query params schema
+        :return: Marshmallow Schema instance
+        """
+        fetch_fields = dict(page_size=fields.Int(required=False, validate=validate.Range(min=1)),
+                            page=fields.Int(required=False, validate=validate.Range(min=1)),
+                            ordering=fields.Str(required=False), q=fields.Str(required=False),
+                            cursor=fields.Str(required=False),
+                            count=fields.Str(required=False, validate=validate.OneOf(COUNT_MODES)),
+                            export_format=fields.Str(required=False, data_key="format",
+                                                     validate=validate.OneOf(EXPORT_FORMATS)))
+        if self.model_metadata.created_at:
+            fetch_fields["created_after"] = fields.Date(required=False)
+            fetch_fields["created_before"] = fields.Date(required=False)
+        if self.model_metadata.updated_at:
+            fetch_fields["updated_after"] = fields.Date(required=False)
+            fetch_fields["updated_before"] = fields.Date(required=False)
+        for column in self.filter_columns:
+            fetch_fields[column.name] = fields.Str(required=False)
+        return Schema.from_dict(fetch_fields)()
+
+    def get_search_columns(self, search_fields=None, search_backend=None):
+        """
+        Gets searchable columns
+
+        :param search_fields: A list of searchable column names. Defaults to search_backend default columns
+        :param search_backend: SearchBackend providing the default columns
+        :return: A list of columns
+        :raises ValueError: If a search field isn't a table column
+        """
+        key = tuple(search_fields) if search_fields else type(search_backend)
+        columns = self._search_columns.get(key)
+        if columns is None:
+            if search_fields:
+                unknown = [name for name in search_fields if name not in self.model_metadata.table.c]
+                if unknown:
+                    raise ValueError(f"Unknown search fields {unknown} on table {self.model_metadata.table.name}")
+                columns = [self.model_metadata.table.c[name] for name in search_fields]
+            else:
+                columns = search_backend.get_default_columns(self.model_metadata)
+            columns = self._search_columns.setdefault(key, columns)
+        return columns
+
+    def get_service(self, app, db):
+        """
+        Gets ChassisService for the schema model creating one if it doesn't exist
+
+        :param app: Flask application reference
+        :param db: Flask SQLAlchemy reference
+        :return: ChassisService
+        """
+        key = (app, db)
+        service = self._services.get(key)
+        if service is None:
+            service = self._services.setdefault(key, ChassisService(app, db, self.model))
+        return service
+
+
+def get_resource_metadata(schema):
+    """
+    Gets cached ResourceMetadata for a schema building it on first access
+
+    :param schema: Marshmallow Schema with model reference
+    :return: ResourceMetadata
+    """
+    metadata = _resource_metadata.get(schema)
+    if metadata is None:
+        with _lock:
+            metadata = _resource_metadata.get(schema)
+            if metadata is None:
+                metadata = ResourceMetadata(schema)
+                _resource_metadata[schema] = metadata
+    return metadata
+
+
+def clear_metadata_cache():
+    """
+    Discards all cached resource metadata. Mainly useful in tests and benchmarks
+    """
+    with _lock:
+        _resource_metadata.clear()
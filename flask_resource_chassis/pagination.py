@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 authors and contributors All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import base64
+import binascii
+import json
+import math
+import uuid
+from datetime import datetime, date
+from decimal import Decimal, InvalidOperation
+
+from sqlalchemy import asc, desc, tuple_, text, inspect
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+from .exceptions import ValidationError
+
+PAGE_PAGINATION = "page"
+CURSOR_PAGINATION = "cursor"
+
+# Listing count modes
+EXACT_COUNT = "exact"
+NO_COUNT = "none"
+ESTIMATE_COUNT = "estimate"
+COUNT_MODES = (EXACT_COUNT, NO_COUNT, ESTIMATE_COUNT)
+
+
+def _encode_value(value):
+    """
+    Converts a column value to a JSON serializable value preserving its type
+    """
+    if isinstance(value, datetime):
+        return {"datetime": value.isoformat()}
+    if isinstance(value, date):
+        return {"date": value.isoformat()}
+    if isinstance(value, Decimal):
+        return {"decimal": str(value)}
+    if isinstance(value, uuid.UUID):
+        return {"uuid": str(value)}
+    return value
+
+
+_VALUE_DECODERS = {"datetime": datetime.fromisoformat, "date": date.fromisoformat, "decimal": Decimal,
+                   "uuid": uuid.UUID}
+
+
+def _decode_value(value):
+    """
+    Reverses _encode_value()
+    :raises ValueError: If value isn't a scalar or a value encoded by _encode_value()
+    """
+    if isinstance(value, dict):
+        if len(value) != 1:
+            raise ValueError("Invalid cursor value")
+        (tag, encoded), = value.items()
+        if tag not in _VALUE_DECODERS or not isinstance(encoded, str):
+            raise ValueError("Invalid cursor value")
+        return _VALUE_DECODERS[tag](encoded)
+    if value is not None and not isinstance(value, (str, int, float, bool)):
+        raise ValueError("Invalid cursor value")
+    return value
+
+
+def encode_cursor(values, reverse=False):
+    """
+    Builds an opaque pagination cursor
+
+    :param values: Ordering column values of the boundary row
+    :param reverse: True if the cursor points to the previous page
+    :return: url safe cursor string
+    """
+    payload = json.dumps([1 if reverse else 0] + [_encode_value(value) for value in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, size):
+    """
+    Decodes a cursor created by encode_cursor()
+
+    :param cursor: cursor string
+    :param size: Expected number of ordering values
+    :return: A tuple of reverse flag and ordering values
+    :throws ValidationError: If the cursor is invalid
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode())
+        if not isinstance(payload, list) or len(payload) != size + 1:
+            raise ValueError("Invalid cursor size")
+        if payload[0] not in (0, 1):
+            raise ValueError("Invalid cursor direction")
+        return bool(payload[0]), [_decode_value(value) for value in payload[1:]]
+    except (ValueError, TypeError, InvalidOperation, binascii.Error):
+        raise ValidationError("Invalid pagination cursor")
+
+
+def paginate_keyset(query, order_column, primary_key, descending=False, page_size=10, cursor=None):
+    """
+    Keyset(cursor) pagination. Records are ordered by order_column and primary key which is used as tie breaker then
+    filtered using WHERE (order_column, primary_key) > (?, ?) hence deep pages don't require OFFSET scans.
+
+    :param query: SQLAlchemy query
+    :param order_column: Ordering column. Nullable columns are rejected since NULL values can't be compared
+    :param primary_key: Primary key column
+    :param descending: True for descending ordering
+    :param page_size: Page size
+    :param cursor: Cursor from a previous page next or previous value
+    :return: A dictionary with results, next and previous cursors
+    :throws ValidationError: If the cursor is invalid or the ordering column is nullable
+    """
+    if order_column is not primary_key and order_column.nullable:
+        raise ValidationError(f"Sorry can't order by nullable column {order_column.name}")
+    columns = [order_column] if order_column is primary_key else [order_column, primary_key]
+    reverse = False
+    if cursor:
+        reverse, values = decode_cursor(cursor, len(columns))
+        # Traversing backwards flips the ordering
+        if descending != reverse:
+            query = query.filter(tuple_(*columns) < tuple_(*values))
+        else:
+            query = query.filter(tuple_(*columns) > tuple_(*values))
+    direction = desc if descending != reverse else asc
+    rows = query.order_by(*[direction(column) for column in columns]).limit(page_size + 1).all()
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if reverse:
+        rows.reverse()
+    has_next = has_more if not reverse else bool(cursor)
+    has_previous = has_more if reverse else bool(cursor)
+    next_cursor = previous_cursor = None
+    if rows and has_next:
+        next_cursor = encode_cursor([getattr(rows[-1], column.key) for column in columns])
+    if rows and has_previous:
+        previous_cursor = encode_cursor([getattr(rows[0], column.key) for column in columns], reverse=True)
+    return {"results": rows, "next": next_cursor, "previous": previous_cursor}
+
+
+def get_total_pages(count, page_size):
+    """
+    Calculates total pages
+    :param count: Total records
+    :param page_size: Page size
+    :return: Total pages
+    """
+    return int(math.ceil(count / float(page_size))) if page_size else 0
+
+
+class Explain(Executable, ClauseElement):
+    """
+    PostgreSQL EXPLAIN (FORMAT JSON) of a statement. Statement parameters are bound like any other executed statement
+    """
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(Explain, "postgresql")
+def _compile_explain(element, compiler, **kwargs):
+    return f"EXPLAIN (FORMAT JSON) {compiler.process(element.statement, **kwargs)}"
+
+
+def estimate_count(query):
+    """
+    Estimates query result count using PostgreSQL planner statistics. Unfiltered queries use pg_class.reltuples and
+    filtered queries use EXPLAIN row estimate. Other dialects fall back to an exact count.
+
+    :param query: SQLAlchemy query
+    :return: Estimated records count
+    """
+    query = query.order_by(None)
+    session = query.session
+    entity = query.column_descriptions[0]["entity"]
+    bind = session.get_bind(mapper=inspect(entity) if entity is not None else None)
+    if bind.dialect.name != "postgresql":
+        return query.count()
+    statement = query.statement
+    if statement.whereclause is None and len(statement.froms) == 1:
+        estimate = session.execute(text("SELECT reltuples FROM pg_class WHERE oid = CAST(:table AS regclass)"),
+                                   {"table": statement.froms[0].name}).scalar()
+    else:
+        plan = session.execute(Explain(statement)).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        estimate = plan[0]["Plan"]["Plan Rows"]
+    # Tables which have never been analyzed have no statistics
+    if estimate is None or estimate < 0:
+        return query.count()
+    return int(estimate)
+
+
+def paginate_offset(query, page, page_size, count_mode=EXACT_COUNT):
+    """
+    Page number pagination
+
+    :param query: SQLAlchemy query
+    :param page: Page number starting with 1
+    :param page_size: Page size
+    :param count_mode: exact runs a COUNT query, estimate uses estimate_count() and none skips counting. Instead an
+    extra record is fetched to check if there is a next page
+    :return: A dictionary with count, current_page, page_size, total_pages and results
+    """
+    if count_mode == EXACT_COUNT:
+        response = query.paginate(page=page, per_page=page_size)
+        return {"count": response.total, "current_page": response.page, "page_size": response.per_page,
+                "total_pages": response.pages, "results": response.items}
+    offset = (page - 1) * page_size
+    if count_mode == NO_COUNT:
+        results = query.limit(page_size + 1).offset(offset).all()
+        return {"current_page": page, "page_size": page_size, "has_next": len(results) > page_size,
+                "results": results[:page_size]}
+    count = estimate_count(query)
+    return {"count": count, "current_page": page, "page_size": page_size,
+            "total_pages": get_total_pages(count, page_size), "results": query.limit(page_size).offset(offset).all()}
+
+
+def count_records(query, count_mode=EXACT_COUNT):
+    """
+    Counts query records
+    :param query: SQLAlchemy query
+    :param count_mode: exact, estimate or none
+    :return: Records count or None if count_mode is none
+    """
+    if count_mode == NO_COUNT:
+        return None
+    if count_mode == ESTIMATE_COUNT:
+        return estimate_count(query)
+    return query.order_by(None).count()
@@ -11,7 +11,10 @@ DjangoPageSchema = Schema.from_dict(dict(
     current_page=fields.Int(),
     page_size=fields.Int(),
     results=fields.List(fields.Dict()),
-    total_pages=fields.Int()
+    total_pages=fields.Int(),
+    has_next=fields.Bool(),
+    next=fields.Str(allow_none=True),
+    previous=fields.Str(allow_none=True)
 ))
 
 ErrorDetails = Schema.from_dict(dict(
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 authors and contributors All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+from sqlalchemy import or_, func, desc, asc, Index, table, column, text
+from sqlalchemy.sql.sqltypes import String
+
+
+def get_text_columns(model_metadata):
+    """
+    Gets text columns of a model
+    :param model_metadata: ModelMetadata
+    :return: A list of text columns
+    """
+    return [column_ for column_ in model_metadata.columns if isinstance(column_.type, String)]
+
+
+class SearchBackend:
+    """
+    Handles list resources q param search. Implementations filter the list query using searchable columns and can
+    provide a rank used to order results when the request doesn't specify ordering.
+    """
+
+    def search(self, query, model_metadata, columns, term):
+        """
+        Filters query using search term
+
+        :param query: SQLAlchemy query
+        :param model_metadata: ModelMetadata of the queried model
+        :param columns: Searchable columns
+        :param term: Search term
+        :return: A tuple of filtered query and an order by clause(None if results aren't ranked)
+        """
+        raise NotImplementedError()
+
+    def get_default_columns(self, model_metadata):
+        """
+        Gets columns searched when a resource doesn't declare searchable columns
+        :param model_metadata: ModelMetadata of the queried model
+        :return: A list of text columns
+        """
+        return get_text_columns(model_metadata)
+
+
+class LikeSearchBackend(SearchBackend):
+    """
+    Substring search using LIKE '%term%' on each searchable column. Indexes can't serve the search hence it's
+    only suitable for small tables.
+    """
+
+    def search(self, query, model_metadata, columns, term):
+        return query.filter(or_(*[column_.like('%' + term + "%") for column_ in columns])), None
+
+    def get_default_columns(self, model_metadata):
+        """
+        Gets all table columns
+        """
+        return list(model_metadata.table.c)
+
+
+def _document(columns):
+    """
+    Concatenates columns into a single space separated text expression
+    """
+    # Constants are rendered inline for the search expression to match the index expression
+    document = func.coalesce(columns[0], text("''"))
+    for column_ in columns[1:]:
+        document = document.op("||")(text("' '")).op("||")(func.coalesce(column_, text("''")))
+    return document
+
+
+class PostgresFullTextSearchBackend(SearchBackend):
+    """
+    PostgreSQL full text search ranked using ts_rank. Requires a GIN index on the same tsvector expression see
+    build_index() or a stored tsvector column see vector_column.
+    """
+
+    def __init__(self, config="english", vector_column=None):
+        """
+        :param config: Text search configuration i.e. english, simple
+        :param vector_column: Optional name of a stored tsvector column used instead of computing the document
+        """
+        self.config = config
+        self.vector_column = vector_column
+
+    def _regconfig(self):
+        """
+        Text search configuration constant
+        """
+        return text(f"'{self.config}'::regconfig")
+
+    def get_vector(self, model_metadata, columns):
+        """
+        Gets tsvector expression of the searchable columns
+        """
+        if self.vector_column:
+            return model_metadata.table.c[self.vector_column]
+        return func.to_tsvector(self._regconfig(), _document(columns))
+
+    def search(self, query, model_metadata, columns, term):
+        vector = self.get_vector(model_metadata, columns)
+        ts_query = func.plainto_tsquery(self._regconfig(), term)
+        return query.filter(vector.op("@@")(ts_query)), desc(func.ts_rank(vector, ts_query))
+
+    def build_index(self, name, *columns):
+        """
+        Builds GIN index matching the search tsvector expression. Define it after the model class::
+
+            PostgresFullTextSearchBackend().build_index("person_search_idx", Person.full_name, Person.national_id)
+
+        :param name: Index name
+        :param columns: Searchable columns in the same order declared on the resource
+        :return: SQLAlchemy Index
+        """
+        return Index(name, func.to_tsvector(self._regconfig(), _document(columns)), postgresql_using="gin")
+
+
+class TrigramSearchBackend(SearchBackend):
+    """
+    Substring search served by pg_trgm GIN indexes and ranked by trigram similarity. Requires the pg_trgm
+    extension and a GIN index using gin_trgm_ops on each searchable column see build_index()
+    """
+
+    def search(self, query, model_metadata, columns, term):
+        similarity = [func.similarity(column_, term) for column_ in columns]
+        rank = similarity[0] if len(similarity) == 1 else func.greatest(*similarity)
+        return query.filter(or_(*[column_.ilike('%' + term + "%") for column_ in columns])), desc(rank)
+
+    @staticmethod
+    def build_index(name, column_):
+        """
+        Builds trigram GIN index for a searchable column
+        :param name: Index name
+        :param column_: Searchable column
+        :return: SQLAlchemy Index
+        """
+        return Index(name, column_, postgresql_using="gin", postgresql_ops={column_.key: "gin_trgm_ops"})
+
+
+class SqliteFtsSearchBackend(SearchBackend):
+    """
+    SQLite FTS5 search ranked using bm25. Uses an external content FTS5 table kept in sync using triggers see
+    create_fts_table(). The model primary key must be an integer(rowid alias).
+    """
+
+    def __init__(self, fts_table=None):
+        """
+        :param fts_table: FTS5 table name. Defaults to {table name}_fts
+        """
+        self.fts_table = fts_table
+
+    def get_fts_table_name(self, model_metadata):
+        return self.fts_table or f"{model_metadata.table.name}_fts"
+
+    @staticmethod
+    def build_match_query(term):
+        """
+        Builds FTS5 query matching all terms prefixes. Terms are quoted to disable FTS5 query syntax
+        """
+        return " ".join('"' + token.replace('"', '""') + '"*' for token in term.split())
+
+    def search(self, query, model_metadata, columns, term):
+        match_query = self.build_match_query(term)
+        if not match_query:
+            return query, None
+        name = self.get_fts_table_name(model_metadata)
+        fts = table(name, column("rowid"), column("rank"))
+        query = query.join(fts, fts.c.rowid == model_metadata.primary_key) \
+            .filter(text(f'"{name}" MATCH :search_term').bindparams(search_term=match_query))
+        return query, asc(fts.c.rank)
+
+    def create_fts_table(self, connection, model_metadata, columns):
+        """
+        Creates FTS5 table, synchronization triggers and indexes existing records
+
+        :param connection: SQLAlchemy connection or engine
+        :param model_metadata: ModelMetadata of the searched model
+        :param columns: Searchable columns
+        """
+        name = self.get_fts_table_name(model_metadata)
+        source = model_metadata.table.name
+        pk = model_metadata.primary_key.name
+        names = ", ".join(column_.name for column_ in columns)
+        new_values = ", ".join(f"new.{column_.name}" for column_ in columns)
+        old_values = ", ".join(f"old.{column_.name}" for column_ in columns)
+        statements = [
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {name} USING fts5({names}, content='{source}', content_rowid='{pk}')",
+            f"CREATE TRIGGER IF NOT EXISTS {name}_ai AFTER INSERT ON {source} BEGIN "
+            f"INSERT INTO {name}(rowid, {names}) VALUES (new.{pk}, {new_values}); END",
+            f"CREATE TRIGGER IF NOT EXISTS {name}_ad AFTER DELETE ON {source} BEGIN "
+            f"INSERT INTO {name}({name}, rowid, {names}) VALUES ('delete', old.{pk}, {old_values}); END",
+            f"CREATE TRIGGER IF NOT EXISTS {name}_au AFTER UPDATE ON {source} BEGIN "
+            f"INSERT INTO {name}({name}, rowid, {names}) VALUES ('delete', old.{pk}, {old_values}); "
+            f"INSERT INTO {name}(rowid, {names}) VALUES (new.{pk}, {new_values}); END",
+            f"INSERT INTO {name}({name}) VALUES ('rebuild')"
+        ]
+        for statement in statements:
+            connection.execute(text(statement))
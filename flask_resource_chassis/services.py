@@ -13,11 +13,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 # ==============================================================================
+from collections import namedtuple
 from collections.abc import Iterable
+from datetime import datetime
 
+from sqlalchemy import inspect, case
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.state import InstanceState
 
 from .exceptions import ValidationError
+from .introspection import get_model_metadata
 from .utils import RemoteToken
 
 
@@ -27,14 +32,83 @@ def get_primary_key(entity):
     :param entity: SqlAlchemy model
     :return: SqlAlchemy Column
     """
-    for column in getattr(entity, "__table__").c:
-        if column.primary_key:
-            return column
-    return None
+    return get_model_metadata(entity).primary_key
+
+
+def supports_update_returning(dialect):
+    """
+    Checks if a dialect supports UPDATE ... RETURNING
+    :param dialect: SqlAlchemy dialect
+    :return: True if supported otherwise False
+    """
+    # SQLAlchemy 2.0 update_returning, SQLAlchemy 1.4 full_returning
+    return getattr(dialect, "update_returning", getattr(dialect, "full_returning", False))
+
+
+def supports_insert_executemany_returning(dialect):
+    """
+    Checks if a dialect supports INSERT ... RETURNING with multiple parameter sets
+    :param dialect: SqlAlchemy dialect
+    :return: True if supported otherwise False
+    """
+    return getattr(dialect, "insert_executemany_returning", False)
+
+
+def get_violated_unique_indexes(entity, error):
+    """
+    Maps a database IntegrityError back to the entity unique indexes it violated
+    :param entity: SqlAlchemy model
+    :param error: SqlAlchemy IntegrityError
+    :return: A list of violated index names. Empty if the error isn't a unique index violation
+    """
+    metadata = get_model_metadata(entity)
+    message = str(error.orig)
+    # PostgreSQL(psycopg2) exposes the violated constraint name
+    constraint_name = getattr(getattr(error.orig, "diag", None), "constraint_name", None)
+    # SQLite reports the violated columns i.e. UNIQUE constraint failed: person.national_id
+    failed_columns = set()
+    if "UNIQUE constraint failed: " in message:
+        failed_columns = {column.strip() for column in message.split("UNIQUE constraint failed: ", 1)[1].split(",")}
+    violated = []
+    for index in metadata.unique_indexes:
+        columns = {f"{metadata.table.name}.{column.name}" for column in index.columns}
+        if index.name == constraint_name or f'"{index.name}"' in message or f"'{index.name}'" in message \
+                or (failed_columns and columns == failed_columns):
+            violated.append(index.name)
+    return violated
+
+
+# LoggerService method name, arguments and event time of an audit log
+AuditEvent = namedtuple("AuditEvent", ["action", "description", "entity", "record_id", "notes", "token",
+                                       "created_at"])
+
+
+def create_audit_event(action, description, entity, record_id=None, notes="", token: RemoteToken = None):
+    """
+    Creates AuditEvent
+    :param action: LoggerService method name i.e. log_success_creation
+    :return: AuditEvent
+    """
+    return AuditEvent(action, description, entity, record_id, notes, token, datetime.utcnow())
 
 
 class LoggerService:
 
+    def log_events(self, events):
+        """
+        Logs a batch of audit events. By default each event is logged using its log_* method. Implementations writing
+        to a database or remote service should override this method to write the batch at once
+
+        :param events: A list of AuditEvent
+        """
+        for event in events:
+            kwargs = dict(token=event.token)
+            if event.action != "log_failed_creation":
+                kwargs["record_id"] = event.record_id
+            if event.action not in ("log_success_creation", "log_failed_creation"):
+                kwargs["notes"] = event.notes
+            getattr(self, event.action)(event.description, event.entity, **kwargs)
+
     def log_success_creation(self, description, entity, record_id=None, token: RemoteToken = None):
         """
         Logs success creation event
@@ -126,60 +200,279 @@ class ChassisService:
 
         :param entity: SQLAlchemy model
         :return: Newly created SQLAlchemy model with default fields populated
+        :throws: ValidationError if a unique index is violated
         """
         self.app.logger.debug("Inserting new record: Payload: %s", str(entity))
         self.db.session.add(entity)
-        self.db.session.commit()
+        self._commit(entity)
         return entity
 
+    def bulk_create(self, entities):
+        """
+        Creates entities in a single transaction. Entities are inserted using an executemany INSERT per group of
+        provided columns if their primary keys are known(provided or generated by a python side default) or the dialect
+        supports executemany INSERT ... RETURNING i.e. PostgreSQL. Otherwise entities are inserted by the ORM which
+        issues an INSERT per entity to fetch database generated primary keys. Column defaults are applied by the INSERT
+        and the created records are loaded using a single query after committing hence values generated by server
+        defaults and lazy relationships can be serialized.
+
+        :param entities: A list of SQLAlchemy models
+        :return: Created entities in the same order as entities
+        :throws: ValidationError if a unique index is violated
+        """
+        if not entities:
+            return entities
+        self.app.logger.debug("Inserting %d records", len(entities))
+        metadata = get_model_metadata(self.entity)
+        primary_key = metadata.primary_key
+        pk_default = primary_key.default
+        dialect = self.db.session().get_bind(mapper=inspect(metadata.model)).dialect
+        pks_known = all(getattr(entity, primary_key.key) is not None for entity in entities) or \
+            (pk_default is not None and (pk_default.is_scalar or pk_default.is_callable))
+        try:
+            if pks_known or supports_insert_executemany_returning(dialect):
+                record_ids = self._insert_many(entities, fetch_ids=not pks_known)
+            else:
+                self.db.session.add_all(entities)
+                self.db.session.flush()
+                record_ids = [getattr(entity, primary_key.key) for entity in entities]
+        except IntegrityError as ex:
+            self._raise_integrity_error(entities[0], ex)
+        self._commit(entities[0])
+        records = {getattr(record, primary_key.key): record
+                   for record in self.db.session.query(self.entity).filter(primary_key.in_(record_ids))}
+        return [records[record_id] for record_id in record_ids]
+
+    def _insert_many(self, entities, fetch_ids=False):
+        """
+        Inserts entities using an executemany INSERT per group of entities with the same provided columns
+        :param entities: A list of SQLAlchemy models
+        :param fetch_ids: If True primary keys are fetched using INSERT ... RETURNING otherwise primary keys are known
+        :return: Inserted primary keys in the same order as entities
+        """
+        metadata = get_model_metadata(self.entity)
+        primary_key = metadata.primary_key
+        groups = {}
+        for i, entity in enumerate(entities):
+            # Unset primary keys are left out for the INSERT to generate them
+            row = {column.key: entity.__dict__[column.key] for column in metadata.columns
+                   if column.key in entity.__dict__
+                   and (column is not primary_key or entity.__dict__[column.key] is not None)}
+            groups.setdefault(frozenset(row), []).append((i, row))
+        statement = metadata.table.insert()
+        if fetch_ids:
+            dialect = self.db.session().get_bind(mapper=inspect(metadata.model)).dialect
+            # SQLAlchemy 2.0 only guarantees RETURNING rows follow the parameters order if requested
+            if getattr(dialect, "insert_executemany_returning_sort_by_parameter_order", False):
+                statement = statement.returning(primary_key, sort_by_parameter_order=True)
+            else:
+                statement = statement.returning(primary_key)
+        record_ids = [None] * len(entities)
+        for group in groups.values():
+            result = self.db.session.execute(statement, [row for i, row in group])
+            # Primary keys generated by python side defaults are available from the executed parameters
+            ids = [row[0] for row in (result.all() if fetch_ids else result.inserted_primary_key_rows)]
+            for (i, row), record_id in zip(group, ids):
+                record_ids[i] = record_id
+        return record_ids
+
     def update(self, entity, model_id):
         """
-        Updates entity
+        Updates entity. On dialects supporting UPDATE ... RETURNING the update and reload are done in a single
+        statement. Otherwise the update row count is used to detect missing records where the dialect reports sane row
+        counts.
+
         :param entity: Entity
         :param model_id: Entity primary id value
         :return: Updated entity
-        :throws: ValidationError if entity with model_id doesn't exist
+        :throws: ValidationError if entity with model_id doesn't exist or a unique index is violated
         """
         self.app.logger.debug("Updating record: Payload: %s", str(entity))
-        primary_key = get_primary_key(entity)
-        filters = {
-            "is_deleted": False,
-            primary_key.name: model_id
-        }
-        db_entity = self.db.session.query(entity.__table__).filter_by(**filters).first()
-        if db_entity is None:
+        metadata = get_model_metadata(entity)
+        primary_key = metadata.primary_key
+        filters = {primary_key.name: model_id}
+        if metadata.soft_delete:
+            filters["is_deleted"] = False
+        dialect = self.db.session().get_bind(mapper=inspect(metadata.model)).dialect
+        if not dialect.supports_sane_rowcount and not supports_update_returning(dialect):
+            db_entity = self.db.session.query(metadata.table).filter_by(**filters).first()
+            if db_entity is None:
+                raise ValidationError("Sorry record doesn't exist")
+        update_vals = self._get_update_values(entity)
+        if not update_vals:
+            db_entity = self.db.session.query(metadata.table).filter_by(**filters).first()
+            if db_entity is None:
+                raise ValidationError("Sorry record doesn't exist")
+            return db_entity
+        stm = metadata.table.update().values(**update_vals).where(primary_key == model_id)
+        if metadata.soft_delete:
+            stm = stm.where(metadata.table.c.is_deleted == False)  # noqa: E712
+        if supports_update_returning(dialect):
+            record = self._commit(entity, stm.returning(*metadata.columns), fetch=True)
+            if record is None:
+                raise ValidationError("Sorry record doesn't exist")
+            return record
+        result = self._commit(entity, stm)
+        if dialect.supports_sane_rowcount and result.rowcount == 0:
             raise ValidationError("Sorry record doesn't exist")
-        update_vals = {}
+        # Reload entity again after update
+        return self.db.session.query(metadata.table).filter_by(**filters).first()
 
+    def _get_update_values(self, entity):
+        """
+        Gets entity loaded column values excluding the primary key
+        :param entity: Entity
+        :return: A dictionary of column values
+        """
+        primary_key = get_model_metadata(entity).primary_key
+        update_vals = {}
         for key, val in entity.__dict__.items():
             if isinstance(getattr(entity, key), Iterable) and not isinstance(getattr(entity, key), str):
                 self.app.logger.warn("Found many to many field (%s). Unfortunately current implementation "
                                      "doesn't support many to many fields update", getattr(entity, key))
             elif not isinstance(val, InstanceState) and key != primary_key.name:
                 update_vals[key] = val
-        # filters
-        stm = entity.__table__.update().values(**update_vals).where(
-            primary_key == model_id)
-        self.db.session.execute(stm)
-        self.db.session.commit()
-        # Reload entity again after update
-        return self.db.session.query(entity.__table__).filter_by(**filters).first()
+        return update_vals
+
+    def bulk_update(self, entities):
+        """
+        Updates multiple records using set based UPDATE ... WHERE pk IN (...) statements. Records updating the same
+        columns share a statement where columns with different values per record are set using CASE expressions.
+
+        :param entities: A list of partially loaded entities with their primary key value
+        :return: Updated records primary key values. Missing(or deleted) records are skipped
+        :throws: ValidationError if a unique index is violated
+        """
+        metadata = get_model_metadata(self.entity)
+        primary_key = metadata.primary_key
+        values = {getattr(entity, primary_key.key): self._get_update_values(entity) for entity in entities}
+        self.app.logger.debug("Updating %d records", len(values))
+        dialect = self.db.session().get_bind(mapper=inspect(self.entity)).dialect
+        returning = supports_update_returning(dialect)
+        groups = {}
+        for model_id, update_vals in values.items():
+            if update_vals:
+                groups.setdefault(tuple(sorted(update_vals)), []).append(model_id)
+        not_deleted = [metadata.table.c.is_deleted == False] if metadata.soft_delete else []  # noqa: E712
+        if returning:
+            updated = set()
+        else:
+            # Without RETURNING affected records are selected before updating
+            updated = {row[0] for row in self.db.session.query(primary_key)
+                       .filter(primary_key.in_(list(values)), *not_deleted)}
+        statements = []
+        for columns, model_ids in groups.items():
+            if not returning:
+                model_ids = [model_id for model_id in model_ids if model_id in updated]
+                if not model_ids:
+                    continue
+            update_vals = {}
+            for column in columns:
+                column_values = {model_id: values[model_id][column] for model_id in model_ids}
+                distinct = set(map(repr, column_values.values()))
+                if len(distinct) == 1:
+                    update_vals[column] = column_values[model_ids[0]]
+                else:
+                    update_vals[column] = case(column_values, value=primary_key)
+            stm = metadata.table.update().values(**update_vals).where(primary_key.in_(model_ids), *not_deleted)
+            statements.append(stm.returning(primary_key) if returning else stm)
+        try:
+            for stm in statements:
+                result = self.db.session.execute(stm)
+                if returning:
+                    updated.update(row[0] for row in result)
+        except IntegrityError as ex:
+            self._raise_integrity_error(self.entity, ex)
+        self._commit(self.entity)
+        return [model_id for model_id in values if model_id in updated and values[model_id]]
+
+    def bulk_delete(self, record_ids=None, query=None):
+        """
+        Deletes multiple records using a set based statement. Soft delete models are flagged as deleted.
+
+        :param record_ids: Deleted records primary key values
+        :param query: Alternatively a query selecting the deleted records i.e. ChassisResourceList.filter_query()
+        :return: Deleted records primary key values
+        """
+        metadata = get_model_metadata(self.entity)
+        primary_key = metadata.primary_key
+        if record_ids is not None:
+            condition = primary_key.in_(list(record_ids))
+        else:
+            condition = primary_key.in_(query.with_entities(primary_key).order_by(None).subquery().select())
+        filters = [condition]
+        if metadata.soft_delete:
+            filters.append(metadata.table.c.is_deleted == False)  # noqa: E712
+            stm = metadata.table.update().values(is_deleted=True)
+        else:
+            stm = metadata.table.delete()
+        dialect = self.db.session().get_bind(mapper=inspect(self.entity)).dialect
+        if supports_update_returning(dialect):
+            deleted = [row[0] for row in self.db.session.execute(stm.where(*filters).returning(primary_key))]
+        else:
+            # Without RETURNING deleted records are selected before deleting
+            deleted = [row[0] for row in self.db.session.query(primary_key).filter(*filters)]
+            if deleted:
+                self.db.session.execute(stm.where(primary_key.in_(deleted), *filters[1:]))
+        self.app.logger.debug("Deleting %d records", len(deleted))
+        self._commit(self.entity)
+        return deleted
+
+    def _commit(self, entity, statement=None, fetch=False):
+        """
+        Commits current session translating unique index violations to ValidationError
+
+        :param entity: Entity being persisted
+        :param statement: Optional statement executed before committing
+        :param fetch: If True the first row returned by statement is fetched before committing
+        :return: statement result or the first row if fetch is True
+        """
+        try:
+            result = None
+            if statement is not None:
+                result = self.db.session.execute(statement)
+                if fetch:
+                    result = result.first()
+            self.db.session.commit()
+            return result
+        except IntegrityError as ex:
+            self._raise_integrity_error(entity, ex)
+
+    def _raise_integrity_error(self, entity, error):
+        """
+        Rolls back current session and translates unique index violations to ValidationError
+        :param entity: Entity being persisted
+        :param error: IntegrityError
+        :throws: ValidationError if a unique index is violated otherwise error is raised
+        """
+        self.db.session.rollback()
+        violated_indexes = get_violated_unique_indexes(entity, error)
+        if violated_indexes:
+            self.app.logger.debug("Unique indexes %s violated. %s", violated_indexes, error)
+            raise ValidationError("Similar record already exists", violated_indexes)
+        raise error
 
     def delete(self, record_id):
         """
-        Deleting record using record_id
+        Deleting record using record_id. Soft delete models are flagged as deleted using a single UPDATE statement
+        while other models are deleted using a single DELETE statement. The statement row count is used to detect
+        missing records where the dialect reports sane row counts.
+
         :param record_id: Record id
+        :throws: ValidationError if record with record_id doesn't exist
         """
         self.app.logger.debug("Deleting record. Record id %s", str(record_id))
-        primary_column = get_primary_key(self.entity)
-        filters = {primary_column.name: record_id}
-        if hasattr(self.entity, "is_deleted"):
-            filters["is_deleted"] = False
-        record = self.entity.query.filter_by(**filters).first()
-        if record is None:
-            raise ValidationError("Record doesn't exist")
-        if hasattr(self.entity, "is_deleted"):
-            record.is_deleted = True
+        metadata = get_model_metadata(self.entity)
+        filters = [metadata.primary_key == record_id]
+        if metadata.soft_delete:
+            filters.append(metadata.table.c.is_deleted == False)  # noqa: E712
+            stm = metadata.table.update().values(is_deleted=True)
         else:
-            self.db.session.delete(record)
-        self.db.session.commit()
+            stm = metadata.table.delete()
+        dialect = self.db.session().get_bind(mapper=inspect(self.entity)).dialect
+        if not dialect.supports_sane_rowcount:
+            if self.db.session.query(metadata.primary_key).filter(*filters).first() is None:
+                raise ValidationError("Record doesn't exist")
+        result = self._commit(self.entity, stm.where(*filters))
+        if dialect.supports_sane_rowcount and result.rowcount == 0:
+            raise ValidationError("Record doesn't exist")
@@ -0,0 +1,404 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 authors and contributors All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import hashlib
+import json
+import logging
+import socket
+import sqlite3
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class TokenCache:
+    """
+    Caches token introspection responses. Tokens are keyed using their SHA-256 hash. Active tokens are cached until
+    the earliest of token expiry(exp) and ttl while inactive tokens are cached for negative_ttl seconds.
+    Implementations provide get() and set() storage.
+    """
+
+    def __init__(self, ttl=300, negative_ttl=30):
+        """
+        :param ttl: Maximum seconds an active token introspection response is cached
+        :param negative_ttl: Seconds an inactive token introspection response is cached. 0 disables negative caching
+        """
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def get_key(token_string):
+        """
+        Gets cache key of a token
+        :param token_string: Access token
+        :return: Token hash
+        """
+        return hashlib.sha256(token_string.encode()).hexdigest()
+
+    def get_token(self, token_string):
+        """
+        Gets cached token introspection response
+        :param token_string: Access token
+        :return: Introspection response dictionary or None if token isn't cached
+        """
+        payload = self.get(self.get_key(token_string))
+        if payload is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return payload
+
+    def set_token(self, token_string, payload):
+        """
+        Caches token introspection response
+        :param token_string: Access token
+        :param payload: Introspection response dictionary
+        """
+        now = time.time()
+        if payload.get("active", False):
+            expires_at = now + self.ttl
+            exp = payload.get("exp")
+            if isinstance(exp, (int, float)):
+                expires_at = min(expires_at, exp)
+        else:
+            expires_at = now + self.negative_ttl
+        if expires_at > now:
+            self.set(self.get_key(token_string), payload, expires_at - now)
+
+    def stats(self):
+        """
+        Cache statistics
+        :return: A dictionary with hits and misses
+        """
+        return {"hits": self.hits, "misses": self.misses}
+
+    @staticmethod
+    def serialize(value):
+        """
+        Serializes cached value to compact JSON bytes. Used by shared cache backends
+        :param value: A dictionary
+        :return: bytes
+        """
+        return json.dumps(value, separators=(",", ":")).encode()
+
+    @staticmethod
+    def deserialize(data):
+        """
+        Reverses serialize()
+        :param data: bytes
+        :return: A dictionary
+        """
+        return json.loads(data)
+
+    def get(self, key):
+        """
+        Gets cached value
+        :param key: cache key
+        :return: Cached value or None if missing or expired
+        """
+        raise NotImplementedError()
+
+    def set(self, key, value, timeout):
+        """
+        Caches value
+        :param key: cache key
+        :param value: A dictionary
+        :param timeout: Seconds to cache the value
+        """
+        raise NotImplementedError()
+
+
+class MemoryTokenCache(TokenCache):
+    """
+    In process LRU token cache bounded by max_size
+    """
+
+    def __init__(self, max_size=10000, ttl=300, negative_ttl=30):
+        """
+        :param max_size: Maximum cached tokens. Least recently used tokens are evicted first
+        :param ttl: Maximum seconds an active token introspection response is cached
+        :param negative_ttl: Seconds an inactive token introspection response is cached
+        """
+        super().__init__(ttl, negative_ttl)
+        self.max_size = max_size
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout):
+        with self._lock:
+            self._entries[key] = (value, time.time() + timeout)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        stats = super().stats()
+        stats.update(size=len(self._entries), evictions=self.evictions)
+        return stats
+
+    def clear(self):
+        """
+        Removes all cached tokens
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+class SqliteTokenCache(TokenCache):
+    """
+    Token cache stored in a SQLite database file. Processes on the same host i.e. gunicorn workers sharing the database
+    file share cached tokens
+    """
+
+    def __init__(self, path, ttl=300, negative_ttl=30, purge_interval=1000):
+        """
+        :param path: SQLite database file path
+        :param ttl: Maximum seconds an active token introspection response is cached
+        :param negative_ttl: Seconds an inactive token introspection response is cached
+        :param purge_interval: Expired tokens are deleted after every purge_interval cached tokens
+        """
+        super().__init__(ttl, negative_ttl)
+        self.path = path
+        self.purge_interval = purge_interval
+        self._writes = 0
+        self._local = threading.local()
+        self._connection().execute("CREATE TABLE IF NOT EXISTS token_cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, "
+                                   "expires_at REAL NOT NULL) WITHOUT ROWID")
+
+    def _connection(self):
+        # SQLite connections can't be shared across threads
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, key):
+        try:
+            row = self._connection().execute("SELECT value FROM token_cache WHERE key = ? AND expires_at > ?",
+                                             (key, time.time())).fetchone()
+        except sqlite3.Error as ex:
+            logger.warning("Failed to read token cache. %s", ex)
+            return None
+        return self.deserialize(row[0]) if row else None
+
+    def set(self, key, value, timeout):
+        try:
+            connection = self._connection()
+            connection.execute("INSERT OR REPLACE INTO token_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                               (key, self.serialize(value), time.time() + timeout))
+            self._writes += 1
+            if self._writes % self.purge_interval == 0:
+                connection.execute("DELETE FROM token_cache WHERE expires_at <= ?", (time.time(),))
+        except sqlite3.Error as ex:
+            logger.warning("Failed to cache token. %s", ex)
+
+
+class RedisError(Exception):
+    """
+    Redis error reply
+    """
+    pass
+
+
+class RedisTokenCache(TokenCache):
+    """
+    Token cache stored in Redis(or any server speaking the Redis protocol) shared by all processes and hosts. Uses a
+    minimal Redis protocol client with a kept alive connection per thread. Cache errors are logged and treated as
+    cache misses
+    """
+
+    def __init__(self, host="localhost", port=6379, db=0, password=None, prefix="chassis:token:",
+                 socket_timeout=1.0, ttl=300, negative_ttl=30):
+        """
+        :param host: Redis host
+        :param port: Redis port
+        :param db: Redis database number
+        :param password: Optional Redis password
+        :param prefix: Cache keys prefix
+        :param socket_timeout: Connect and read timeout in seconds
+        :param ttl: Maximum seconds an active token introspection response is cached
+        :param negative_ttl: Seconds an inactive token introspection response is cached
+        """
+        super().__init__(ttl, negative_ttl)
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.prefix = prefix
+        self.socket_timeout = socket_timeout
+        self._local = threading.local()
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        """
+        Creates cache from a redis url i.e. redis://:password@localhost:6379/0
+        """
+        parsed = urllib.parse.urlparse(url)
+        db = int(parsed.path.lstrip("/") or 0)
+        return cls(parsed.hostname or "localhost", parsed.port or 6379, db, parsed.password, **kwargs)
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.socket_timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._local.socket = sock
+        self._local.reader = sock.makefile("rb")
+        if self.password:
+            self._send("AUTH", self.password)
+        if self.db:
+            self._send("SELECT", self.db)
+
+    def _close(self):
+        sock = getattr(self._local, "socket", None)
+        self._local.socket = None
+        if sock is not None:
+            try:
+                self._local.reader.close()
+                sock.close()
+            except OSError:
+                pass
+
+    def _send(self, *args):
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        self._local.socket.sendall(b"".join(parts))
+        return self._read_reply()
+
+    def _read_reply(self):
+        line = self._local.reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("Redis connection closed")
+        prefix, payload = line[:1], line[1:-2]
+        if prefix == b"+":
+            return payload
+        if prefix == b"-":
+            raise RedisError(payload.decode())
+        if prefix == b":":
+            return int(payload)
+        if prefix == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            return self._local.reader.read(length + 2)[:-2]
+        if prefix == b"*":
+            length = int(payload)
+            return None if length < 0 else [self._read_reply() for _ in range(length)]
+        raise RedisError(f"Unexpected reply {line!r}")
+
+    def execute(self, *args):
+        """
+        Executes a Redis command. Stale connections are reconnected once
+        :param args: Command and arguments i.e. "GET", key
+        :return: Command reply
+        """
+        for attempt in range(2):
+            reconnected = getattr(self._local, "socket", None) is None
+            try:
+                if reconnected:
+                    self._connect()
+                return self._send(*args)
+            except (OSError, ConnectionError):
+                self._close()
+                if reconnected or attempt:
+                    raise
+            except RedisError:
+                self._close()
+                raise
+
+    def get(self, key):
+        try:
+            data = self.execute("GET", self.prefix + key)
+        except (OSError, RedisError) as ex:
+            logger.warning("Failed to read token cache. %s", ex)
+            return None
+        return self.deserialize(data) if data is not None else None
+
+    def set(self, key, value, timeout):
+        try:
+            self.execute("SET", self.prefix + key, self.serialize(value), "PX", max(int(timeout * 1000), 1))
+        except (OSError, RedisError) as ex:
+            logger.warning("Failed to cache token. %s", ex)
+
+
+class _Call:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key. The first caller executes the function while the others wait and
+    receive its result or exception
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function, *args):
+        """
+        Executes function unless a call with the same key is in flight
+        :param key: Call key
+        :param function: Function to execute
+        :param args: Function arguments
+        :return: Function result
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = function(*args)
+            return call.result
+        except Exception as ex:
+            call.error = ex
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
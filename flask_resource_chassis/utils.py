@@ -1,6 +1,8 @@
 import base64
 import functools
+import logging
 import os
+import threading
 import time
 import traceback
 import unittest
@@ -11,16 +13,25 @@ from datetime import datetime, timedelta
 
 import requests
 from authlib.integrations.flask_oauth2 import ResourceProtector
+from authlib.jose import JsonWebToken, JsonWebKey, JoseError
 from authlib.oauth2.rfc6749 import MissingAuthorizationError, TokenMixin
-from authlib.oauth2.rfc6750 import BearerTokenValidator, InvalidTokenError
-from flask import json
+from authlib.oauth2.rfc6749.util import scope_to_list
+from authlib.oauth2.rfc6750 import BearerTokenValidator, InvalidTokenError, InsufficientScopeError
+from flask import json, g, request
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
+from urllib3.util.retry import Retry
 from sqlalchemy import TypeDecorator, CHAR
 
+from .circuit_breaker import CircuitBreaker
 from .exceptions import AccessDeniedError
+from .introspection import get_model_metadata
 from .schemas import ResponseWrapper
+from .token_cache import TokenCache, SingleFlight
 from sqlalchemy.dialects.postgresql import UUID
 
+logger = logging.getLogger(__name__)
+
 
 def unauthorized(error):
     print("Authorization error", error)
@@ -45,19 +56,86 @@ def validation_error_handler(err):
 
 class DefaultRemoteTokenValidator(BearerTokenValidator):
 
-    def __init__(self, token_introspect_url, client_id, client_secret, realm=None):
+    # Client error statuses which don't reject the token itself i.e. invalid client credentials or rate limiting
+    NON_DEFINITIVE_STATUS_CODES = (401, 403, 408, 429)
+
+    def __init__(self, token_introspect_url, client_id, client_secret, realm=None, token_cache: TokenCache = None,
+                 pool_size=10, timeout=(3.05, 10), retries=2, backoff_factor=0.3, failure_threshold=5,
+                 recovery_timeout=30):
+        """
+        :param token_introspect_url: Authorization server token introspection url
+        :param client_id: oauth2 client id
+        :param client_secret: oauth2 client secret
+        :param realm: Realm
+        :param token_cache: Optional TokenCache used to cache introspection responses i.e. MemoryTokenCache
+        :param pool_size: Maximum kept alive connections to the authorization server
+        :param timeout: Introspection request timeout in seconds. Either a single value or (connect, read) tuple
+        :param retries: Retries on connection errors and 502, 503 and 504 responses
+        :param backoff_factor: Retries exponential backoff factor
+        :param failure_threshold: Consecutive failed introspection requests which open the circuit breaker. While
+        open tokens which aren't cached are rejected without calling the authorization server
+        :param recovery_timeout: Seconds the circuit breaker stays open
+        """
         super().__init__(realm)
         self.token_cls = RemoteToken
         self.token_introspect_url = token_introspect_url
         self.client_id = client_id
         self.client_secret = client_secret
+        self.token_cache = token_cache
+        self.timeout = timeout
+        self.circuit_breaker = CircuitBreaker(failure_threshold, recovery_timeout)
+        self.single_flight = SingleFlight()
+        self.session = requests.Session()
+        self.session.auth = HTTPBasicAuth(client_id, client_secret)
+        retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=(502, 503, 504),
+                      allowed_methods=frozenset(["POST"]), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
 
     def authenticate_token(self, token_string):
-        res = requests.post(self.token_introspect_url, data={'token': token_string},
-                            auth=HTTPBasicAuth(self.client_id, self.client_secret))
-        print("Retrospect token response", res.status_code, res.json())
+        if self.token_cache:
+            payload = self.token_cache.get_token(token_string)
+            if payload is not None:
+                return self.token_cls(payload)
+        # Concurrent requests with the same token share a single introspection call
+        payload = self.single_flight.do(TokenCache.get_key(token_string), self._load_token, token_string)
+        if payload is None:
+            return None
+        return self.token_cls(payload)
+
+    def _load_token(self, token_string):
+        payload = self.introspect_token(token_string)
+        if payload is not None and self.token_cache:
+            self.token_cache.set_token(token_string, payload)
+        return payload
+
+    def introspect_token(self, token_string):
+        """
+        Introspects token using the authorization server. Client error responses rejecting the token i.e. 400 from
+        check_token endpoints are treated as inactive token responses hence they are negative cached
+        :param token_string: Access token
+        :return: Introspection response dictionary or None if the request fails or the circuit breaker is open
+        """
+        if not self.circuit_breaker.allow_request():
+            logger.warning("Token introspection circuit breaker is open. Rejecting token")
+            return None
+        try:
+            res = self.session.post(self.token_introspect_url, data={'token': token_string}, timeout=self.timeout)
+        except requests.RequestException as ex:
+            self.circuit_breaker.record_failure()
+            logger.error("Token introspection request failed. %s", ex)
+            return None
+        if res.status_code >= 500:
+            self.circuit_breaker.record_failure()
+        else:
+            self.circuit_breaker.record_success()
+        logger.debug("Introspect token response status %s", res.status_code)
         if res.ok:
-            return self.token_cls(res.json())
+            return res.json()
+        if 400 <= res.status_code < 500 and res.status_code not in self.NON_DEFINITIVE_STATUS_CODES:
+            logger.debug("Token rejected by the authorization server. Status %s", res.status_code)
+            return {"active": False}
 
         return None
 
@@ -68,10 +146,156 @@ class DefaultRemoteTokenValidator(BearerTokenValidator):
         return token.is_revoked()
 
 
+class JwtTokenValidator(BearerTokenValidator):
+    """
+    Verifies JWT access tokens locally using the authorization server JSON Web Key Set(JWKS) instead of calling the
+    token introspection endpoint. Keys are cached for jwks_ttl seconds and refreshed in the background when stale or
+    when a token is signed using an unknown key id(kid).
+    """
+
+    DEFAULT_ALGORITHMS = ["RS256", "RS384", "RS512", "PS256", "PS384", "PS512", "ES256", "ES384", "ES512"]
+
+    def __init__(self, jwks_url, audience=None, issuer=None, leeway=0, jwks_ttl=3600, refresh_interval=30,
+                 refresh_timeout=5, algorithms=None, realm=None):
+        """
+        :param jwks_url: Authorization server JWKS url. file:// urls are read from the file system
+        :param audience: Expected aud claim. Not validated if None
+        :param issuer: Expected iss claim. Not validated if None
+        :param leeway: Seconds of clock skew tolerated when validating exp, nbf and iat
+        :param jwks_ttl: Seconds the key set is cached before it's refreshed in the background
+        :param refresh_interval: Minimum seconds between key set refreshes. Limits refreshes triggered by unknown kid
+        :param refresh_timeout: Maximum seconds a request waits for keys refresh when the token kid is unknown
+        :param algorithms: Accepted signing algorithms. Defaults to asymmetric algorithms
+        :param realm: Realm
+        """
+        super().__init__(realm)
+        self.token_cls = RemoteToken
+        self.jwks_url = jwks_url
+        self.leeway = leeway
+        self.jwks_ttl = jwks_ttl
+        self.refresh_interval = refresh_interval
+        self.refresh_timeout = refresh_timeout
+        self.jwt = JsonWebToken(algorithms or self.DEFAULT_ALGORITHMS)
+        self.claims_options = {"exp": {"essential": True}}
+        if audience:
+            self.claims_options["aud"] = {"essential": True, "value": audience}
+        if issuer:
+            self.claims_options["iss"] = {"essential": True, "value": issuer}
+        self._key_set = None
+        self._keys_loaded_at = 0
+        self._last_refresh = 0
+        self._refresh_thread = None
+        self._refresh_lock = threading.Lock()
+
+    def authenticate_token(self, token_string):
+        try:
+            claims = self.jwt.decode(token_string, self.find_key, claims_options=self.claims_options)
+            claims.validate(leeway=self.leeway)
+            if claims.get("iat", 0) > time.time() + self.leeway:
+                raise ValueError("Token issued in the future")
+        except (JoseError, ValueError) as ex:
+            logger.debug("Invalid JWT access token. %s", ex)
+            return None
+        payload = dict(claims)
+        scope = payload.get("scope", payload.get("scp"))
+        if isinstance(scope, (list, tuple)):
+            scope = " ".join(scope)
+        payload["scope"] = scope
+        payload["active"] = True
+        return self.token_cls(payload)
+
+    def fetch_jwks(self):
+        """
+        Fetches the JSON Web Key Set
+        :return: JWKS dictionary
+        """
+        if self.jwks_url.startswith("file://"):
+            with open(urllib.parse.urlparse(self.jwks_url).path) as jwks_file:
+                return json.load(jwks_file)
+        res = requests.get(self.jwks_url, timeout=self.refresh_timeout)
+        res.raise_for_status()
+        return res.json()
+
+    def refresh_keys(self):
+        """
+        Refreshes the key set in a background thread. Concurrent calls share a single refresh and refreshes are limited
+        to one per refresh_interval.
+        :return: The refresh thread or None if keys were refreshed within refresh_interval
+        """
+        with self._refresh_lock:
+            if self._refresh_thread is not None and self._refresh_thread.is_alive():
+                return self._refresh_thread
+            if time.time() - self._last_refresh < self.refresh_interval:
+                return None
+            self._last_refresh = time.time()
+            self._refresh_thread = threading.Thread(target=self._load_keys, name="jwks-refresh", daemon=True)
+            self._refresh_thread.start()
+            return self._refresh_thread
+
+    def _load_keys(self):
+        try:
+            key_set = JsonWebKey.import_key_set(self.fetch_jwks())
+        except Exception as ex:
+            logger.warning("Failed to load JWKS from %s. %s", self.jwks_url, ex)
+            return
+        self._key_set = key_set
+        self._keys_loaded_at = time.time()
+
+    def _wait_refresh(self):
+        thread = self.refresh_keys()
+        if thread is not None:
+            thread.join(self.refresh_timeout)
+
+    def find_key(self, header, payload):
+        """
+        Finds the token verification key using the token header kid
+        :param header: JWT header
+        :param payload: JWT payload
+        :return: Key
+        :throws ValueError: If the key isn't found even after refreshing the key set
+        """
+        if self._key_set is None:
+            self._wait_refresh()
+        elif time.time() - self._keys_loaded_at > self.jwks_ttl:
+            self.refresh_keys()
+        kid = header.get("kid")
+        key = self._get_key(kid)
+        if key is None:
+            # Keys might have been rotated
+            self._wait_refresh()
+            key = self._get_key(kid)
+        if key is None:
+            raise ValueError(f"Unknown signing key {kid}")
+        return key
+
+    def _get_key(self, kid):
+        key_set = self._key_set
+        if key_set is None:
+            return None
+        if kid is None:
+            return key_set.keys[0] if len(key_set.keys) == 1 else None
+        try:
+            return key_set.find_by_kid(kid)
+        except ValueError:
+            return None
+
+    def request_invalid(self, request):
+        return False
+
+    def token_revoked(self, token):
+        return False
+
+    def token_expired(self, token):
+        # exp is validated when decoding the token
+        return False
+
+
 class RemoteToken(TokenMixin):
 
     def __init__(self, token):
         self.token = token
+        self._scope_set = None
+        self._authority_set = None
 
     def get_client_id(self):
         return self.token.get('client_id', None)
@@ -97,11 +321,88 @@ class RemoteToken(TokenMixin):
     def get_user_id(self):
         return self.token.get("user_id", None)
 
+    def get_scope_set(self):
+        """
+        Token scopes parsed once per token
+        :return: frozenset of scopes
+        """
+        if self._scope_set is None:
+            self._scope_set = frozenset(scope_to_list(self.get_scope()) or ())
+        return self._scope_set
+
+    def get_authority_set(self):
+        """
+        Token authorities parsed once per token
+        :return: frozenset of authorities
+        """
+        if self._authority_set is None:
+            self._authority_set = frozenset(self.get_authorities() or ())
+        return self._authority_set
+
 
 class CustomResourceProtector(ResourceProtector):
+
+    def acquire_token(self, scope=None, operator='AND'):
+        """
+        Acquires current request token. The token is validated once per request and stored in flask.g hence later
+        calls within the same request only check the scope
+
+        :param scope: client scope. Either a string, list or a frozenset compiled using compile_scope()
+        :param operator: value of "AND" or "OR"
+        :return: token object
+        """
+        authorization = request.headers.get("Authorization")
+        tokens = g.setdefault("chassis_tokens", {})
+        token = tokens.get((id(self), authorization))
+        if token is None:
+            token = super().acquire_token(None, operator)
+            tokens[(id(self), authorization)] = token
+        if not callable(operator):
+            operator = operator.upper()
+        if self.scope_insufficient(token, self.compile_scope(scope), operator):
+            raise InsufficientScopeError()
+        return token
+
+    @staticmethod
+    def compile_scope(scope):
+        """
+        Converts scope to a frozenset
+        :param scope: A space separated string, list or frozenset of scopes
+        :return: frozenset or None if scope is empty
+        """
+        if isinstance(scope, frozenset):
+            return scope or None
+        return frozenset(scope_to_list(scope) or ()) or None
+
+    @staticmethod
+    def scope_insufficient(token, scopes, operator='AND'):
+        """
+        Checks if token scopes are insufficient
+        :param token: Token
+        :param scopes: frozenset of required scopes
+        :param operator: value of "AND", "OR" or a callable receiving token scopes and required scopes
+        :return: True if token scopes are insufficient
+        """
+        if not scopes:
+            return False
+        if isinstance(token, RemoteToken):
+            token_scopes = token.get_scope_set()
+        else:
+            token_scopes = frozenset(scope_to_list(token.get_scope()) or ())
+        if not token_scopes:
+            return True
+        if operator == 'AND':
+            return not token_scopes.issuperset(scopes)
+        if operator == 'OR':
+            return token_scopes.isdisjoint(scopes)
+        if callable(operator):
+            return not operator(token_scopes, scopes)
+        raise ValueError('Invalid operator value')
+
     def __call__(self, scope=None, operator='AND', optional=False, has_any_authority=None):
         """
-        Adds authority/permission validation
+        Adds authority/permission validation. Scopes and permissions are compiled to frozensets once hence each request
+        is checked using a set intersection
 
         :param scope: client scope
         :param operator:
@@ -109,24 +410,23 @@ class CustomResourceProtector(ResourceProtector):
         :param has_any_authority: User/oauth client permissions
         :return: decorator function
         """
+        scopes = self.compile_scope(scope)
+        authorities = frozenset(has_any_authority) if has_any_authority else None
 
         def wrapper(f):
             @functools.wraps(f)
             def decorated(*args, **kwargs):
                 try:
-                    token = self.acquire_token(scope, operator)
+                    token = self.acquire_token(scopes, operator)
                     if token is None:
                         raise Exception(f"Validating token request. {str(token)}")
                     args = args + (token,)
-                    if has_any_authority:
-                        def filter_permission(perm):
-                            if perm in has_any_authority:
-                                return True
-                            else:
-                                return False
-
-                        filters = filter(filter_permission, token.get_authorities())
-                        if not any(filters):
+                    if authorities:
+                        if isinstance(token, RemoteToken):
+                            token_authorities = token.get_authority_set()
+                        else:
+                            token_authorities = token.get_authorities()
+                        if authorities.isdisjoint(token_authorities):
                             raise AccessDeniedError()
                 except MissingAuthorizationError as error:
                     print("Authentication error ", error)
@@ -174,10 +474,7 @@ class TestChassis:
         """
         if entity is None:
             entity = self.schema.Meta.model
-        for column in getattr(entity, "__table__").c:
-            if column.primary_key:
-                return column
-        return None
+        return get_model_metadata(entity).primary_key
 
     def creation_test(self, payload, unique_fields=None, rel_fields=None):
         """
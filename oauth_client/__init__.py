@@ -12,9 +12,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 # ==============================================================================
+import logging
+import threading
 from datetime import datetime
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
 
 
 class OAuthToken:
@@ -35,18 +41,39 @@ class OAuthToken:
         """
         return (self.issued_at + self.expires_in) > datetime.timestamp(datetime.utcnow())
 
+    def should_refresh(self, refresh_ratio):
+        """
+        Checks if refresh_ratio of the token lifetime has elapsed
+        :param refresh_ratio: Fraction of expires_in after which the token is renewed i.e. 0.8
+        :return: true if the token should be renewed otherwise false
+        """
+        return (self.issued_at + self.expires_in * refresh_ratio) <= datetime.timestamp(datetime.utcnow())
+
 
 class OAuth2Requests(requests.Session):
     """
     Enables oauth2 bearer token request on requests. Retrieves and refreshes access token automatically
     """
 
-    def __init__(self, oauth_client_id, oauth_client_secret, oauth_url, scopes=None):
+    def __init__(self, oauth_client_id, oauth_client_secret, oauth_url, scopes=None, refresh_ratio=0.8,
+                 background_refresh=False, pool_connections=10, pool_maxsize=10, pool_block=False, max_retries=0,
+                 token_timeout=(3.05, 10), token_retries=2, token_backoff_factor=0.3):
         """
         :param oauth_client_id: oauth2 client id
         :param oauth_client_secret: oauth2 client secret
         :param oauth_url: oauth2 server url
         :param scopes: Oauth2 scopes
+        :param refresh_ratio: Fraction of the token expires_in after which the token is renewed proactively
+        :param background_refresh: If true tokens are renewed proactively in a background thread while requests keep
+        using the current token
+        :param pool_connections: Number of hosts whose connection pools are cached
+        :param pool_maxsize: Maximum kept alive connections per host
+        :param pool_block: If true requests wait for a free connection instead of opening connections beyond
+        pool_maxsize
+        :param max_retries: HTTPAdapter max_retries for requests i.e. number of retries or urllib3 Retry
+        :param token_timeout: Token request timeout in seconds. Either a single value or (connect, read) tuple
+        :param token_retries: Token request retries on connection errors and 502, 503 and 504 responses
+        :param token_backoff_factor: Token request retries exponential backoff factor
         """
         super().__init__()
         self.oauth_url = oauth_url
@@ -54,29 +81,95 @@ class OAuth2Requests(requests.Session):
         self.oauth_client_id = oauth_client_id
         self.scopes = scopes
         self.oauth_token = None
+        self.refresh_ratio = refresh_ratio
+        self.background_refresh = background_refresh
+        self.token_timeout = token_timeout
+        self._token_lock = threading.RLock()
+        self._refresh_lock = threading.Lock()
+        self._refresh_thread = None
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=max_retries,
+                              pool_block=pool_block)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+        # Token requests use a dedicated session hence they don't compete with requests for pooled connections
+        self.token_session = requests.Session()
+        retry = Retry(total=token_retries, backoff_factor=token_backoff_factor, status_forcelist=(502, 503, 504),
+                      allowed_methods=frozenset(["POST"]), raise_on_status=False)
+        token_adapter = HTTPAdapter(pool_connections=1, pool_maxsize=2, max_retries=retry)
+        self.token_session.mount("http://", token_adapter)
+        self.token_session.mount("https://", token_adapter)
 
     def retrieve_access_token(self):
         """
         Requests new access token from the authorization server.
         :raises Exception: In case of http connection error
         """
-        print(f"OAuth2Requests: Retrieving a new access token from server "
-              f"{self.oauth_url} for client {self.oauth_client_id}")
-        response = requests.post(self.oauth_url, auth=(self.oauth_client_id, self.oauth_client_secret),
-                                 data=dict(grant_type="client_credentials", scope=self.scopes))
-        if response.ok:
-            body = response.json()
-            self.oauth_token = OAuthToken()
-            self.oauth_token.token = body.get("access_token")
-            self.oauth_token.expires_in = body.get("expires_in")
-            self.oauth_token.scopes = body.get("scope")
-            # Remove 2 seconds to account for connection time
-            self.oauth_token.issued_at = datetime.timestamp(datetime.utcnow()) - 2000
-            response.close()
-        else:
-            text = response.text
-            response.close()
-            raise Exception(f"Failed to retrieve access token from authorization server. Details: {text}")
+        with self._token_lock:
+            logger.info("Retrieving a new access token from server %s for client %s", self.oauth_url,
+                        self.oauth_client_id, extra=dict(oauth_url=self.oauth_url, client_id=self.oauth_client_id))
+            response = self.token_session.post(self.oauth_url, auth=(self.oauth_client_id, self.oauth_client_secret),
+                                               data=dict(grant_type="client_credentials", scope=self.scopes),
+                                               timeout=self.token_timeout)
+            if response.ok:
+                body = response.json()
+                oauth_token = OAuthToken()
+                oauth_token.token = body.get("access_token")
+                oauth_token.expires_in = body.get("expires_in")
+                oauth_token.scopes = body.get("scope")
+                # Remove 2 seconds to account for connection time
+                oauth_token.issued_at = datetime.timestamp(datetime.utcnow()) - 2
+                self.oauth_token = oauth_token
+                response.close()
+            else:
+                text = response.text
+                response.close()
+                logger.error("Failed to retrieve access token. Status %s", response.status_code,
+                             extra=dict(oauth_url=self.oauth_url, client_id=self.oauth_client_id,
+                                        status_code=response.status_code))
+                raise Exception(f"Failed to retrieve access token from authorization server. Details: {text}")
+
+    def get_token(self):
+        """
+        Gets a valid access token. Tokens are renewed once refresh_ratio of their lifetime has elapsed while still
+        valid, hence requests don't wait for renewal unless the token has expired. Concurrent callers share a single
+        renewal.
+        :return: OAuthToken
+        """
+        oauth_token = self.oauth_token
+        if oauth_token is None or not oauth_token.is_active():
+            return self._renew_token(oauth_token)
+        if oauth_token.should_refresh(self.refresh_ratio):
+            if self.background_refresh:
+                self._renew_token_in_background(oauth_token)
+            elif self._token_lock.acquire(blocking=False):
+                # Other threads keep using the current token while it's renewed
+                try:
+                    self._renew_token(oauth_token, raise_error=False)
+                finally:
+                    self._token_lock.release()
+        return self.oauth_token
+
+    def _renew_token(self, stale_token, raise_error=True):
+        """
+        Renews stale_token unless another thread already renewed it
+        """
+        with self._token_lock:
+            if self.oauth_token is stale_token:
+                try:
+                    self.retrieve_access_token()
+                except Exception as ex:
+                    if raise_error:
+                        raise
+                    logger.warning("Access token renewal failed. Using current token. %s", ex)
+            return self.oauth_token
+
+    def _renew_token_in_background(self, stale_token):
+        with self._refresh_lock:
+            if self._refresh_thread is not None and self._refresh_thread.is_alive():
+                return
+            self._refresh_thread = threading.Thread(target=self._renew_token, args=(stale_token, False),
+                                                    name="oauth2-token-refresh", daemon=True)
+            self._refresh_thread.start()
 
     def request(
             self,
@@ -86,13 +179,11 @@ class OAuth2Requests(requests.Session):
             headers=None,
             **kwargs
     ):
-        if self.oauth_token is None:
-            self.retrieve_access_token()
-        # print(f"Retrieved access token: {self.oauth_token.token}")
+        oauth_token = self.get_token()
         response = self._make_request(method, url, data=data, headers=headers, **kwargs)
-        # If authorization error reload token
+        # If authorization error reload token i.e. token was revoked
         if response.status_code == 401:
-            self.retrieve_access_token()
+            self._renew_token(oauth_token)
             return self._make_request(method, url, data=data, headers=headers, **kwargs)
         else:
             return response
@@ -116,11 +207,7 @@ class OAuth2Requests(requests.Session):
         Gets access token. If token has expired an new one is requested.
         :return: returns OAuthToken
         """
-        if self.oauth_token and self.oauth_token.is_active():
-            return self.oauth_token
-        else:
-            self.retrieve_access_token()
-            return self.oauth_token
+        return self.get_token()
 
 
 class SaslOauthTokenProvider:
@@ -140,7 +227,7 @@ class SaslOauthTokenProvider:
         :return: access_token
         :rtype: str
         """
-        print("Retrieving access token from authorization server for kafka connection")
+        logger.debug("Retrieving access token from authorization server for kafka connection")
         return self.oauth2_requests.access_token.token
 
     def extensions(self):
@@ -152,4 +239,4 @@ class SaslOauthTokenProvider:
         not implemented, the values are ignored. This feature is only available
         in Kafka >= 2.1.0.
         """
-        return {}
\ No newline at end of file
+        return {}
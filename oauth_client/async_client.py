@@ -0,0 +1,193 @@
+# Copyright (C)  Authors and contributors All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import asyncio
+import logging
+from datetime import datetime
+
+import httpx
+
+from . import OAuthToken
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncOAuth2Client:
+    """
+    asyncio variant of OAuth2Requests built on httpx. A single pooled connection client and access token are shared by
+    all tasks. Retrieves and refreshes access token automatically
+    """
+
+    def __init__(self, oauth_client_id, oauth_client_secret, oauth_url, scopes=None, refresh_ratio=0.8,
+                 max_connections=100, max_keepalive_connections=20, max_concurrency=None, timeout=10.0,
+                 **client_kwargs):
+        """
+        :param oauth_client_id: oauth2 client id
+        :param oauth_client_secret: oauth2 client secret
+        :param oauth_url: oauth2 server url
+        :param scopes: Oauth2 scopes
+        :param refresh_ratio: Fraction of the token expires_in after which the token is renewed in the background
+        :param max_connections: Maximum open connections
+        :param max_keepalive_connections: Maximum idle kept alive connections
+        :param max_concurrency: Maximum concurrent requests. Unlimited if None
+        :param timeout: Requests timeout in seconds
+        :param client_kwargs: Extra httpx.AsyncClient arguments i.e. transport, base_url
+        """
+        self.oauth_url = oauth_url
+        self.oauth_client_secret = oauth_client_secret
+        self.oauth_client_id = oauth_client_id
+        self.scopes = scopes
+        self.refresh_ratio = refresh_ratio
+        self.max_concurrency = max_concurrency
+        self.oauth_token = None
+        self.client = httpx.AsyncClient(limits=httpx.Limits(max_connections=max_connections,
+                                                            max_keepalive_connections=max_keepalive_connections),
+                                        timeout=timeout, **client_kwargs)
+        # asyncio primitives are created on first use to bind them to the running event loop
+        self._token_lock = None
+        self._semaphore = None
+        self._refresh_task = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.aclose()
+
+    async def aclose(self):
+        """
+        Cancels pending background token renewal and closes pooled connections
+        """
+        refresh_task = self._refresh_task
+        if refresh_task is not None and not refresh_task.done():
+            refresh_task.cancel()
+            try:
+                await refresh_task
+            except asyncio.CancelledError:
+                pass
+        await self.client.aclose()
+
+    async def retrieve_access_token(self):
+        """
+        Requests new access token from the authorization server.
+        :raises Exception: In case of http connection error
+        """
+        logger.info("Retrieving a new access token from server %s for client %s", self.oauth_url,
+                    self.oauth_client_id, extra=dict(oauth_url=self.oauth_url, client_id=self.oauth_client_id))
+        data = dict(grant_type="client_credentials")
+        # requests drops None form values while httpx sends them as empty strings
+        if self.scopes is not None:
+            data["scope"] = self.scopes
+        response = await self.client.post(self.oauth_url, auth=(self.oauth_client_id, self.oauth_client_secret),
+                                          data=data)
+        if response.is_error:
+            logger.error("Failed to retrieve access token. Status %s", response.status_code,
+                         extra=dict(oauth_url=self.oauth_url, client_id=self.oauth_client_id,
+                                    status_code=response.status_code))
+            raise Exception(f"Failed to retrieve access token from authorization server. Details: {response.text}")
+        body = response.json()
+        oauth_token = OAuthToken()
+        oauth_token.token = body.get("access_token")
+        oauth_token.expires_in = body.get("expires_in")
+        oauth_token.scopes = body.get("scope")
+        # Remove 2 seconds to account for connection time
+        oauth_token.issued_at = datetime.timestamp(datetime.utcnow()) - 2
+        self.oauth_token = oauth_token
+
+    async def get_token(self):
+        """
+        Gets a valid access token. Tokens are renewed in a background task once refresh_ratio of their lifetime has
+        elapsed hence requests only wait for renewal if the token has expired. Concurrent tasks share a single renewal.
+        :return: OAuthToken
+        """
+        oauth_token = self.oauth_token
+        if oauth_token is None or not oauth_token.is_active():
+            return await self._renew_token(oauth_token)
+        if oauth_token.should_refresh(self.refresh_ratio) and (self._refresh_task is None or self._refresh_task.done()):
+            self._refresh_task = asyncio.ensure_future(self._renew_token(oauth_token, raise_error=False))
+        return oauth_token
+
+    async def _renew_token(self, stale_token, raise_error=True):
+        """
+        Renews stale_token unless another task already renewed it
+        """
+        if self._token_lock is None:
+            self._token_lock = asyncio.Lock()
+        async with self._token_lock:
+            if self.oauth_token is stale_token:
+                try:
+                    await self.retrieve_access_token()
+                except Exception:
+                    if raise_error:
+                        raise
+        return self.oauth_token
+
+    async def request(self, method, url, headers=None, **kwargs):
+        """
+        Sends authorized request. Requests are retried once with a new token on 401 responses
+        :param method: http method
+        :param url: url
+        :param headers: Optional request headers
+        :param kwargs: httpx.AsyncClient.request arguments i.e. json, params
+        :return: httpx.Response
+        """
+        if self.max_concurrency and self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        if self._semaphore is None:
+            return await self._request(method, url, headers, **kwargs)
+        async with self._semaphore:
+            return await self._request(method, url, headers, **kwargs)
+
+    async def _request(self, method, url, headers=None, **kwargs):
+        oauth_token = await self.get_token()
+        response = await self._make_request(oauth_token, method, url, headers, **kwargs)
+        # If authorization error reload token i.e. token was revoked
+        if response.status_code == 401:
+            oauth_token = await self._renew_token(oauth_token)
+            return await self._make_request(oauth_token, method, url, headers, **kwargs)
+        return response
+
+    async def _make_request(self, oauth_token, method, url, headers=None, **kwargs):
+        headers = dict(headers) if headers else {}
+        headers["Authorization"] = f"Bearer {oauth_token.token}"
+        return await self.client.request(method, url, headers=headers, **kwargs)
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    async def put(self, url, **kwargs):
+        return await self.request("PUT", url, **kwargs)
+
+    async def patch(self, url, **kwargs):
+        return await self.request("PATCH", url, **kwargs)
+
+    async def delete(self, url, **kwargs):
+        return await self.request("DELETE", url, **kwargs)
+
+    async def gather(self, *calls, return_exceptions=False):
+        """
+        Sends requests concurrently::
+
+            person, country = await client.gather(("GET", "http://person-service/v1/person/1"),
+                                                  ("GET", "http://country-service/v1/country/1", dict(params=params)))
+
+        :param calls: Tuples of method, url and optional request arguments dictionary
+        :param return_exceptions: If True exceptions are returned instead of being raised
+        :return: A list of responses in the same order as calls
+        """
+        return await asyncio.gather(*[self.request(call[0], call[1], **(call[2] if len(call) > 2 else {}))
+                                      for call in calls], return_exceptions=return_exceptions)
@@ -1,5 +1,10 @@
 # from unittest import TestCase
+import json
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 from apispec import APISpec
 from apispec.ext.marshmallow import MarshmallowPlugin
@@ -12,7 +17,11 @@ from flask_restful import Api
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import event, func, Column, Index
 
-from flask_resource_chassis import ChassisResource, ChassisResourceList, Scope
+from flask_resource_chassis import ChassisResource, ChassisResourceList, Scope, BulkCreateMixin, BulkUpdateMixin, \
+    BulkDeleteMixin
+from flask_resource_chassis.introspection import get_model_metadata
+from flask_resource_chassis.search import SqliteFtsSearchBackend
+from flask_resource_chassis.services import LoggerService
 from flask_resource_chassis.exceptions import AccessDeniedError
 from flask_resource_chassis.utils import validation_error_handler, CustomResourceProtector, \
     RemoteToken
@@ -60,6 +69,25 @@ class Country(db.Model):
     iso_code = db.Column(db.String(2), nullable=False)
 
 
+class Reading(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    sensor = db.Column(db.String(254), nullable=False)
+    value = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, server_default=func.now(), default=datetime.utcnow)
+
+
+class Ticket(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.String(254), nullable=False)
+    status = db.Column(db.String(20), nullable=False, server_default="open")
+    created_at = db.Column(db.DateTime, nullable=False, server_default=func.now())
+    # Context sensitive default
+    code = db.Column(db.String(254), default=lambda context: context.get_current_parameters()["title"].upper())
+    location_id = db.Column(db.Integer, db.ForeignKey(Location.id, ondelete='RESTRICT'))
+
+    location = db.relationship('Location')
+
+
 @event.listens_for(Gender.__table__, 'after_create')
 def insert_default_grant(target, connection, **kw):
     db.session.add(Gender(gender="Male", is_active=False))
@@ -119,8 +147,24 @@ class CountrySchema(marshmallow.SQLAlchemyAutoSchema):
         include_fk = True
 
 
+class ReadingSchema(marshmallow.SQLAlchemyAutoSchema):
+    class Meta:
+        model = Reading
+        load_instance = True
+
+
+class TicketSchema(marshmallow.SQLAlchemyAutoSchema):
+    class Meta:
+        model = Ticket
+        load_instance = True
+        include_fk = True
+        dump_only = ("status", "created_at", "code")
+
+    location_name = marshmallow.Function(lambda ticket: ticket.location.name if ticket.location else None)
+
+
 @doc(tags=["Test Resource"])
-class TestApiList(ChassisResourceList):
+class TestApiList(BulkCreateMixin, ChassisResourceList):
 
     def __init__(self):
         super().__init__(flask_test_app, db, PersonSchema, "Test Resource", resource_protector=resource_protector,
@@ -157,12 +201,79 @@ class TestCountryApi(ChassisResource):
                          fetch_scope=Scope(scopes="read update delete", operator="OR"))
 
 
+class TestOptimisticApiList(ChassisResourceList):
+
+    def __init__(self):
+        super().__init__(flask_test_app, db, PersonSchema, "Test Resource", optimistic_unique=True)
+
+
+class TestCursorApiList(ChassisResourceList):
+
+    def __init__(self):
+        super().__init__(flask_test_app, db, PersonSchema, "Test Resource", pagination="cursor")
+
+
+person_search_backend = SqliteFtsSearchBackend()
+person_search_backend.create_fts_table(db.engine, get_model_metadata(Person), [Person.full_name, Person.national_id])
+
+
+class TestSearchApiList(ChassisResourceList):
+
+    def __init__(self):
+        super().__init__(flask_test_app, db, PersonSchema, "Test Resource", search_backend=person_search_backend,
+                         search_fields=["full_name", "national_id"])
+
+
+class AuditRecorder(LoggerService):
+
+    def __init__(self):
+        self.batches = []
+
+    def log_events(self, events):
+        self.batches.append(events)
+
+
+bulk_audit_recorder = AuditRecorder()
+
+
+class TestBulkApiList(BulkCreateMixin, BulkUpdateMixin, BulkDeleteMixin, ChassisResourceList):
+
+    def __init__(self):
+        super().__init__(flask_test_app, db, PersonSchema, "Test Resource", logger_service=bulk_audit_recorder,
+                         bulk_max_size=5)
+
+
+class TestReadingList(ChassisResourceList):
+
+    def __init__(self):
+        super().__init__(flask_test_app, db, ReadingSchema, "Reading", export_batch_size=500)
+
+
+class TestTicketList(BulkCreateMixin, ChassisResourceList):
+
+    def __init__(self):
+        super().__init__(flask_test_app, db, TicketSchema, "Ticket", logger_service=bulk_audit_recorder)
+
+
+class TestOptimisticApi(ChassisResource):
+
+    def __init__(self):
+        super().__init__(flask_test_app, db, PersonSchema, "Test Resource", optimistic_unique=True)
+
+
 # Restful api configuration
 api = Api(flask_test_app)
 api.add_resource(TestApiList, "/v1/person")
 api.add_resource(TestApi, "/v1/person/<int:id>")
 api.add_resource(TestCountryList, "/v1/country")
 api.add_resource(TestCountryApi, "/v1/country/<int:id>")
+api.add_resource(TestOptimisticApiList, "/v1/optimistic/person")
+api.add_resource(TestOptimisticApi, "/v1/optimistic/person/<int:id>")
+api.add_resource(TestCursorApiList, "/v1/cursor/person")
+api.add_resource(TestSearchApiList, "/v1/search/person")
+api.add_resource(TestBulkApiList, "/v1/bulk/person")
+api.add_resource(TestReadingList, "/v1/reading")
+api.add_resource(TestTicketList, "/v1/ticket")
 # Swagger documentation configuration
 flask_test_app.config.update({
     'APISPEC_SPEC': APISpec(
@@ -186,6 +297,7 @@ docs.register(TestApiList)
 docs.register(TestApi)
 docs.register(TestCountryList)
 docs.register(TestCountryApi)
+docs.register(TestBulkApiList)
 
 flask_test_app.register_error_handler(422, validation_error_handler)
 
@@ -211,3 +323,75 @@ def scope_access_denied(error):
 
 
 flask_test_app.testing = True
+
+
+@contextmanager
+def count_statements(engine=None):
+    """
+    Records SQL statements executed within the block::
+
+        with count_statements() as statements:
+            ...
+        self.assertEqual(len(statements), 1)
+
+    :param engine: SQLAlchemy engine. Defaults to the test database engine
+    """
+    engine = engine if engine is not None else db.engine
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+class IntrospectionStub:
+    """
+    Local token introspection server counting requests and TCP connections
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.connections = 0
+        self.status_code = 200
+        self.authorization = None
+        self.delay = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def handle(self):
+                stub.connections += 1
+                super().handle()
+
+            def do_POST(self):
+                stub.requests += 1
+                time.sleep(stub.delay)
+                stub.authorization = self.headers.get("Authorization")
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                body = json.dumps(dict(active=True, user_id="user1", exp=time.time() + 3600)).encode()
+                self.send_response(stub.status_code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}/oauth/check_token"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
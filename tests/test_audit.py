@@ -0,0 +1,179 @@
+# Copyright (C)  Authors and contributors All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import atexit
+import os
+import tempfile
+import threading
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+from sqlalchemy import create_engine, select, func
+
+from flask_resource_chassis.audit import QueueingLoggerService, SqlAuditSink, DROP_NEW, DROP_OLDEST, BLOCK
+from flask_resource_chassis.services import LoggerService, create_audit_event
+from flask_resource_chassis.utils import RemoteToken
+from tests import Person, count_statements
+
+
+class RecordingLoggerService(LoggerService):
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.batches = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def log_events(self, events):
+        self.release.wait()
+        time.sleep(self.delay)
+        self.batches.append(list(events))
+
+
+class TestQueueingLoggerService(TestCase):
+
+    def test_batching(self):
+        """
+        Tests events are written in batches by size and interval
+        """
+        sink = RecordingLoggerService()
+        logger_service = QueueingLoggerService(sink, batch_size=100, flush_interval=0.5)
+        started = time.monotonic()
+        for index in range(250):
+            logger_service.log_success_creation(f"Created person {index}", Person, index)
+        self.assertLess(time.monotonic() - started, 0.5, "Logging doesn't wait for writes")
+        logger_service.flush()
+        self.assertEqual(sum(len(batch) for batch in sink.batches), 250)
+        self.assertEqual([len(batch) for batch in sink.batches[:2]], [100, 100])
+        self.assertEqual(sink.batches[0][0].description, "Created person 0")
+        self.assertEqual(sink.batches[0][0].action, "log_success_creation")
+        logger_service.shutdown()
+
+        sink = RecordingLoggerService()
+        logger_service = QueueingLoggerService(sink, batch_size=100, flush_interval=0.05)
+        logger_service.log_success_update("Updated person", Person, 1)
+        time.sleep(0.3)
+        self.assertEqual(len(sink.batches), 1, "Partial batches are written after flush_interval")
+        logger_service.shutdown()
+
+    def test_overflow(self):
+        """
+        Tests queue overflow policies
+        """
+        for overflow, expected in ((DROP_NEW, [0, 1, 2]), (DROP_OLDEST, [0, 3, 4]), (BLOCK, [0, 1, 2])):
+            sink = RecordingLoggerService()
+            sink.release.clear()
+            logger_service = QueueingLoggerService(sink, max_queue_size=2, batch_size=1, flush_interval=0,
+                                                   overflow=overflow, block_timeout=0.05)
+            logger_service.log_success_deletion("Deleted 0", Person, 0)
+            time.sleep(0.2)  # Worker is blocked writing the first event
+            for index in range(1, 5):
+                logger_service.log_success_deletion(f"Deleted {index}", Person, index)
+            self.assertEqual(logger_service.stats().get("dropped"), 2, overflow)
+            sink.release.set()
+            logger_service.flush()
+            self.assertEqual([batch[0].record_id for batch in sink.batches], expected, overflow)
+            logger_service.shutdown()
+
+        # Concurrent drops are all counted
+        sink = RecordingLoggerService()
+        sink.release.clear()
+        logger_service = QueueingLoggerService(sink, max_queue_size=1, batch_size=1, flush_interval=0,
+                                               overflow=DROP_NEW)
+        logger_service.log_success_deletion("Deleted 0", Person, 0)
+        time.sleep(0.2)
+        logger_service.log_success_deletion("Deleted 1", Person, 1)
+
+        def log_events():
+            for _ in range(500):
+                logger_service.log_success_deletion("Deleted", Person, 2)
+
+        threads = [threading.Thread(target=log_events) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(logger_service.stats().get("dropped"), 4000)
+        sink.release.set()
+        logger_service.shutdown()
+
+    def test_shutdown(self):
+        """
+        Tests queued events are flushed on shutdown and failures don't stop the worker
+        """
+        sink = RecordingLoggerService(delay=0.01)
+        logger_service = QueueingLoggerService(sink, batch_size=10, flush_interval=1)
+        for index in range(50):
+            logger_service.log_failed_update("Failed to update person", Person, index)
+        with patch.object(atexit, "unregister") as unregister:
+            logger_service.shutdown()
+            unregister.assert_called_once_with(logger_service.shutdown)
+        self.assertEqual(sum(len(batch) for batch in sink.batches), 50)
+        logger_service.log_failed_deletion("Failed to delete person", Person, 1)
+        self.assertEqual(sum(len(batch) for batch in sink.batches), 51, "Written synchronously after shutdown")
+
+        class FailingLoggerService(LoggerService):
+            calls = []
+
+            def log_success_creation(self, description, entity, record_id=None, token=None):
+                self.calls.append(record_id)
+                if record_id == 1:
+                    raise Exception("Audit service unavailable")
+
+        sink = FailingLoggerService()
+        logger_service = QueueingLoggerService(sink, batch_size=1, flush_interval=0)
+        for index in range(3):
+            logger_service.log_success_creation("Created person", Person, index)
+        logger_service.flush()
+        self.assertEqual(sink.calls, [0, 1, 2], "Plain LoggerService methods receive the events")
+        self.assertEqual(logger_service.stats().get("failed"), 1)
+        logger_service.shutdown()
+
+
+class TestSqlAuditSink(TestCase):
+
+    def test_bulk_insert(self):
+        """
+        Tests batches are written using a single INSERT statement
+        """
+        database_file, path = tempfile.mkstemp(suffix=".sqlite3")
+        os.close(database_file)
+        try:
+            engine = create_engine(f"sqlite:///{path}")
+            sink = SqlAuditSink(engine)
+            sink.create_table()
+            token = RemoteToken(dict(user_id="26957b74-47d0-40df-96a1-f104f3828552", client_id="client1"))
+            with count_statements(engine) as statements:
+                sink.log_events([create_audit_event("log_success_creation", "Created person", Person, index,
+                                                    token=token) for index in range(100)])
+            self.assertEqual(len([statement for statement in statements if statement.startswith("INSERT")]), 1)
+
+            logger_service = QueueingLoggerService(sink, batch_size=50, flush_interval=1)
+            for index in range(120):
+                logger_service.log_failed_deletion("Failed to delete person", Person, index, "Not found")
+            logger_service.shutdown()
+            with engine.connect() as connection:
+                self.assertEqual(connection.execute(select(func.count()).select_from(sink.table)).scalar(), 220)
+                row = connection.execute(select(sink.table).order_by(sink.table.c.id)).first()
+                self.assertEqual(row.entity, "Person")
+                self.assertEqual(row.record_id, "0")
+                self.assertEqual(row.client_id, "client1")
+                self.assertTrue(row.success)
+                failed = connection.execute(select(func.count()).select_from(sink.table)
+                                            .where(sink.table.c.success == False)).scalar()  # noqa: E712
+                self.assertEqual(failed, 120)
+            engine.dispose()
+        finally:
+            os.remove(path)
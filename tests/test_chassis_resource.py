@@ -12,12 +12,18 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 # ==============================================================================
+import base64
+import csv
+import io
+import tracemalloc
 from datetime import datetime, timedelta
 from unittest import TestCase
 
 from authlib.oauth2.rfc6750 import InvalidTokenError
 from flask import Flask, json
-from tests import flask_test_app, Person, db, Gender, Country
+
+from flask_resource_chassis import validate_foreign_keys, validate_unique_constraints, ValidationError
+from tests import flask_test_app, Person, db, Gender, Country, Reading, bulk_audit_recorder, count_statements
 
 
 class TestResourceChassis(TestCase):
@@ -314,5 +320,328 @@ class TestResourceChassis(TestCase):
         country = Country.query.filter_by(id=country_id).first()
         self.assertIsNone(country, "is_deleted attribute verification test")
 
+    def test_foreign_key_validation(self):
+        """
+        Tests foreign key validation messages and that a single query is issued per referred table
+        """
+        with count_statements() as statements:
+            validate_foreign_keys(Person(full_name="Test", gender_id=2, location_id=1), db)
+        self.assertEqual(len(statements), 2, "One query per referred table")
+        with self.assertRaises(ValidationError) as context:
+            validate_foreign_keys(Person(full_name="Test", gender_id=2, location_id=-1), db)
+        self.assertEqual(context.exception.message, "Sorry Location doesn't exist")
+        with self.assertRaises(ValidationError) as context:
+            validate_foreign_keys(Person(full_name="Test", gender_id=1, location_id=1), db)
+        self.assertEqual(context.exception.message, "Sorry Gender Doc is not active")
+
+    def test_unique_constraints_validation(self):
+        """
+        Tests unique constraints are validated using a single query reporting the violated index
+        """
+        person = Person(full_name="Unique User", gender_id=2, national_id="55511122")
+        db.session.add(person)
+        db.session.commit()
+        with count_statements() as statements:
+            with self.assertRaises(ValidationError) as context:
+                validate_unique_constraints(Person(full_name="Test", national_id="55511122"), db)
+        self.assertEqual(context.exception.errors, ["unique_national_id"])
+        self.assertEqual(len(statements), 1, "Single unique constraints query")
+        validate_unique_constraints(Person(full_name="Test", national_id="55511122"), db, person.id)
+        validate_unique_constraints(Person(full_name="Test", national_id="55511123"), db)
+
+    def test_optimistic_unique(self):
+        """
+        Tests unique index violations are reported as validation errors when unique pre-checks are skipped
+        """
+        payload = {"full_name": "Optimistic User", "gender_id": 2, "national_id": "77700011"}
+        response = self.client.post("/v1/optimistic/person", data=json.dumps(payload),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        person_id = response.json.get("id")
+        response = self.client.post("/v1/optimistic/person", data=json.dumps(payload),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json.get("message"), "Similar record already exists")
+
+        payload["national_id"] = "77700012"
+        response = self.client.post("/v1/optimistic/person", data=json.dumps(payload),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        response = self.client.patch(f"/v1/optimistic/person/{response.json.get('id')}",
+                                     data=json.dumps(dict(payload, national_id="77700011")),
+                                     content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json.get("errors"), ["Similar record already exists"])
+        # Deleted records don't violate the partial unique index
+        self.client.delete(f"/v1/person/{person_id}", headers={"Authorization": "Bearer admin_token"})
+        response = self.client.post("/v1/optimistic/person", data=json.dumps(dict(payload, national_id="77700011")),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+
+    def test_cursor_pagination(self):
+        """
+        Tests keyset pagination traversing pages forward and backwards
+        """
+        for i in range(5):
+            db.session.add(Person(full_name=f"Cursor User {i % 2}", gender_id=2))
+        db.session.commit()
+        expected = [person.id for person in Person.query.filter_by(is_deleted=False)
+                    .order_by(Person.full_name.desc(), Person.id.desc())]
+
+        pages = []
+        response = self.client.get("/v1/cursor/person?page_size=2&ordering=-full_name")
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.json.get("previous"))
+        self.assertEqual(response.json.get("count"), len(expected))
+        pages.append(response.json)
+        while response.json.get("next"):
+            response = self.client.get(f"/v1/cursor/person?page_size=2&ordering=-full_name"
+                                       f"&cursor={response.json.get('next')}")
+            self.assertEqual(response.status_code, 200)
+            pages.append(response.json)
+        self.assertEqual([record.get("id") for page in pages for record in page.get("results")], expected)
+        self.assertEqual(len(pages), response.json.get("total_pages"))
+        # Traverse backwards
+        previous = pages[-1].get("previous")
+        for page in reversed(pages[:-1]):
+            response = self.client.get(f"/v1/cursor/person?page_size=2&ordering=-full_name&cursor={previous}")
+            self.assertEqual(response.json.get("results"), page.get("results"))
+            previous = response.json.get("previous")
+        self.assertIsNone(previous)
+
+        response = self.client.get("/v1/cursor/person?cursor=invalid")
+        self.assertEqual(response.status_code, 400)
+        for payload in ([0, [1, 2], 1], [0, {"x": 1}, 1], [0, {"decimal": "abc"}, 1],
+                        [0, {"date": "2020-01-01", "uuid": "x"}, 1], [2, "a", 1]):
+            cursor = base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+            response = self.client.get(f"/v1/cursor/person?ordering=-full_name&cursor={cursor}")
+            self.assertEqual(response.status_code, 400, payload)
+        response = self.client.get("/v1/cursor/person?ordering=unknown")
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get("/v1/cursor/person?ordering=national_id")
+        self.assertEqual(response.status_code, 400, "Nullable columns can't be used for keyset pagination")
+        self.assertIn("nullable", response.json["message"])
+        response = self.client.get("/v1/cursor/person?ordering=-full_name")
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get("/v1/cursor/person?page_size=2&ordering=created_at")
+        response = self.client.get(f"/v1/cursor/person?page_size=2&ordering=created_at"
+                                   f"&cursor={response.json.get('next')}")
+        self.assertEqual(response.status_code, 200)
+
+    def test_list_export(self):
+        """
+        Tests streaming all matching records as NDJSON and CSV
+        """
+        headers = {"Authorization": "Bearer admin_token"}
+        response = self.client.get("/v1/person?format=ndjson", headers=headers)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        records = [json.loads(line) for line in response.data.decode().splitlines()]
+        self.assertEqual(len(records), Person.query.filter_by(is_deleted=False).count())
+        response = self.client.get("/v1/person?gender_id=2&ordering=-id",
+                                   headers={"Accept": "text/csv", **headers})
+        self.assertEqual(response.mimetype, "text/csv")
+        rows = list(csv.DictReader(io.StringIO(response.data.decode())))
+        self.assertEqual([int(row["id"]) for row in rows],
+                         [person.id for person in Person.query.filter_by(is_deleted=False, gender_id=2)
+                         .order_by(Person.id.desc())])
+        self.assertEqual(self.client.get("/v1/person?format=xml", headers=headers).status_code, 400)
+
+        readings = [dict(sensor=f"sensor-{i % 10}", value=i, created_at=datetime.utcnow()) for i in range(60000)]
+        db.session.execute(Reading.__table__.insert(), readings)
+        db.session.commit()
 
+        def export_peak_memory(url):
+            tracemalloc.start()
+            try:
+                lines = 0
+                response = self.client.get(url, buffered=False)
+                for chunk in response.response:
+                    lines += chunk.count(b"\n")
+                response.close()
+                return lines, tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        small_lines, small_peak = export_peak_memory("/v1/reading?format=ndjson&sensor=sensor-1&value=1")
+        lines, peak = export_peak_memory("/v1/reading?format=ndjson")
+        self.assertEqual(small_lines, 1)
+        self.assertEqual(lines, 60000)
+        self.assertLess(peak, small_peak + 4 * 1024 * 1024, "Memory doesn't grow with the number of records")
+        lines, peak = export_peak_memory("/v1/reading?format=csv&sensor=sensor-1")
+        self.assertEqual(lines, 6001, "Header and 6000 rows")
+
+    def test_list_count_modes(self):
+        """
+        Tests listing with exact, estimated and skipped records count
+        """
+        for i in range(3):
+            db.session.add(Person(full_name=f"Count User {i}", gender_id=2))
+        db.session.commit()
+        headers = {"Authorization": "Bearer admin_token"}
+        exact = self.client.get("/v1/person?page_size=2", headers=headers).json
+        response = self.client.get("/v1/person?page_size=2&count=estimate", headers=headers)
+        self.assertEqual(response.json.get("count"), exact.get("count"), "SQLite falls back to exact count")
+        self.assertEqual(response.json.get("total_pages"), exact.get("total_pages"))
+
+        with count_statements() as statements:
+            response = self.client.get("/v1/person?page_size=2&count=none", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([statement for statement in statements if "count(" in statement.lower()])
+        self.assertIsNone(response.json.get("count"))
+        self.assertTrue(response.json.get("has_next"))
+        self.assertEqual(response.json.get("results"), exact.get("results"))
+        last_page = exact.get("total_pages")
+        response = self.client.get(f"/v1/person?page_size=2&count=none&page={last_page}", headers=headers)
+        self.assertFalse(response.json.get("has_next"))
+        self.assertTrue(len(response.json.get("results")) >= 1)
+
+        response = self.client.get("/v1/cursor/person?count=none")
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.json.get("count"))
+        response = self.client.get("/v1/person?count=invalid", headers=headers)
+        self.assertEqual(response.status_code, 400)
+        for params in ("count=none&page=0", "count=estimate&page=-1", "count=none&page_size=0"):
+            response = self.client.get(f"/v1/person?{params}", headers=headers)
+            self.assertEqual(response.status_code, 400, params)
+
+    def test_list_bulk_creation(self):
+        """
+        Tests creating multiple records using a JSON array
+        """
+        headers = {"Authorization": "Bearer admin_token"}
+        records = [dict(full_name="Bulk User1", gender_id=2, national_id="BULK-1"),
+                   dict(full_name="Bulk User2", gender_id=1, national_id="BULK-2"),
+                   dict(full_name="Bulk User3", gender_id=2, national_id="BULK-1"),
+                   dict(gender_id=2, national_id="BULK-4"),
+                   dict(full_name="Bulk User5", gender_id=2, location_id=2, national_id="BULK-5")]
+        response = self.client.post("/v1/person", json=records, headers={"Authorization": "Bearer guest_token"})
+        self.assertEqual(response.status_code, 403)
 
+        response = self.client.post("/v1/person", json=records, headers=headers)
+        self.assertEqual(response.status_code, 400, "All or nothing")
+        results = response.json["data"]["results"]
+        self.assertEqual([result["status"] for result in results], [400] * 5)
+        self.assertEqual(results[1]["message"], "Sorry Gender Doc is not active")
+        self.assertEqual(results[2]["message"], "Duplicate record in request")
+        self.assertIn("full_name", results[3]["errors"])
+        self.assertEqual(Person.query.filter(Person.national_id.like("BULK-%")).count(), 0)
+
+        with count_statements() as statements:
+            response = self.client.post("/v1/person?mode=partial", json=records, headers=headers)
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.json["data"]["created"], 2)
+        results = response.json["data"]["results"]
+        self.assertEqual([result["status"] for result in results], [201, 400, 400, 400, 201])
+        self.assertEqual(Person.query.get(results[4]["data"]["id"]).national_id, "BULK-5")
+        selects = [statement for statement in statements if statement.startswith("SELECT")]
+        self.assertEqual(len(selects), 4, "A query per referred table, unique index and created records")
+
+        response = self.client.post("/v1/person", json=[records[0]], headers=headers)
+        self.assertEqual(response.json["data"]["results"][0]["message"], "Similar record already exists")
+        self.assertEqual(response.json["data"]["results"][0]["errors"], ["unique_national_id"])
+
+        # Known primary keys are inserted using a single executemany
+        records = [dict(id=100000 + i, full_name=f"Bulk User{i}", gender_id=2, national_id=f"BULK-ID-{i}")
+                   for i in range(5)]
+        with count_statements() as statements:
+            response = self.client.post("/v1/bulk/person", json=records)
+        self.assertEqual(response.status_code, 201, response.json)
+        self.assertEqual(len([statement for statement in statements if statement.startswith("INSERT")]), 1)
+        self.assertEqual(Person.query.get(100003).full_name, "Bulk User3")
+        self.assertIsNotNone(response.json["data"]["results"][0]["data"]["created_at"])
+        self.assertEqual(len(bulk_audit_recorder.batches[-1]), 5, "Audit events are logged in one batch")
+        self.assertEqual(bulk_audit_recorder.batches[-1][0].record_id, 100000)
+
+        response = self.client.post("/v1/bulk/person", json=records + [records[0]])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("maximum of 5", response.json["message"])
+        response = self.client.post("/v1/bulk/person?mode=invalid", json=records)
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post("/v1/bulk/person", json=[])
+        self.assertEqual(response.status_code, 400, "Empty array")
+        response = self.client.post("/v1/country", json=[dict(country_name="Kenya", iso_code="KE")],
+                                    headers=headers)
+        self.assertEqual(response.status_code, 400, "Bulk creation is opt-in")
+        self.assertEqual(response.json["data"], {"_schema": ["Invalid input type."]})
+
+    def test_list_bulk_creation_server_defaults(self):
+        """
+        Tests records created in bulk include values generated by server defaults
+        """
+        for records in ([dict(title="Ticket1", location_id=2), dict(title="Ticket2", location_id=2)],
+                        [dict(id=100, title="Ticket100", location_id=2), dict(id=101, title="Ticket101")]):
+            response = self.client.post("/v1/ticket", json=records)
+            self.assertEqual(response.status_code, 201, response.json)
+            for record, result in zip(records, response.json["data"]["results"]):
+                self.assertEqual(result["data"]["status"], "open")
+                self.assertIsNotNone(result["data"]["created_at"])
+                self.assertIsNotNone(result["data"]["id"])
+                self.assertEqual(result["data"]["code"], record["title"].upper(), "Context sensitive default")
+                self.assertEqual(result["data"]["location_name"], "Earth" if "location_id" in record else None,
+                                 "Lazy relationship")
+            self.assertEqual(len(bulk_audit_recorder.batches[-1]), 2)
+
+    def test_list_bulk_update_delete(self):
+        """
+        Tests updating and deleting multiple records using set based statements
+        """
+        records = [dict(id=200000 + i, full_name=f"Batch User{i}", gender_id=2, age=20, national_id=f"BATCH-{i}")
+                   for i in range(5)]
+        response = self.client.post("/v1/bulk/person", json=records)
+        self.assertEqual(response.status_code, 201, response.json)
+        response = self.client.patch("/v1/person", json=[dict(id=200000, age=30)],
+                                     headers={"Authorization": "Bearer admin_token"})
+        self.assertEqual(response.status_code, 405, "Bulk update is disabled by default")
+        response = self.client.delete("/v1/person", json=dict(ids=[200000]),
+                                      headers={"Authorization": "Bearer admin_token"})
+        self.assertEqual(response.status_code, 405, "Bulk delete is disabled by default")
+        paths = self.client.get("/swagger/").json["paths"]
+        self.assertNotIn("patch", paths["/v1/person"])
+        self.assertNotIn("delete", paths["/v1/person"])
+        self.assertIn("patch", paths["/v1/bulk/person"])
+        self.assertIn("delete", paths["/v1/bulk/person"])
+
+        # Invalid records fail the whole request
+        response = self.client.patch("/v1/bulk/person", json=[dict(id=200000, age=30),
+                                                              dict(id=200001, national_id="BATCH-2"),
+                                                              dict(id=200002, gender_id=1),
+                                                              dict(age=30)])
+        self.assertEqual(response.status_code, 400, response.json)
+        results = response.json["data"]["results"]
+        self.assertEqual(results[0]["message"], "Not updated due to other invalid records")
+        self.assertEqual(results[1]["errors"], ["unique_national_id"])
+        self.assertEqual(results[2]["message"], "Sorry Gender Doc is not active")
+        self.assertEqual(results[3]["message"], "Sorry id is required")
+        self.assertEqual(Person.query.get(200000).age, 20)
+
+        updates = [dict(id=200000, age=30), dict(id=200001, age=31), dict(id=200002, age=32, national_id="BATCH-2"),
+                   dict(id=200003, full_name="Batch Renamed"), dict(id=999999, age=30)]
+        with count_statements() as statements:
+            response = self.client.patch("/v1/bulk/person", json=updates)
+        self.assertEqual(response.status_code, 200, response.json)
+        self.assertEqual(response.json["data"]["updated"], 4)
+        self.assertEqual(response.json["data"]["not_found"], [999999])
+        self.assertEqual(len([statement for statement in statements if statement.startswith("UPDATE")]), 3,
+                         "A statement per updated column set")
+        self.assertEqual([Person.query.get(200000 + i).age for i in range(4)], [30, 31, 32, 20])
+        self.assertEqual(Person.query.get(200003).full_name, "Batch Renamed")
+        self.assertEqual([event_.action for event_ in bulk_audit_recorder.batches[-1]],
+                         ["log_success_update"] * 4 + ["log_failed_update"])
+
+        response = self.client.delete("/v1/bulk/person")
+        self.assertEqual(response.status_code, 400, "Deleting without filters is rejected")
+        response = self.client.delete("/v1/bulk/person?format=ndjson&page=2")
+        self.assertEqual(response.status_code, 400, "Non filter parameters aren't filters")
+
+        with count_statements() as statements:
+            response = self.client.delete("/v1/bulk/person?age=30&format=csv&page_size=2&ordering=id")
+        self.assertEqual(response.status_code, 200, response.json)
+        self.assertIn(200000, response.json["data"]["ids"])
+        self.assertNotIn(200001, response.json["data"]["ids"])
+        self.assertEqual(len([statement for statement in statements if statement.startswith("UPDATE")]), 1)
+        self.assertTrue(Person.query.get(200000).is_deleted)
+        self.assertEqual(bulk_audit_recorder.batches[-1][0].action, "log_success_deletion")
+
+        response = self.client.delete("/v1/bulk/person", json=dict(ids=[200000, 200001, 200002]))
+        self.assertEqual(response.json["data"]["ids"], [200001, 200002], "Deleted records are skipped")
+        self.assertTrue(Person.query.get(200001).is_deleted)
@@ -0,0 +1,103 @@
+# Copyright (C)  Authors and contributors All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+from unittest import TestCase
+
+from marshmallow import class_registry
+
+from flask_resource_chassis.introspection import get_model_metadata
+from flask_resource_chassis.metadata import get_resource_metadata
+from tests import flask_test_app, TestApiList, TestApi, PersonSchema, CountrySchema, Person, Gender, Country
+
+
+class TestResourceMetadata(TestCase):
+
+    def test_resource_list_reuses_metadata(self):
+        """
+        Tests that list resources share schemas and services across instances
+        """
+        first = TestApiList()
+        second = TestApiList()
+        self.assertIs(first.metadata, second.metadata)
+        self.assertIs(first.fetch_schema, second.fetch_schema)
+        self.assertIs(first.page_response_schema, second.page_response_schema)
+        self.assertIs(first.service, second.service)
+        self.assertIsNot(get_resource_metadata(PersonSchema), get_resource_metadata(CountrySchema))
+
+    def test_resource_reuses_metadata(self):
+        """
+        Tests that detail resources share response schemas across instances
+        """
+        first = TestApi()
+        second = TestApi()
+        self.assertIs(first.response_schema, second.response_schema)
+        self.assertIs(first.page_response_schema, second.page_response_schema)
+        self.assertIs(first.service, second.service)
+        self.assertIs(first.metadata, TestApiList().metadata)
+
+    def test_fetch_schema_fields(self):
+        """
+        Tests list query params exclude chassis managed columns
+        """
+        fetch_fields = get_resource_metadata(PersonSchema).fetch_schema.fields
+        for name in ("page", "page_size", "ordering", "q", "created_after", "updated_before", "full_name",
+                     "gender_id"):
+            self.assertIn(name, fetch_fields)
+        for name in ("id", "is_deleted", "created_at", "updated_at"):
+            self.assertNotIn(name, fetch_fields)
+        self.assertNotIn("created_after", get_resource_metadata(CountrySchema).fetch_schema.fields)
+
+    def test_class_registry_stable(self):
+        """
+        Tests detail and list requests don't register new marshmallow classes
+        """
+        client = flask_test_app.test_client()
+        headers = {"Authorization": "Bearer admin_token"}
+        client.get("/v1/country", headers=headers)
+        client.get("/v1/country/1", headers=headers)
+        registry_size = sum(len(classes) for classes in class_registry._registry.values())
+        # flask restful instantiates resources per request
+        for i in range(10000):
+            TestApiList()
+            TestApi()
+        for i in range(100):
+            client.get("/v1/country", headers=headers)
+            client.get("/v1/country/1", headers=headers)
+        self.assertEqual(sum(len(classes) for classes in class_registry._registry.values()), registry_size)
+
+
+class TestModelMetadata(TestCase):
+
+    def test_model_metadata(self):
+        """
+        Tests model introspection and memoization
+        """
+        metadata = get_model_metadata(Person)
+        self.assertIs(metadata, get_model_metadata(Person()))
+        self.assertEqual(metadata.primary_key.name, "id")
+        self.assertEqual({fk.column.name: fk.referred_table.name for fk in metadata.foreign_keys},
+                         {"gender_id": Gender.__tablename__, "location_id": "location"})
+        self.assertEqual([(index.name, [column.name for column in index.columns])
+                          for index in metadata.unique_indexes], [("unique_national_id", ["national_id"])])
+        self.assertTrue(metadata.soft_delete)
+        self.assertTrue(metadata.created_at)
+        self.assertTrue(metadata.updated_at)
+        self.assertFalse(metadata.is_active)
+        self.assertTrue(get_model_metadata(Gender).is_active)
+
+        metadata = get_model_metadata(Country)
+        self.assertFalse(metadata.soft_delete)
+        self.assertFalse(metadata.created_at)
+        self.assertEqual(metadata.foreign_keys, [])
+        self.assertEqual(metadata.unique_indexes, [])
@@ -12,17 +12,30 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 # ==============================================================================
-from unittest import TestCase
-from unittest.mock import patch
+import asyncio
+import json
+import threading
+import time
+from datetime import datetime
+from unittest import TestCase, skipIf
+from unittest.mock import patch, MagicMock
+from urllib.parse import parse_qs
 
 import requests
 
 from oauth_client import OAuth2Requests, SaslOauthTokenProvider
+from tests import IntrospectionStub
+
+try:
+    import httpx
+    from oauth_client.async_client import AsyncOAuth2Client
+except ImportError:
+    httpx = None
 
 
 class TestOAuth2Requests(TestCase):
 
-    @patch.object(requests, 'post')
+    @patch.object(requests.Session, 'post')
     def test_retrieve_token(self, requests_post):
         oauth2_requests = OAuth2Requests("test_client_id", "test_client_secret",
                                          "http://localhost:5002/oauth/token")
@@ -51,6 +64,90 @@ class TestOAuth2Requests(TestCase):
         oauth2_requests.retrieve_access_token()
         self.assertTrue(oauth2_requests.access_token.is_active(), "OAuth2Request active second test")
 
+    @patch.object(requests.Session, 'post')
+    def test_token_issued_at(self, requests_post):
+        requests_post.return_value = token_response()
+        oauth2_requests = OAuth2Requests("test_client_id", "test_client_secret", "http://localhost:5002/oauth/token")
+        oauth2_requests.retrieve_access_token()
+        elapsed = datetime.timestamp(datetime.utcnow()) - oauth2_requests.oauth_token.issued_at
+        self.assertAlmostEqual(elapsed, 2, delta=0.5, msg="Connection time allowance")
+
+    @patch.object(requests.Session, 'request')
+    @patch.object(requests.Session, 'post')
+    def test_proactive_refresh(self, requests_post, session_request):
+        requests_post.return_value = token_response(expires_in=100)
+        session_request.return_value = MagicMock(status_code=200)
+        oauth2_requests = OAuth2Requests("test_client_id", "test_client_secret", "http://localhost:5002/oauth/token",
+                                         refresh_ratio=0.8)
+        oauth2_requests.get("http://localhost:5003/v1/person")
+        self.assertEqual(requests_post.call_count, 1)
+        oauth2_requests.get("http://localhost:5003/v1/person")
+        self.assertEqual(requests_post.call_count, 1, "Token reused")
+
+        oauth2_requests.oauth_token.issued_at -= 85
+        requests_post.return_value = token_response(access_token="renewed_token", expires_in=100)
+        oauth2_requests.get("http://localhost:5003/v1/person")
+        self.assertEqual(requests_post.call_count, 2, "Token renewed before expiry")
+        self.assertEqual(session_request.call_args[1]["headers"]["Authorization"], "Bearer renewed_token")
+        self.assertEqual(session_request.call_count, 3, "No 401 retries")
+
+        oauth2_requests.oauth_token.issued_at -= 85
+        requests_post.return_value = MockRequestsResponse()
+        oauth2_requests.get("http://localhost:5003/v1/person")
+        self.assertEqual(session_request.call_args[1]["headers"]["Authorization"], "Bearer renewed_token",
+                         "Current token is used if renewal fails before expiry")
+
+    @patch.object(requests.Session, 'post')
+    def test_concurrent_refresh(self, requests_post):
+        def post(*args, **kwargs):
+            time.sleep(0.2)
+            return token_response()
+
+        requests_post.side_effect = post
+        oauth2_requests = OAuth2Requests("test_client_id", "test_client_secret", "http://localhost:5002/oauth/token")
+        tokens = []
+        threads = [threading.Thread(target=lambda: tokens.append(oauth2_requests.access_token)) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(requests_post.call_count, 1, "Concurrent callers share a single token request")
+        self.assertEqual(len(set(tokens)), 1)
+
+    @patch.object(requests.Session, 'post')
+    def test_background_refresh(self, requests_post):
+        requests_post.return_value = token_response(expires_in=100)
+        oauth2_requests = OAuth2Requests("test_client_id", "test_client_secret", "http://localhost:5002/oauth/token",
+                                         background_refresh=True)
+        token = oauth2_requests.access_token
+        token.issued_at -= 90
+        requests_post.side_effect = lambda *args, **kwargs: time.sleep(0.2) or token_response("renewed_token")
+        self.assertIs(oauth2_requests.access_token, token, "Current token used while renewing")
+        oauth2_requests._refresh_thread.join()
+        self.assertEqual(oauth2_requests.access_token.token, "renewed_token")
+        self.assertEqual(requests_post.call_count, 2)
+
+    def test_connection_pooling(self):
+        with IntrospectionStub() as stub:
+            oauth2_requests = OAuth2Requests("test_client_id", "test_client_secret", stub.url, pool_maxsize=5,
+                                             token_timeout=2)
+            for _ in range(3):
+                oauth2_requests.retrieve_access_token()
+            self.assertEqual(stub.requests, 3)
+            self.assertEqual(stub.connections, 1, "Token requests reuse connections")
+            self.assertEqual(oauth2_requests.get_adapter("http://localhost")._pool_maxsize, 5)
+            self.assertEqual(oauth2_requests.token_session.get_adapter(stub.url).max_retries.total, 2)
+
+            stub.status_code = 400
+            with self.assertLogs("oauth_client", "ERROR"):
+                self.assertRaises(Exception, oauth2_requests.retrieve_access_token)
+
+
+def token_response(access_token="test_token", expires_in=6000):
+    response = MockRequestsResponse()
+    response.set_response_dict(dict(access_token=access_token, expires_in=expires_in, scope=""))
+    return response
+
 
 class MockRequestsResponse:
 
@@ -89,9 +186,162 @@ class TestSaslOauthTokenProvider(TestCase):
     def test_extensions(self):
         self.assertIsNotNone(self.token_provider.extensions(), "Extensions test")
 
-    @patch.object(requests, 'post')
+    @patch.object(requests.Session, 'post')
     def test_token(self, requests_post):
         response = MockRequestsResponse()
         response.set_response_dict(dict(access_token="test_token", expires_in=6000, scope=""))
         requests_post.return_value = response
         self.assertEqual(self.token_provider.token(), "test_token", "Access token test")
+
+
+class DownstreamStub:
+    """
+    ASGI application serving oauth2 tokens and slow downstream resources
+    """
+
+    def __init__(self, delay=0.2, token_status=200, token_delay=0.05):
+        self.delay = delay
+        self.token_status = token_status
+        self.token_delay = token_delay
+        self.token_requests = 0
+        self.token_forms = []
+        self.revoked_tokens = set()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def __call__(self, scope, receive, send):
+        path = scope["path"]
+        headers = dict(scope["headers"])
+        if path == "/oauth/token":
+            self.token_requests += 1
+            self.token_forms.append(parse_qs((await receive())["body"].decode(), keep_blank_values=True))
+            await asyncio.sleep(self.token_delay)
+            if self.token_status == 200:
+                status, body = 200, dict(access_token=f"token{self.token_requests}", expires_in=100, scope="")
+            else:
+                status, body = self.token_status, dict(error="invalid_client")
+        elif headers.get(b"authorization", b"").decode()[7:] in self.revoked_tokens:
+            status, body = 401, dict(message="Invalid token")
+        else:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            await asyncio.sleep(self.delay)
+            self.in_flight -= 1
+            status, body = 200, dict(path=path, token=headers.get(b"authorization", b"").decode())
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": json.dumps(body).encode()})
+
+
+@skipIf(httpx is None, "httpx isn't installed")
+class TestAsyncOAuth2Client(TestCase):
+
+    def create_client(self, stub, **kwargs):
+        return AsyncOAuth2Client("test_client_id", "test_client_secret", "http://auth/oauth/token",
+                                 transport=httpx.ASGITransport(app=stub), **kwargs)
+
+    def test_gather(self):
+        """
+        Tests downstream calls run concurrently sharing a single token
+        """
+        stub = DownstreamStub()
+
+        async def fan_out():
+            async with self.create_client(stub) as client:
+                started = time.monotonic()
+                responses = await client.gather(*[("GET", f"http://service{i}/v1/resource") for i in range(10)],
+                                                ("POST", "http://service/v1/resource", dict(json=dict(name="test"))))
+                return responses, time.monotonic() - started
+
+        responses, elapsed = asyncio.run(fan_out())
+        self.assertEqual([response.status_code for response in responses], [200] * 11)
+        self.assertEqual(responses[3].json().get("path"), "/v1/resource")
+        self.assertEqual(stub.token_requests, 1, "Token shared across tasks")
+        self.assertEqual(stub.max_in_flight, 11)
+        self.assertLess(elapsed, 1, "Calls run concurrently")
+
+    def test_concurrency_limit(self):
+        """
+        Tests max_concurrency limits in flight requests
+        """
+        stub = DownstreamStub(delay=0.05)
+
+        async def fan_out():
+            async with self.create_client(stub, max_concurrency=3) as client:
+                return await client.gather(*[("GET", "http://service/v1/resource")] * 10)
+
+        self.assertEqual(len(asyncio.run(fan_out())), 10)
+        self.assertEqual(stub.max_in_flight, 3)
+
+    def test_token_refresh(self):
+        """
+        Tests proactive token renewal and revoked token retries
+        """
+        stub = DownstreamStub(delay=0)
+
+        async def requests_():
+            async with self.create_client(stub) as client:
+                self.assertEqual((await client.get("http://service/")).json().get("token"), "Bearer token1")
+                client.oauth_token.issued_at -= 90
+                self.assertEqual((await client.get("http://service/")).json().get("token"), "Bearer token1",
+                                 "Current token used while renewing")
+                await client._refresh_task
+                self.assertEqual((await client.get("http://service/")).json().get("token"), "Bearer token2")
+
+                stub.revoked_tokens.add("token2")
+                response = await client.get("http://service/")
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json().get("token"), "Bearer token3")
+
+                client.oauth_token.expires_in = -10
+                self.assertEqual((await client.get("http://service/")).json().get("token"), "Bearer token4")
+
+        asyncio.run(requests_())
+        self.assertEqual(stub.token_requests, 4)
+
+    def test_token_request(self):
+        """
+        Tests scope is only sent if set and failed token requests are logged
+        """
+        stub = DownstreamStub(delay=0)
+
+        async def retrieve_tokens():
+            async with self.create_client(stub) as client:
+                await client.retrieve_access_token()
+            async with self.create_client(stub, scopes="read write") as client:
+                await client.retrieve_access_token()
+
+        asyncio.run(retrieve_tokens())
+        self.assertEqual(stub.token_forms[0], dict(grant_type=["client_credentials"]), "Unset scope omitted")
+        self.assertEqual(stub.token_forms[1].get("scope"), ["read write"])
+
+        stub = DownstreamStub(token_status=401)
+
+        async def retrieve_token():
+            async with self.create_client(stub) as client:
+                await client.retrieve_access_token()
+
+        with self.assertLogs("oauth_client.async_client", level="ERROR") as logs:
+            self.assertRaises(Exception, asyncio.run, retrieve_token())
+        self.assertIn("Status 401", logs.output[0])
+
+    def test_aclose(self):
+        """
+        Tests closing the client cancels pending background token renewal
+        """
+        stub = DownstreamStub(delay=0)
+
+        async def close():
+            client = self.create_client(stub)
+            await client.retrieve_access_token()
+            stub.token_delay = 10
+            client.oauth_token.issued_at -= 90
+            await client.get_token()
+            refresh_task = client._refresh_task
+            await asyncio.sleep(0)
+            await client.aclose()
+            return refresh_task.cancelled()
+
+        started = time.monotonic()
+        self.assertTrue(asyncio.run(close()), "Pending renewal cancelled")
+        self.assertLess(time.monotonic() - started, 5, "Close doesn't wait for renewal")
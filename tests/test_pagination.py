@@ -0,0 +1,78 @@
+# Copyright (C)  Authors and contributors All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import json
+from datetime import datetime
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from sqlalchemy.dialects.postgresql import psycopg2
+from sqlalchemy.orm import Query
+
+from flask_resource_chassis.pagination import estimate_count, Explain
+from tests import flask_test_app, Person
+
+
+class TestPostgresEstimateCount(TestCase):
+    """
+    Tests estimate_count() PostgreSQL statistics queries using a mocked PostgreSQL session
+    """
+
+    def setUp(self):
+        self.context = flask_test_app.app_context()
+        self.context.push()
+        self.session = MagicMock()
+        self.session.get_bind.return_value.dialect = psycopg2.dialect()
+
+    def tearDown(self):
+        self.context.pop()
+
+    def test_unfiltered_estimate(self):
+        """
+        Tests unfiltered queries use pg_class.reltuples
+        """
+        self.session.execute.return_value.scalar.return_value = 1234.0
+        self.assertEqual(estimate_count(Person.query.with_session(self.session)), 1234)
+        statement, params = self.session.execute.call_args[0]
+        self.assertIn("SELECT reltuples FROM pg_class", str(statement))
+        self.assertEqual(params, {"table": "person"})
+        self.session.connection.assert_not_called()
+
+    def test_filtered_estimate(self):
+        """
+        Tests filtered queries use EXPLAIN planner row estimate
+        """
+        self.session.execute.return_value.scalar.return_value = json.dumps([{"Plan": {"Plan Rows": 42}}])
+        query = Person.query.with_session(self.session).filter(Person.created_at > datetime(2020, 1, 1)) \
+            .order_by(Person.id)
+        self.assertEqual(estimate_count(query), 42)
+        statement = self.session.execute.call_args[0][0]
+        self.assertIsInstance(statement, Explain, "Executed like other statements hence bind processors are applied")
+        compiled = statement.compile(dialect=psycopg2.dialect())
+        self.assertTrue(str(compiled).startswith("EXPLAIN (FORMAT JSON) SELECT"))
+        self.assertNotIn("ORDER BY", str(compiled))
+        self.assertIn(datetime(2020, 1, 1), compiled.params.values())
+
+        # Some drivers return the plan already decoded
+        self.session.execute.return_value.scalar.return_value = [{"Plan": {"Plan Rows": 7}}]
+        self.assertEqual(estimate_count(query), 7)
+
+    def test_missing_statistics(self):
+        """
+        Tests tables which have never been analyzed fall back to an exact count
+        """
+        self.session.execute.return_value.scalar.return_value = -1
+        with patch.object(Query, "count", return_value=3) as count:
+            self.assertEqual(estimate_count(Person.query.with_session(self.session)), 3)
+            count.assert_called_once()
@@ -0,0 +1,124 @@
+# Copyright (C)  Authors and contributors All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+from unittest import TestCase
+
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateIndex
+
+from flask_resource_chassis import ChassisResourceList
+from flask_resource_chassis.introspection import get_model_metadata
+from flask_resource_chassis.search import PostgresFullTextSearchBackend, TrigramSearchBackend, LikeSearchBackend
+from tests import flask_test_app, db, Person, PersonSchema
+
+
+class TestSqliteFtsSearch(TestCase):
+
+    def setUp(self):
+        self.client = flask_test_app.test_client()
+
+    def test_search(self):
+        """
+        Tests FTS5 search matching term prefixes and ranking results
+        """
+        db.session.add(Person(full_name="Zebra Searcher", gender_id=2, national_id="S-1001"))
+        db.session.add(Person(full_name="Zebra Zebra Searcher", gender_id=2, national_id="S-1002"))
+        db.session.add(Person(full_name="Another Person", gender_id=2, national_id="S-1003"))
+        db.session.commit()
+
+        response = self.client.get("/v1/search/person?q=zebra")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json.get("count"), 2)
+        self.assertEqual(response.json.get("results")[0].get("full_name"), "Zebra Zebra Searcher", "Ranked results")
+
+        response = self.client.get("/v1/search/person?q=zeb%20search")
+        self.assertEqual(response.json.get("count"), 2, "Prefix search")
+        response = self.client.get("/v1/search/person?q=zebra&ordering=national_id")
+        self.assertEqual(response.json.get("results")[0].get("national_id"), "S-1001", "Explicit ordering")
+        response = self.client.get('/v1/search/person?q="AND%20(')
+        self.assertEqual(response.status_code, 200, "FTS5 query syntax is escaped")
+        self.assertEqual(response.json.get("count"), 0)
+
+        person = Person.query.filter_by(national_id="S-1003").first()
+        person.full_name = "Zebra Renamed"
+        db.session.commit()
+        response = self.client.get("/v1/search/person?q=zebra")
+        self.assertEqual(response.json.get("count"), 3, "FTS table updated by triggers")
+
+
+class TestPostgresSearch(TestCase):
+
+    def compile(self, query):
+        return str(query.statement.compile(dialect=postgresql.dialect()))
+
+    def test_full_text_search(self):
+        """
+        Tests PostgreSQL full text search query matches the GIN index expression
+        """
+        backend = PostgresFullTextSearchBackend()
+        metadata = get_model_metadata(Person)
+        columns = [Person.__table__.c.full_name, Person.__table__.c.national_id]
+        query, ordering = backend.search(Person.query, metadata, columns, "test")
+        sql = self.compile(query.order_by(ordering))
+        document = "to_tsvector('english'::regconfig, (coalesce(person.full_name, '') || ' ') || " \
+                   "coalesce(person.national_id, ''))"
+        self.assertIn(f"{document} @@ plainto_tsquery('english'::regconfig", sql)
+        self.assertIn("ORDER BY ts_rank(", sql)
+        index = backend.build_index("person_search_idx", *columns)
+        self.assertIn(f"USING gin ({document.replace('person.', '')})",
+                      str(CreateIndex(index).compile(dialect=postgresql.dialect())))
+
+    def test_trigram_search(self):
+        """
+        Tests trigram search query and index
+        """
+        metadata = get_model_metadata(Person)
+        query, ordering = TrigramSearchBackend().search(Person.query, metadata, [Person.__table__.c.full_name], "es")
+        sql = self.compile(query.order_by(ordering))
+        self.assertIn("person.full_name ILIKE", sql)
+        self.assertIn("ORDER BY similarity(person.full_name", sql)
+        index = TrigramSearchBackend.build_index("person_name_trgm_idx", Person.__table__.c.full_name)
+        self.assertIn("USING gin (full_name gin_trgm_ops)",
+                      str(CreateIndex(index).compile(dialect=postgresql.dialect())))
+
+
+class TestSearchColumns(TestCase):
+
+    def setUp(self):
+        self.client = flask_test_app.test_client()
+
+    def test_default_columns(self):
+        """
+        Tests LIKE search covers all columns while indexed backends default to text columns
+        """
+        metadata = get_model_metadata(Person)
+        self.assertEqual(LikeSearchBackend().get_default_columns(metadata), list(Person.__table__.c))
+        self.assertEqual(TrigramSearchBackend().get_default_columns(metadata),
+                         [Person.__table__.c.full_name, Person.__table__.c.national_id])
+
+        person = Person(full_name="Like Searcher", gender_id=2, age=987654)
+        db.session.add(person)
+        db.session.commit()
+        response = self.client.get("/v1/person?q=987654", headers={"Authorization": "Bearer admin_token"})
+        self.assertEqual([record["id"] for record in response.json["results"]], [person.id],
+                         "Non text columns are searched")
+
+    def test_unknown_search_fields(self):
+        """
+        Tests unknown search fields are rejected when the resource is created
+        """
+        with flask_test_app.test_request_context():
+            with self.assertRaises(ValueError) as context:
+                ChassisResourceList(flask_test_app, db, PersonSchema, search_fields=["full_name", "fullname"])
+        self.assertIn("fullname", str(context.exception))
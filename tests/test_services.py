@@ -1,11 +1,17 @@
 from datetime import datetime
 from unittest import TestCase
+from unittest.mock import MagicMock, patch
 
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy, Model
 from sqlalchemy import Integer, String, Column, func
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import psycopg2
 
-from flask_resource_chassis import ChassisService, ValidationError
+from flask_resource_chassis import ValidationError
+from flask_resource_chassis.services import ChassisService, supports_update_returning, \
+    supports_insert_executemany_returning
+from tests import count_statements
 
 
 class Test(Model):
@@ -61,6 +67,23 @@ class TestChassisService(TestCase):
         self.assertEqual(gender3.is_active, gender2.is_active)
         self.assertEqual(gender3.created_at, gender.created_at)
 
+    def test_update_statements(self):
+        """
+        Test ChassisService update() doesn't check record existence with a separate query
+        """
+        self.assertTrue(supports_update_returning(postgresql.dialect()))
+        gender_id = self.service.create(self.Gender(gender="Female")).id
+        with count_statements(self.db.engine) as statements:
+            record = self.service.update(self.Gender(gender="Male"), gender_id)
+        self.assertEqual(record.gender, "Male")
+        self.assertTrue(statements[0].startswith("UPDATE"))
+        if supports_update_returning(self.db.engine.dialect):
+            self.assertEqual(len(statements), 1)
+        else:
+            self.assertEqual(len(statements), 2)
+        self.service.delete(gender_id)
+        self.assertRaises(ValidationError, self.service.update, self.Gender(gender="Male"), gender_id)
+
     def test_delete(self):
         """
         Test ChassisService delete() method
@@ -72,5 +95,51 @@ class TestChassisService(TestCase):
         gender = self.Gender.query.filter_by(id=gender.id).first()
         self.assertTrue(gender.is_deleted)
 
+    def test_delete_statements(self):
+        """
+        Test ChassisService delete() uses a single statement without loading the record
+        """
+        gender_id = self.service.create(self.Gender(gender="Female")).id
+        with count_statements(self.db.engine) as statements:
+            self.service.delete(gender_id)
+        self.assertEqual(len(statements), 1)
+        self.assertTrue(statements[0].startswith("UPDATE"))
+        self.assertRaises(ValidationError, self.service.delete, gender_id)
+        self.assertRaises(ValidationError, self.service.delete, -1)
+        self.assertTrue(self.Gender.query.filter_by(id=gender_id).first().is_deleted)
+
+        class Country(self.db.Model):
+            id = self.db.Column(self.db.Integer, primary_key=True)
+            name = self.db.Column(self.db.String(254), nullable=False)
 
+        self.db.create_all()
+        service = ChassisService(self.app, self.db, Country)
+        country_id = service.create(Country(name="Kenya")).id
+        with count_statements(self.db.engine) as statements:
+            service.delete(country_id)
+        self.assertEqual(len(statements), 1)
+        self.assertTrue(statements[0].startswith("DELETE"))
+        self.assertRaises(ValidationError, service.delete, country_id)
 
+    def test_bulk_create_returning(self):
+        """
+        Tests database generated primary keys are fetched using a single executemany INSERT ... RETURNING on
+        dialects supporting it
+        """
+        self.assertFalse(supports_insert_executemany_returning(self.db.engine.dialect))
+        genders = [self.Gender(gender="Male"), self.Gender(gender="Female", is_active=False),
+                   self.Gender(gender="Other")]
+        session = MagicMock()
+        session.return_value.get_bind.return_value.dialect = psycopg2.dialect()
+        session.execute.side_effect = [MagicMock(all=MagicMock(return_value=[(1,), (3,)])),
+                                       MagicMock(all=MagicMock(return_value=[(2,)]))]
+        created = [self.Gender(id=i) for i in (3, 1, 2)]
+        session.query.return_value.filter.return_value = iter(created)
+        with patch.object(self.db, "session", session):
+            records = self.service.bulk_create(genders)
+        self.assertEqual([record.id for record in records], [1, 2, 3], "Created records follow the entities order")
+        self.assertEqual(session.execute.call_count, 2, "An INSERT per group of provided columns")
+        statement, rows = session.execute.call_args_list[0][0]
+        self.assertIn("RETURNING gender.id", str(statement.compile(dialect=psycopg2.dialect())))
+        self.assertEqual(rows, [dict(gender="Male"), dict(gender="Other")])
+        session.add_all.assert_not_called()
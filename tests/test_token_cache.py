@@ -0,0 +1,170 @@
+# Copyright (C)  Authors and contributors All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import os
+import socketserver
+import tempfile
+import threading
+import time
+from unittest import TestCase
+
+from flask_resource_chassis.token_cache import SqliteTokenCache, RedisTokenCache, MemoryTokenCache, TokenCache
+
+
+class FakeRedisServer:
+    """
+    Local server implementing the Redis protocol commands used by RedisTokenCache
+    """
+
+    def __init__(self, password=None):
+        self.data = {}
+        self.commands = []
+        self.connections = 0
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+
+            def read_command(self):
+                line = self.rfile.readline()
+                if not line:
+                    return None
+                args = []
+                for _ in range(int(line[1:])):
+                    length = int(self.rfile.readline()[1:])
+                    args.append(self.rfile.read(length + 2)[:-2])
+                return args
+
+            def handle(self):
+                server.connections += 1
+                authenticated = password is None
+                while True:
+                    args = self.read_command()
+                    if args is None:
+                        return
+                    command = args[0].decode().upper()
+                    server.commands.append(command)
+                    if command == "AUTH":
+                        authenticated = args[1].decode() == password
+                        self.wfile.write(b"+OK\r\n" if authenticated else b"-ERR invalid password\r\n")
+                    elif not authenticated:
+                        self.wfile.write(b"-NOAUTH Authentication required.\r\n")
+                    elif command == "SELECT":
+                        self.wfile.write(b"+OK\r\n")
+                    elif command == "SET":
+                        expires_at = time.time() + int(args[4]) / 1000 if len(args) > 4 else None
+                        server.data[args[1]] = (args[2], expires_at)
+                        self.wfile.write(b"+OK\r\n")
+                    elif command == "GET":
+                        value, expires_at = server.data.get(args[1], (None, None))
+                        if value is None or (expires_at and expires_at <= time.time()):
+                            self.wfile.write(b"$-1\r\n")
+                        else:
+                            self.wfile.write(b"$%d\r\n%s\r\n" % (len(value), value))
+                    else:
+                        self.wfile.write(b"-ERR unknown command\r\n")
+
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestTokenCache(TestCase):
+
+    def test_serialization(self):
+        """
+        Tests cached payloads are stored as compact JSON
+        """
+        payload = dict(active=True, user_id="user1", authorities=["can_create", "can_update"], exp=1700000000)
+        data = TokenCache.serialize(payload)
+        self.assertNotIn(b" ", data)
+        self.assertEqual(TokenCache.deserialize(data), payload)
+
+    def test_sqlite_cache(self):
+        """
+        Tests cached tokens are shared by caches using the same database file i.e. gunicorn workers
+        """
+        database_file, path = tempfile.mkstemp(suffix=".sqlite3")
+        os.close(database_file)
+        try:
+            worker1 = SqliteTokenCache(path, ttl=60, purge_interval=3)
+            worker2 = SqliteTokenCache(path, ttl=60)
+            worker1.set_token("token1", dict(active=True, user_id="user1"))
+            self.assertEqual(worker2.get_token("token1"), dict(active=True, user_id="user1"))
+            self.assertIsNone(worker2.get_token("token2"))
+            self.assertEqual(worker2.stats(), dict(hits=1, misses=1))
+
+            worker1.set("expired", dict(active=True), 0.01)
+            time.sleep(0.02)
+            self.assertIsNone(worker2.get("expired"))
+            worker1.set_token("token2", dict(active=True, user_id="user2"))
+            count = worker1._connection().execute("SELECT COUNT(*) FROM token_cache").fetchone()[0]
+            self.assertEqual(count, 2, "Expired tokens purged")
+
+            results = []
+            threads = [threading.Thread(target=lambda: results.append(worker2.get_token("token1")))
+                       for _ in range(10)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(len([result for result in results if result]), 10)
+        finally:
+            os.remove(path)
+
+    def test_redis_cache(self):
+        """
+        Tests tokens are cached using the Redis protocol with kept alive connections
+        """
+        with FakeRedisServer(password="secret") as server:
+            cache = RedisTokenCache.from_url(f"redis://:secret@127.0.0.1:{server.port}/2", ttl=60)
+            other_worker = RedisTokenCache("127.0.0.1", server.port, db=2, password="secret")
+            cache.set_token("token1", dict(active=True, user_id="user1", exp=time.time() + 3600))
+            self.assertEqual(other_worker.get_token("token1").get("user_id"), "user1")
+            self.assertIsNone(cache.get_token("token2"))
+            self.assertEqual(server.connections, 2, "Connections are reused")
+            self.assertEqual(server.commands.count("SELECT"), 2)
+
+            cache.set_token("inactive", dict(active=False))
+            key = (cache.prefix + TokenCache.get_key("inactive")).encode()
+            self.assertAlmostEqual(server.data[key][1] - time.time(), 30, delta=1, msg="negative_ttl")
+
+            cache.set("expiring", dict(active=True), 0.05)
+            time.sleep(0.1)
+            self.assertIsNone(cache.get("expiring"))
+
+            # Server side closed connections are reconnected
+            server.server.shutdown()
+            cache._local.socket.shutdown(2)
+        self.assertIsNone(cache.get_token("token1"), "Unavailable server is treated as a cache miss")
+
+        with FakeRedisServer(password="secret") as server:
+            cache = RedisTokenCache("127.0.0.1", server.port, password="wrong")
+            self.assertIsNone(cache.get_token("token1"))
+
+    def test_memory_cache(self):
+        """
+        Tests memory cache stores payloads without serialization
+        """
+        cache = MemoryTokenCache()
+        payload = dict(active=True)
+        cache.set_token("token1", payload)
+        self.assertIs(cache.get_token("token1"), payload)
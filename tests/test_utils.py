@@ -13,12 +13,24 @@
 # limitations under the License.
 # ==============================================================================
 import base64
+import json
+import os
+import tempfile
+import threading
+import time
 from unittest import TestCase
-from unittest.mock import patch
+from unittest.mock import patch, MagicMock
 
 import requests
+from authlib.jose import JsonWebKey, jwt
+from authlib.oauth2.rfc6750 import InsufficientScopeError
 
-from flask_resource_chassis.utils import get_kafka_hosts
+from flask_resource_chassis import authenticate, Scope, _get_authenticator
+from flask_resource_chassis.exceptions import AccessDeniedError
+from flask_resource_chassis.token_cache import MemoryTokenCache
+from flask_resource_chassis.utils import get_kafka_hosts, DefaultRemoteTokenValidator, JwtTokenValidator, \
+    CustomResourceProtector, RemoteToken
+from tests import flask_test_app, resource_protector, IntrospectionStub
 
 
 class MessageServiceTests(TestCase):
@@ -37,4 +49,253 @@ class MessageServiceTests(TestCase):
 
         requests_get.return_value = ReturnValue()
         response = get_kafka_hosts()
-        self.assertEqual(len(response), 2, "Messaging service get hosts verification test")
\ No newline at end of file
+        self.assertEqual(len(response), 2, "Messaging service get hosts verification test")
+
+
+def introspection_response(payload, status_code=200):
+    response = MagicMock()
+    response.ok = 200 <= status_code < 300
+    response.status_code = status_code
+    response.json.return_value = payload
+    return response
+
+
+class TestDefaultRemoteTokenValidator(TestCase):
+
+    def setUp(self):
+        self.cache = MemoryTokenCache(max_size=2, ttl=60, negative_ttl=30)
+        self.validator = DefaultRemoteTokenValidator("http://localhost:5002/oauth/check_token", "client_id",
+                                                     "client_secret", token_cache=self.cache)
+
+    def test_token_cache(self):
+        """
+        Tests introspection responses are cached, negative cached and evicted
+        """
+        with patch.object(self.validator.session, 'post') as requests_post:
+            self.assert_token_cache(requests_post)
+
+    def assert_token_cache(self, requests_post):
+        requests_post.return_value = introspection_response(dict(active=True, user_id="user1",
+                                                                 exp=time.time() + 3600))
+        self.assertEqual(self.validator.authenticate_token("token1").get_user_id(), "user1")
+        self.assertEqual(self.validator.authenticate_token("token1").get_user_id(), "user1")
+        self.assertEqual(requests_post.call_count, 1)
+        self.assertEqual(self.cache.stats().get("hits"), 1)
+        self.assertEqual(self.cache.stats().get("misses"), 1)
+
+        requests_post.return_value = introspection_response(dict(active=False))
+        self.assertTrue(self.validator.authenticate_token("invalid").is_revoked())
+        self.assertTrue(self.validator.authenticate_token("invalid").is_revoked())
+        self.assertEqual(requests_post.call_count, 2, "Negative caching")
+
+        requests_post.return_value = introspection_response(dict(error="server error"), 500)
+        self.assertIsNone(self.validator.authenticate_token("token2"))
+        self.assertIsNone(self.validator.authenticate_token("token2"))
+        self.assertEqual(requests_post.call_count, 4, "Failed introspection isn't cached")
+
+        requests_post.return_value = introspection_response(dict(active=True, user_id="user3"))
+        self.validator.authenticate_token("token3")
+        self.assertEqual(self.cache.stats().get("evictions"), 1)
+        self.assertIsNone(self.cache.get_token("token1"), "Least recently used token evicted")
+
+        requests_post.return_value = introspection_response(dict(error="invalid_token"), 400)
+        self.assertTrue(self.validator.authenticate_token("rejected").is_revoked())
+        self.assertTrue(self.validator.authenticate_token("rejected").is_revoked())
+        self.assertEqual(requests_post.call_count, 6, "Rejected tokens are negative cached")
+
+        for status_code in (401, 429):
+            requests_post.return_value = introspection_response(dict(error="error"), status_code)
+            self.assertIsNone(self.validator.authenticate_token(f"token{status_code}"))
+            self.assertIsNone(self.validator.authenticate_token(f"token{status_code}"))
+        self.assertEqual(requests_post.call_count, 10, "Client authentication and rate limit errors aren't cached")
+
+    def test_connection_reuse(self):
+        """
+        Tests introspection requests reuse kept alive connections
+        """
+        with IntrospectionStub() as stub:
+            validator = DefaultRemoteTokenValidator(stub.url, "client_id", "client_secret")
+            for index in range(5):
+                self.assertEqual(validator.authenticate_token(f"token{index}").get_user_id(), "user1")
+            self.assertEqual(stub.requests, 5)
+            self.assertEqual(stub.connections, 1)
+            self.assertEqual(stub.authorization, "Basic " + base64.b64encode(b"client_id:client_secret").decode())
+
+    def test_concurrent_introspection(self):
+        """
+        Tests concurrent requests with the same token share a single introspection call
+        """
+        with IntrospectionStub() as stub:
+            stub.delay = 0.5
+            validator = DefaultRemoteTokenValidator(stub.url, "client_id", "client_secret")
+            barrier = threading.Barrier(100)
+            tokens = []
+
+            def authenticate_token():
+                barrier.wait()
+                tokens.append(validator.authenticate_token("token"))
+
+            threads = [threading.Thread(target=authenticate_token) for _ in range(100)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(stub.requests, 1)
+            self.assertEqual(len(tokens), 100)
+            self.assertTrue(all(token.get_user_id() == "user1" for token in tokens))
+            self.assertEqual(validator.single_flight._calls, {})
+
+    def test_circuit_breaker(self):
+        """
+        Tests introspection fails fast while the authorization server is unhealthy
+        """
+        with IntrospectionStub() as stub:
+            validator = DefaultRemoteTokenValidator(stub.url, "client_id", "client_secret", token_cache=self.cache,
+                                                    retries=0, failure_threshold=3, recovery_timeout=0.2)
+            self.assertIsNotNone(validator.authenticate_token("cached"))
+            stub.status_code = 503
+            for index in range(5):
+                self.assertIsNone(validator.authenticate_token(f"token{index}"))
+            self.assertEqual(stub.requests, 4, "Circuit opened after 3 failures")
+            self.assertIsNotNone(validator.authenticate_token("cached"), "Cached tokens are still served")
+
+            time.sleep(0.25)
+            stub.status_code = 200
+            self.assertIsNotNone(validator.authenticate_token("token5"), "Circuit closed after a successful trial")
+            self.assertIsNotNone(validator.authenticate_token("token6"))
+            self.assertEqual(stub.requests, 6)
+
+        validator = DefaultRemoteTokenValidator("http://127.0.0.1:9/oauth/check_token", "client_id", "client_secret",
+                                                retries=0, timeout=0.5, failure_threshold=1)
+        self.assertIsNone(validator.authenticate_token("token"), "Connection errors")
+        self.assertFalse(validator.circuit_breaker.allow_request())
+
+    def test_token_expiry(self):
+        """
+        Tests cached tokens expire at the earliest of exp and ttl
+        """
+        self.cache.set_token("expired", dict(active=True, exp=time.time() - 1))
+        self.assertIsNone(self.cache.get_token("expired"))
+        self.cache.set_token("expiring", dict(active=True, exp=time.time() + 0.05))
+        self.assertIsNotNone(self.cache.get_token("expiring"))
+        self.assertNotIn("expiring", self.cache._entries, "Tokens are stored hashed")
+        time.sleep(0.1)
+        self.assertIsNone(self.cache.get_token("expiring"))
+
+
+class TestJwtTokenValidator(TestCase):
+
+    def setUp(self):
+        self.keys = {kid: JsonWebKey.generate_key("RSA", 2048, is_private=True) for kid in ("key1", "key2")}
+        jwks_file, self.jwks_path = tempfile.mkstemp(suffix=".json")
+        os.close(jwks_file)
+        self.write_jwks("key1")
+        self.validator = JwtTokenValidator(f"file://{self.jwks_path}", audience="resource-server", leeway=5,
+                                           refresh_interval=0)
+
+    def tearDown(self):
+        os.remove(self.jwks_path)
+
+    def write_jwks(self, *kids):
+        keys = []
+        for kid in kids:
+            public_key = JsonWebKey.import_key(self.keys[kid].get_public_key(), {"kty": "RSA"}).as_dict()
+            public_key.update(kid=kid, use="sig", alg="RS256")
+            keys.append(public_key)
+        with open(self.jwks_path, "w") as jwks_file:
+            json.dump({"keys": keys}, jwks_file)
+
+    def sign(self, kid="key1", **claims):
+        payload = dict(aud="resource-server", iat=int(time.time()), exp=int(time.time()) + 300, user_id="user1",
+                       client_id="client1", authorities=["ADD_PERSON"], scope=["read", "write"])
+        payload.update(claims)
+        return jwt.encode({"alg": "RS256", "kid": kid}, payload, self.keys[kid]).decode()
+
+    def test_token_verification(self):
+        """
+        Tests signature and claims verification
+        """
+        token = self.validator.authenticate_token(self.sign())
+        self.assertEqual(token.get_user_id(), "user1")
+        self.assertEqual(token.get_client_id(), "client1")
+        self.assertEqual(token.get_authorities(), ["ADD_PERSON"])
+        self.assertEqual(token.get_scope(), "read write")
+        self.assertFalse(token.is_revoked())
+
+        self.assertIsNone(self.validator.authenticate_token(self.sign(aud="other")), "Invalid audience")
+        self.assertIsNone(self.validator.authenticate_token(self.sign(exp=int(time.time()) - 60)), "Expired")
+        self.assertIsNotNone(self.validator.authenticate_token(self.sign(exp=int(time.time()) - 2)), "Leeway")
+        self.assertIsNone(self.validator.authenticate_token(self.sign(iat=int(time.time()) + 60)), "Future iat")
+        tampered = self.sign().split(".")
+        tampered[1] = self.sign(user_id="admin").split(".")[1]
+        self.assertIsNone(self.validator.authenticate_token(".".join(tampered)), "Invalid signature")
+        self.assertIsNone(self.validator.authenticate_token("invalid token"))
+
+    def test_key_rotation(self):
+        """
+        Tests keys are refreshed when a token has an unknown kid
+        """
+        self.assertIsNotNone(self.validator.authenticate_token(self.sign("key1")))
+        self.assertIsNone(self.validator.authenticate_token(self.sign("key2")), "Unknown key")
+        self.write_jwks("key1", "key2")
+        self.assertIsNotNone(self.validator.authenticate_token(self.sign("key2")), "Keys refreshed")
+
+        self.validator.refresh_interval = 60
+        self.write_jwks("key1")
+        self.assertIsNotNone(self.validator.authenticate_token(self.sign("key2")),
+                             "Keys aren't refreshed more than once per refresh_interval")
+        self.validator.jwks_ttl = 0
+        self.validator.refresh_interval = 0
+        self.validator.authenticate_token(self.sign("key1"))
+        self.validator._refresh_thread.join()
+        self.assertIsNone(self.validator.authenticate_token(self.sign("key2")), "Stale keys refreshed")
+
+
+class TestCustomResourceProtector(TestCase):
+
+    def test_request_token_memoization(self):
+        """
+        Tests tokens are validated once per request while scope and permissions are checked on every call
+        """
+        validator = resource_protector._token_validators["bearer"]
+        with patch.object(validator, "authenticate_token", wraps=validator.authenticate_token) as authenticate_token:
+            with flask_test_app.test_request_context(headers={"Authorization": "Bearer admin_token"}):
+                token = authenticate(resource_protector, Scope(scopes="create"), ["can_create"])
+                self.assertIs(authenticate(resource_protector, Scope(scopes="update delete")), token)
+                self.assertIs(authenticate(resource_protector, None, ["can_delete"]), token)
+                self.assertRaises(InsufficientScopeError, authenticate, resource_protector, Scope(scopes="admin"))
+                self.assertEqual(authenticate_token.call_count, 1)
+            with flask_test_app.test_request_context(headers={"Authorization": "Bearer admin_token"}):
+                authenticate(resource_protector, Scope(scopes="create"), ["can_create"])
+                self.assertEqual(authenticate_token.call_count, 2, "Tokens aren't shared across requests")
+
+    def test_authenticator_cache(self):
+        """
+        Tests authentication decorators are reused
+        """
+        authenticator = _get_authenticator(resource_protector, "create", "AND", ("can_create",))
+        self.assertIs(_get_authenticator(resource_protector, "create", "AND", ("can_create",)), authenticator)
+        self.assertIsNot(_get_authenticator(resource_protector, "create", "OR", ("can_create",)), authenticator)
+
+    def test_set_based_checks(self):
+        """
+        Tests scopes and authorities are checked using precompiled sets
+        """
+        token = RemoteToken(dict(active=True, scope="read write", authorities=[f"perm{i}" for i in range(500)]))
+        self.assertIs(token.get_authority_set(), token.get_authority_set(), "Authorities parsed once")
+        self.assertIs(token.get_scope_set(), token.get_scope_set(), "Scopes parsed once")
+        self.assertEqual(token.get_scope_set(), frozenset(["read", "write"]))
+        compile_scope = CustomResourceProtector.compile_scope
+        self.assertIsNone(compile_scope(""))
+        self.assertEqual(compile_scope(["read", "write"]), frozenset(["read", "write"]))
+        self.assertFalse(CustomResourceProtector.scope_insufficient(token, compile_scope("read write"), "AND"))
+        self.assertTrue(CustomResourceProtector.scope_insufficient(token, compile_scope("read admin"), "AND"))
+        self.assertFalse(CustomResourceProtector.scope_insufficient(token, compile_scope("read admin"), "OR"))
+        self.assertFalse(CustomResourceProtector.scope_insufficient(token, None, "AND"))
+
+        protected = resource_protector(scope="create", has_any_authority=["missing", "can_update"])(lambda token: token)
+        with flask_test_app.test_request_context(headers={"Authorization": "Bearer admin_token"}):
+            self.assertEqual(protected().get_user_id(), "26957b74-47d0-40df-96a1-f104f3828552")
+        protected = resource_protector(has_any_authority=["missing"])(lambda token: token)
+        with flask_test_app.test_request_context(headers={"Authorization": "Bearer admin_token"}):
+            self.assertRaises(AccessDeniedError, protected)